@@ -354,6 +354,19 @@ class EvaluateCVAdapter(ToolAdapter):
         if not cv_text:
             return {"success": False, "output": None, "error": "Falta el argumento 'cv_text'."}
 
+        try:
+            respuesta = self.evaluate(cv_text, context)
+
+            # Guardar CV y evaluación en la base de conocimiento
+            if self.kb and respuesta:
+                self._persist_cv(cv_text, respuesta, user_id)
+
+            return {"success": True, "output": respuesta, "error": None}
+        except Exception as e:
+            return {"success": False, "output": None, "error": str(e)}
+
+    def evaluate(self, cv_text: str, context: str = "") -> str:
+        """Pide al LLM la evaluación de RH del CV (sin guardar nada)."""
         prompt = f"""Eres un experto de Recursos Humanos de Axoloit, una startup mexicana de tecnología.
 
 INSTRUCCIONES:
@@ -376,16 +389,7 @@ RESPONDE CON:
 
 Sé directo, honesto y usa español mexicano natural. Si el CV tiene áreas débiles, dilo sin rodeos."""
 
-        try:
-            respuesta = self.ai_query_fn(prompt, 0.5, 2000)
-
-            # Guardar CV y evaluación en la base de conocimiento
-            if self.kb and respuesta:
-                self._persist_cv(cv_text, respuesta, user_id)
-
-            return {"success": True, "output": respuesta, "error": None}
-        except Exception as e:
-            return {"success": False, "output": None, "error": str(e)}
+        return self.ai_query_fn(prompt, 0.5, 2000)
 
     def _persist_cv(self, cv_text: str, evaluation: str, user_id: str):
         """Extrae nombre del candidato y guarda CV + persona en la KB."""
@@ -458,6 +462,54 @@ Sé directo, honesto y usa español mexicano natural. Si el CV tiene áreas déb
         return data
 
 
+class BatchEvaluateCVsAdapter(ToolAdapter):
+    """Evalúa muchos CVs guardados a la vez (JSON estricto, en paralelo entre proveedores)."""
+
+    name = "evaluate_cvs_batch"
+    description = (
+        "Evaluate MANY stored CVs at once (parallel across AI providers, structured scores) and save "
+        "name/skills/level/verdict/score to the knowledge database. "
+        "Args: 'doc_ids' (list of document ids) OR 'pending' (true = CVs without evaluation), "
+        "'context' (optional job/company needs), 'limit' (default 50), 'user_id'."
+    )
+    requires_approval = False
+    MAX_DOCS = 50
+
+    def __init__(self, knowledge_base, evaluator):
+        self.kb = knowledge_base
+        self.evaluator = evaluator
+
+    def execute(self, args: dict) -> dict:
+        limit = min(int(args.get("limit", self.MAX_DOCS) or self.MAX_DOCS), self.MAX_DOCS)
+        doc_ids = args.get("doc_ids") or []
+        if isinstance(doc_ids, (int, str)):
+            doc_ids = [doc_ids]
+        try:
+            doc_ids = [int(d) for d in doc_ids][:limit]
+        except (TypeError, ValueError):
+            return {"success": False, "output": None, "error": "'doc_ids' debe ser una lista de ids."}
+        if not doc_ids and args.get("pending"):
+            doc_ids = self.kb.pending_cv_ids(args.get("user_id"), limit)
+        if not doc_ids:
+            return {"success": False, "output": None, "error": "Falta 'doc_ids' (o 'pending': true) con CVs por evaluar."}
+
+        try:
+            report = self.evaluator.evaluate_documents(doc_ids, context=args.get("context", ""))
+        except Exception as e:
+            return {"success": False, "output": None, "error": str(e)}
+
+        lines = [
+            f"=== {report['evaluated']}/{report['total']} CVs evaluados en {report['elapsed_s']}s ===",
+        ]
+        for r in report["results"]:
+            lines.append(
+                f"• {r['name'] or '(sin nombre)'} — {r['score']}/100 | {r['verdict']} | {r['level']} (doc {r['doc_id']})"
+            )
+        if report["errors"]:
+            lines.append(f"⚠️ {report['failed']} sin evaluar: " + "; ".join(report["errors"][:3]))
+        return {"success": True, "output": "\n".join(lines), "error": None}
+
+
 class StoreCVAdapter(ToolAdapter):
     """Guarda un CV/documento en la base de conocimiento sin evaluarlo."""
 
@@ -548,7 +600,9 @@ class QueryKnowledgeAdapter(ToolAdapter):
     description = (
         "Search the knowledge database for people, CVs, documents, or facts. "
         "Args: 'query' (search text), 'person_name' (optional, for specific person lookup), "
-        "'type' (optional: 'people'/'documents'/'facts'/'all', default 'all')."
+        "'type' (optional: 'people'/'documents'/'facts'/'all', default 'all'). "
+        "To filter candidates (HR), use 'skills' (list, ALL required), 'level' (Junior/Mid/Senior/Lead), "
+        "'verdict' (Contratar/Considerar/Pasar) and/or 'location'."
     )
     requires_approval = False
 
@@ -562,6 +616,9 @@ class QueryKnowledgeAdapter(ToolAdapter):
 
         results = []
 
+        if any(args.get(k) for k in ("skills", "level", "verdict", "location")):
+            results.extend(self._candidate_lines(args))
+
         if person_name:
             # Búsqueda específica de persona
             person = self.kb.get_person(person_name)
@@ -622,6 +679,93 @@ class QueryKnowledgeAdapter(ToolAdapter):
 
         return {"success": True, "output": "\n".join(results), "error": None}
 
+    def _candidate_lines(self, args: dict) -> list[str]:
+        """Filtro facetado de candidatos (skills / nivel / veredicto / ubicación)."""
+        found = self.kb.find_candidates(
+            skills=args.get("skills"),
+            level=args.get("level"),
+            verdict=args.get("verdict"),
+            location=args.get("location"),
+            limit=15,
+        )
+        filtros = ", ".join(f"{k}={args[k]}" for k in ("skills", "level", "verdict", "location") if args.get(k))
+        if not found["total"]:
+            return [f"No hay candidatos con {filtros}."]
+        lines = [f"=== {found['total']} candidatos con {filtros} (mostrando {len(found['people'])}) ==="]
+        for p in found["people"]:
+            skills = p.get("skills", "")
+            if isinstance(skills, list): skills = ", ".join(skills)
+            lines.append(
+                f"  • {p['name']} — {p.get('role') or 'sin rol'} | {p.get('level') or '?'} | "
+                f"{p.get('verdict') or 'sin veredicto'} | {p.get('location') or '?'} | Skills: {skills}"
+            )
+        for facet, label in (("level", "Por nivel"), ("verdict", "Por veredicto"),
+                             ("location", "Por ubicación"), ("skills", "Otros skills frecuentes")):
+            counts = found["facets"].get(facet)
+            if counts:
+                lines.append(f"{label}: " + ", ".join(f"{k} ({n})" for k, n in counts.items()))
+        return lines
+
+
+class RankCandidatesAdapter(ToolAdapter):
+    """Rankea a todos los candidatos de la KB contra una vacante; solo el top-k va al LLM."""
+
+    name = "rank_candidates"
+    description = (
+        "Rank ALL candidates in the knowledge database against a job description "
+        "(skill overlap, level, semantic similarity, recency) and return a scored shortlist. "
+        "Args: 'job' (job description), 'skills' (optional list of required skills), "
+        "'level' (optional: Junior/Mid/Senior/Lead), 'top_k' (default 10), "
+        "'evaluate_top' (optional int, max 5: how many of the top candidates get a narrative LLM evaluation)."
+    )
+    requires_approval = False
+    MAX_EVALUATIONS = 5
+
+    def __init__(self, knowledge_base, ai_query_fn=None):
+        from core.matching import CandidateRanker
+        self.kb = knowledge_base
+        self.ranker = CandidateRanker(knowledge_base)
+        self.evaluator = EvaluateCVAdapter(ai_query_fn) if ai_query_fn else None
+
+    def execute(self, args: dict) -> dict:
+        job = args.get("job", "")
+        if not job and not args.get("skills"):
+            return {"success": False, "output": None, "error": "Falta 'job' (o 'skills')."}
+        try:
+            ranking = self.ranker.rank(
+                job, skills=args.get("skills"), level=args.get("level"),
+                top_k=int(args.get("top_k", 10)),
+            )
+        except Exception as e:
+            return {"success": False, "output": None, "error": str(e)}
+        if not ranking["results"]:
+            return {"success": True, "output": "No hay candidatos en la base de conocimiento.", "error": None}
+
+        req = ranking["job"]
+        lines = [
+            f"=== Top {len(ranking['results'])} de {ranking['total_candidates']} candidatos ===",
+            f"Requisitos detectados: skills={', '.join(req['skills']) or '—'} | nivel={req['level'] or '—'}",
+            "Pesos: " + ", ".join(f"{c} {w:.0%}" for c, w in ranking["weights"].items()),
+        ]
+        for pos, c in enumerate(ranking["results"], 1):
+            breakdown = " ".join(f"{k}={v:.2f}" for k, v in c["breakdown"].items())
+            lines.append(f"{pos}. {c['name']} — {c.get('role') or 'sin rol'} | {c.get('level') or '?'} | score {c['score']:.3f} ({breakdown})")
+            if c["missing_skills"]:
+                lines.append(f"     Le falta: {', '.join(c['missing_skills'])}")
+
+        n_eval = min(int(args.get("evaluate_top", 0) or 0), self.MAX_EVALUATIONS)
+        if self.evaluator and n_eval:
+            lines.append("\n=== Evaluación de los finalistas ===")
+            for c in ranking["results"][:n_eval]:
+                docs = self.kb.get_documents_by_person(c["name"])
+                cv = next((d for d in docs if d["doc_type"] == "cv"), None)
+                if not cv:
+                    lines.append(f"\n• {c['name']}: sin CV guardado para evaluar.")
+                    continue
+                lines.append(f"\n• {c['name']}:\n{self.evaluator.evaluate(cv['content'], context=job)}")
+
+        return {"success": True, "output": "\n".join(lines), "error": None}
+
 
 # ═══════════════════════════════════════════════════════════════
 # Spotify Adapters
@@ -853,10 +997,12 @@ class AdapterRegistry:
         return adapter.requires_approval if adapter else True  # unknown → require approval
 
 
-def build_registry(gestor, knowledge_base=None, spotify_client=None) -> AdapterRegistry:
+def build_registry(gestor, knowledge_base=None, spotify_client=None, cv_evaluator=None) -> AdapterRegistry:
     """
     Construye el registry con todos los adapters disponibles,
     reutilizando los componentes que ya tiene GestorHerramientas.
+    `cv_evaluator` (BatchCVEvaluator) se comparte para no duplicar los
+    límites de concurrencia por proveedor; si no se da, se arma uno.
     """
     registry = AdapterRegistry()
 
@@ -878,6 +1024,13 @@ def build_registry(gestor, knowledge_base=None, spotify_client=None) -> AdapterR
         registry.register(StorePersonAdapter(knowledge_base))
         registry.register(AddFactAdapter(knowledge_base))
         registry.register(QueryKnowledgeAdapter(knowledge_base))
+        registry.register(RankCandidatesAdapter(knowledge_base, gestor._consultar_ia))
+        if cv_evaluator is None:
+            from core.cv_batch import BatchCVEvaluator, providers_from_clients
+            cv_evaluator = BatchCVEvaluator(knowledge_base, providers_from_clients(
+                groq=gestor.groq_client, mistral=gestor.mistral, ollama=gestor.ollama,
+            ))
+        registry.register(BatchEvaluateCVsAdapter(knowledge_base, cv_evaluator))
 
     # Spotify adapters (solo si hay cliente Spotify)
     if spotify_client:
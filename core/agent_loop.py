@@ -12,15 +12,20 @@ relevantes en la VectorMemory para RAG.
 from __future__ import annotations
 
 import json
+import logging
 import re
 import traceback
-from typing import Callable
+from typing import TYPE_CHECKING, Callable
 
 from core.adapters import AdapterRegistry
 from core.agent_logger import AgentLogger
 from core.agent_memory import VectorMemory
 from core.approval import ApprovalManager, ApprovalStatus, approval_manager
 
+if TYPE_CHECKING:
+    from core.conversation_db import ConversationDB
+
+logger = logging.getLogger(__name__)
 
 # ═══════════════════════════════════════════════════════════════
 # Prompt de planificación (se inyecta como system message)
@@ -122,6 +127,7 @@ class AgentLoop:
         memory: VectorMemory | None = None,
         approval: ApprovalManager | None = None,
         on_progress: Callable[[str], None] | None = None,  # callback para mensajes parciales
+        conversation_db: ConversationDB | None = None,     # búsqueda en historial viejo
     ):
         self.registry = registry
         self.ai_chat = ai_chat_fn
@@ -129,6 +135,7 @@ class AgentLoop:
         self.memory = memory or VectorMemory()
         self.approval = approval or approval_manager
         self.on_progress = on_progress
+        self.conversation_db = conversation_db
 
     # ─── Punto de entrada ─────────────────────────────────────
 
@@ -178,6 +185,16 @@ class AgentLoop:
         if knowledge_context:
             system_prompt += f"\n\n{knowledge_context}"
 
+        # Inyectar turnos viejos relevantes a la meta (fuera de la ventana reciente)
+        if self.conversation_db and user_id:
+            try:
+                recall = self.conversation_db.recall_context(user_id, goal)
+                if recall:
+                    system_prompt += f"\n\n{recall}"
+            except Exception as e:
+                # best-effort: sin recall el agente sigue con el historial reciente
+                logger.warning(f"⚠️ Error en recall: {e}")
+
         # Inyectar contexto de usuario
         if user_name:
             system_prompt += f"\n\nUsuario actual: {user_name}"
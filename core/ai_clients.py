@@ -8,6 +8,8 @@ import requests
 
 from groq import Groq
 
+from core.token_budget import PROVIDER_INPUT_TOKENS, fit_messages
+
 
 # ═══════════════════════════════════════════════════════════════
 # Ollama (local GPU)
@@ -21,19 +23,18 @@ class OllamaClient:
         self.model = model
         self.last_tokens_used = 0
 
-    def generate(self, prompt, temperature=0.7, max_tokens=2000):
+    def generate(self, prompt, temperature=0.7, max_tokens=2000, json_mode=False):
         try:
-            response = requests.post(
-                f"{self.url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "temperature": temperature,
-                    "stream": False,
-                    "options": {"num_predict": max_tokens},
-                },
-                timeout=120,
-            )
+            payload = {
+                "model": self.model,
+                "prompt": prompt,
+                "temperature": temperature,
+                "stream": False,
+                "options": {"num_predict": max_tokens},
+            }
+            if json_mode:
+                payload["format"] = "json"
+            response = requests.post(f"{self.url}/api/generate", json=payload, timeout=120)
             if response.status_code == 200:
                 data = response.json()
                 self.last_tokens_used = data.get("eval_count", 0)
@@ -46,22 +47,21 @@ class OllamaClient:
             print(f"Error Ollama: {e}")
             return None
 
-    def chat(self, messages, temperature=0.7, max_tokens=2000):
-        """Chat con formato messages [{role, content}] via /api/chat."""
+    def chat(self, messages, temperature=0.7, max_tokens=2000, json_mode=False):
+        """Chat con formato messages [{role, content}] via /api/chat. json_mode fuerza JSON válido."""
         try:
-            response = requests.post(
-                f"{self.url}/api/chat",
-                json={
-                    "model": self.model,
-                    "messages": messages,
-                    "stream": False,
-                    "options": {
-                        "temperature": temperature,
-                        "num_predict": max_tokens,
-                    },
+            payload = {
+                "model": self.model,
+                "messages": messages,
+                "stream": False,
+                "options": {
+                    "temperature": temperature,
+                    "num_predict": max_tokens,
                 },
-                timeout=120,
-            )
+            }
+            if json_mode:
+                payload["format"] = "json"
+            response = requests.post(f"{self.url}/api/chat", json=payload, timeout=120)
             if response.status_code == 200:
                 data = response.json()
                 self.last_tokens_used = data.get("eval_count", 0)
@@ -109,17 +109,19 @@ class MistralClient:
         except Exception as e:
             print(f"⚠️ Error inicializando Mistral: {e}")
 
-    def chat(self, messages, temperature=0.7, max_tokens=4000, model_override=None):
+    def chat(self, messages, temperature=0.7, max_tokens=4000, model_override=None, json_mode=False):
         if not self.client:
             return None
         try:
-            # Truncar mensajes si el payload es muy grande
-            trimmed = self._trim_messages(messages)
+            # Recortar el contexto al presupuesto de tokens del modelo
+            trimmed = self._trim_messages(messages, model_override or self.model)
+            extra = {"response_format": {"type": "json_object"}} if json_mode else {}
             response = self.client.chat.complete(
                 model=model_override or self.model,
                 messages=trimmed,
                 temperature=temperature,
                 max_tokens=max_tokens,
+                **extra,
             )
             if hasattr(response, "usage") and response.usage:
                 self.last_tokens_used = response.usage.total_tokens
@@ -159,16 +161,9 @@ class MistralClient:
             return f"❌ Error procesando imagen: {e}"
 
     @staticmethod
-    def _trim_messages(messages, max_chars=24000):
-        """Recorta historial para no exceder límite de payload."""
-        total = sum(len(m.get("content", "") if isinstance(m.get("content", ""), str) else str(m.get("content", ""))) for m in messages)
-        if total <= max_chars:
-            return messages
-        system = [m for m in messages if m["role"] == "system"]
-        others = [m for m in messages if m["role"] != "system"]
-        while others and sum(len(m.get("content", "") if isinstance(m.get("content", ""), str) else str(m.get("content", ""))) for m in system + others) > max_chars:
-            others.pop(0)
-        return system + others
+    def _trim_messages(messages, model=None, max_tokens=PROVIDER_INPUT_TOKENS["mistral"]):
+        """Recorta el contexto por prioridad para no exceder el presupuesto de tokens."""
+        return fit_messages(messages, max_tokens, provider="mistral", model=model)
 
     def is_available(self):
         if not self.client:
@@ -208,17 +203,19 @@ class GroqClient:
         except Exception as e:
             print(f"⚠️ Error inicializando Groq: {e}")
 
-    def chat(self, messages, temperature=0.7, max_tokens=4000, model_override=None):
+    def chat(self, messages, temperature=0.7, max_tokens=4000, model_override=None, json_mode=False):
         if not self.client:
             return None
         try:
-            # Truncar mensajes si el payload es muy grande (evitar 413)
-            trimmed = self._trim_messages(messages)
+            # Recortar el contexto al presupuesto de tokens (evitar 413)
+            trimmed = self._trim_messages(messages, model_override or self.model)
+            extra = {"response_format": {"type": "json_object"}} if json_mode else {}
             response = self.client.chat.completions.create(
                 model=model_override or self.model,
                 messages=trimmed,
                 temperature=temperature,
                 max_tokens=max_tokens,
+                **extra,
             )
             if hasattr(response, "usage"):
                 self.last_tokens_used = response.usage.total_tokens
@@ -241,17 +238,9 @@ class GroqClient:
             return None
 
     @staticmethod
-    def _trim_messages(messages, max_chars=24000):
-        """Recorta historial para no exceder límite de payload."""
-        total = sum(len(m.get("content", "")) for m in messages)
-        if total <= max_chars:
-            return messages
-        # Conservar system + últimos mensajes, recortar historial del medio
-        system = [m for m in messages if m["role"] == "system"]
-        others = [m for m in messages if m["role"] != "system"]
-        while others and sum(len(m.get("content", "")) for m in system + others) > max_chars:
-            others.pop(0)  # quitar mensajes más viejos
-        return system + others
+    def _trim_messages(messages, model=None, max_tokens=PROVIDER_INPUT_TOKENS["groq"]):
+        """Recorta el contexto por prioridad para no exceder el presupuesto de tokens."""
+        return fit_messages(messages, max_tokens, provider="groq", model=model)
 
     def is_available(self):
         if not self.client:
@@ -0,0 +1,397 @@
+"""
+bulk_ingest.py — Ingesta masiva de CVs (PDFs e imágenes) a la base de conocimiento.
+
+Pipeline:
+    1. Lista los archivos soportados de una carpeta y calcula su sha256.
+    2. Descarta los que el usuario ya tiene en la KB (o repetidos en la carpeta).
+       Los documentos guardados antes de content_hash solo tienen hash de su
+       texto: esos se reconocen después de extraer (no ahorran ese OCR, pero
+       no se duplican y desde ahí quedan con el hash del media).
+    3. Extrae el texto en un pool de PROCESOS (Tesseract y PyPDF2 usan CPU),
+       siempre con start method "spawn" (igual en Windows que en Linux).
+    4. Guarda los documentos por lotes, cada lote en una sola transacción.
+    5. Opcional: evalúa cada lote guardado con BatchCVEvaluator (JSON
+       estricto, concurrencia acotada por proveedor) mientras la extracción
+       sigue corriendo.
+
+Uso (CLI):
+    python -m core.bulk_ingest carpeta_cvs/ --user-id rh --workers 4 --evaluate
+
+Uso (código):
+    from core.bulk_ingest import ingest_folder
+    report = ingest_folder("carpeta_cvs", kb, user_id="rh", evaluator=batch_cv_evaluator)
+
+Desde el servidor (/kb/ingest) la ingesta corre en un subproceso con
+`start_ingest_job`: un pool spawn creado dentro de whatsapp_server.py
+re-ejecutaría toda su inicialización en cada proceso de extracción.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
+from core.knowledge_db import content_hash
+
+if TYPE_CHECKING:
+    from core.cv_batch import BatchCVEvaluator
+    from core.knowledge_db import KnowledgeBase
+
+logger = logging.getLogger(__name__)
+
+
+SUPPORTED_SUFFIXES = {".pdf", ".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tif", ".tiff", ".txt"}
+STORE_BATCH_SIZE = 25      # documentos por transacción
+EVAL_CONCURRENCY = 2       # lotes evaluándose a la vez (el evaluador acota las llamadas por proveedor)
+PROGRESS_EVERY_S = 5.0
+
+_PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+# ─── Extracción (corre en los procesos del pool) ──────────────
+
+_vision = None
+
+
+def _init_worker():
+    """Inicializador de cada proceso del pool: precarga los procesadores de extracción."""
+    try:
+        import core.processors  # noqa: F401
+    except ImportError:
+        pass  # un fallo aquí rompería el pool entero; se reporta por archivo en _extract_file
+
+
+def _get_vision():
+    """Un VisionProcessor por proceso, creado al primer PDF/imagen."""
+    global _vision
+    if _vision is None:
+        from core.processors import VisionProcessor
+        _vision = VisionProcessor()
+    return _vision
+
+
+def _extract_file(path: str) -> tuple[str, str | None, str | None]:
+    """(ruta, texto, error) de un archivo."""
+    try:
+        p = Path(path)
+        if p.suffix.lower() == ".txt":
+            text = p.read_text(encoding="utf-8", errors="replace").strip()
+        else:
+            mimetype = "application/pdf" if p.suffix.lower() == ".pdf" else None
+            text = _get_vision().extract_text_from_bytes(p.read_bytes(), mimetype=mimetype)
+        if not text or text.startswith("❌"):
+            return path, None, text or "Sin texto"
+        return path, text, None
+    except Exception as e:
+        return path, None, str(e)
+
+
+# ─── Pipeline ─────────────────────────────────────────────────
+
+def list_files(folder: str | Path, recursive: bool = True) -> list[Path]:
+    folder = Path(folder)
+    pattern = "**/*" if recursive else "*"
+    return sorted(
+        p for p in folder.glob(pattern)
+        if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES
+    )
+
+
+def ingest_folder(
+    folder: str | Path,
+    kb: KnowledgeBase,
+    user_id: str,
+    workers: int | None = None,
+    evaluator: BatchCVEvaluator | None = None,
+    eval_concurrency: int = EVAL_CONCURRENCY,
+    batch_size: int = STORE_BATCH_SIZE,
+    recursive: bool = True,
+    on_progress: Callable[[dict], None] | None = None,
+) -> dict:
+    """
+    Ingresa todos los CVs de `folder` a la KB del usuario.
+
+    Args:
+        workers: Procesos de extracción (default: núcleos de la CPU).
+        evaluator: BatchCVEvaluator para evaluar los CVs nuevos con el LLM (opcional).
+        on_progress: Callback con el reporte parcial (mismo formato que el final).
+
+    Returns:
+        {"files", "duplicates", "extracted", "failed", "stored", "evaluated",
+         "eval_failed", "bytes", "elapsed_s", "files_per_s", "errors"}
+    """
+    start = time.time()
+    report = {
+        "files": 0, "duplicates": 0, "extracted": 0, "failed": 0, "stored": 0,
+        "evaluated": 0, "eval_failed": 0, "bytes": 0,
+        "elapsed_s": 0.0, "files_per_s": 0.0, "errors": [],
+    }
+    lock = threading.Lock()
+    last_progress = [0.0]
+
+    def _progress(force: bool = False):
+        now = time.time()
+        with lock:
+            report["elapsed_s"] = round(now - start, 2)
+            report["files_per_s"] = round(report["extracted"] / max(now - start, 1e-6), 2)
+            if not force and now - last_progress[0] < PROGRESS_EVERY_S:
+                return
+            last_progress[0] = now
+            snapshot = {**report, "errors": list(report["errors"][-5:])}
+        logger.info(
+            f"📥 Ingesta: {snapshot['extracted'] + snapshot['failed']}/{snapshot['files'] - snapshot['duplicates']} "
+            f"extraídos, {snapshot['stored']} guardados, {snapshot['evaluated']} evaluados "
+            f"({snapshot['files_per_s']} archivos/s)"
+        )
+        if on_progress:
+            on_progress(snapshot)
+
+    # 1-2. Hash y dedup antes de gastar OCR
+    files = list_files(folder, recursive)
+    report["files"] = len(files)
+    hashes: dict[str, str] = {}
+    seen: set[str] = set()
+    for path in files:
+        data = path.read_bytes()
+        report["bytes"] += len(data)
+        digest = content_hash(data)
+        if digest in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(digest)
+        hashes[str(path)] = digest
+    existing = kb.existing_hashes(user_id, list(hashes.values()))
+    pending = [p for p, h in hashes.items() if h not in existing]
+    report["duplicates"] += len(hashes) - len(pending)
+
+    eval_pool = ThreadPoolExecutor(max_workers=eval_concurrency) if evaluator else None
+    eval_futures = []
+
+    def _evaluate(items: list[dict]):
+        try:
+            result = evaluator.evaluate_batch(items)
+            with lock:
+                report["evaluated"] += result["evaluated"]
+                report["eval_failed"] += result["failed"]
+                report["errors"].extend(f"eval {err}" for err in result["errors"])
+        except Exception as e:
+            with lock:
+                report["eval_failed"] += len(items)
+                report["errors"].append(f"eval lote de {len(items)}: {e}")
+        _progress()
+
+    def _store(batch: list[tuple[str, str]]):
+        # Mismo texto que un documento ya guardado (p. ej. anterior a content_hash):
+        # la KB devuelve el existente y le asigna el hash del media
+        text_hashes = [content_hash(text) for _, text in batch]
+        known = kb.existing_hashes(user_id, text_hashes, column="text_hash")
+        ids = kb.store_documents_bulk([
+            {
+                "user_id": user_id,
+                "doc_type": "cv",
+                "content": text,
+                "title": f"CV {Path(path).stem}",
+                "source": "upload",
+                "content_hash": hashes[path],
+            }
+            for path, text in batch
+        ])
+        new: dict[int, str] = {}
+        for doc_id, (_, text), text_hash in zip(ids, batch, text_hashes):
+            if text_hash not in known:
+                new.setdefault(doc_id, text)
+        with lock:
+            report["stored"] += len(new)
+            report["duplicates"] += len(ids) - len(new)
+        if eval_pool and new:
+            eval_futures.append(eval_pool.submit(_evaluate, [
+                {"doc_id": doc_id, "text": text, "user_id": user_id}
+                for doc_id, text in new.items()
+            ]))
+
+    # 3-4. Extracción en paralelo, guardado por lotes conforme llegan
+    batch: list[tuple[str, str]] = []
+    if pending:
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        ) as pool:
+            futures = [pool.submit(_extract_file, p) for p in pending]
+            for future in as_completed(futures):
+                path, text, error = future.result()
+                with lock:
+                    if text is None:
+                        report["failed"] += 1
+                        report["errors"].append(f"{Path(path).name}: {error}")
+                    else:
+                        report["extracted"] += 1
+                if text is not None:
+                    batch.append((path, text))
+                if len(batch) >= batch_size:
+                    _store(batch)
+                    batch = []
+                _progress()
+    if batch:
+        _store(batch)
+
+    # 5. Esperar evaluaciones pendientes
+    if eval_pool:
+        for future in as_completed(eval_futures):
+            future.result()
+        eval_pool.shutdown()
+
+    _progress(force=True)
+    logger.info(f"✅ Ingesta terminada: {report['stored']} CVs nuevos en {report['elapsed_s']}s")
+    return report
+
+
+# ─── Jobs en segundo plano (para el endpoint HTTP) ────────────
+
+_jobs: dict[str, dict] = {}
+_jobs_lock = threading.Lock()
+
+
+def start_ingest_job(
+    folder: str | Path,
+    kb: KnowledgeBase,
+    user_id: str,
+    workers: int | None = None,
+    evaluate: bool = False,
+    eval_concurrency: int = EVAL_CONCURRENCY,
+    recursive: bool = True,
+) -> str:
+    """
+    Lanza la ingesta en un SUBPROCESO (`python -m core.bulk_ingest --json`)
+    y devuelve el id del job (ver `get_job`).
+
+    El pool de extracción no se arma dentro del servidor: con spawn, cada
+    proceso del pool vuelve a ejecutar el `__main__` del padre, y
+    whatsapp_server.py se inicializa a nivel de módulo (clientes de IA, BDs,
+    hilos de mantenimiento). Con `-m`, el `__main__` es este módulo.
+    Al terminar, `kb` descarta sus cachés: las escrituras vinieron de otro proceso.
+    """
+    job_id = uuid.uuid4().hex[:12]
+    job = {"id": job_id, "status": "running", "folder": str(folder), "user_id": user_id,
+           "progress": None, "report": None, "error": None}
+    with _jobs_lock:
+        _jobs[job_id] = job
+
+    cmd = [
+        sys.executable, "-m", "core.bulk_ingest", str(folder),
+        "--user-id", user_id, "--db", kb.db_path, "--json",
+        "--eval-concurrency", str(eval_concurrency),
+    ]
+    if workers:
+        cmd += ["--workers", str(workers)]
+    if evaluate:
+        cmd.append("--evaluate")
+    if not recursive:
+        cmd.append("--no-recursive")
+
+    def _run():
+        try:
+            # stderr (logs del subproceso) sale por la consola del servidor
+            proc = subprocess.Popen(cmd, cwd=_PROJECT_DIR, stdout=subprocess.PIPE, text=True)
+            for line in proc.stdout:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if "progress" in message:
+                    job["progress"] = message["progress"]
+                elif "report" in message:
+                    job["report"] = message["report"]
+            code = proc.wait()
+            if code == 0 and job["report"] is not None:
+                job["status"] = "done"
+            else:
+                job["status"] = "error"
+                job["error"] = f"La ingesta terminó con código {code}"
+                logger.error(f"❌ Error en ingesta masiva ({job_id}): código {code}")
+        except Exception as e:
+            logger.error(f"❌ Error en ingesta masiva: {e}")
+            job["status"] = "error"
+            job["error"] = str(e)
+        finally:
+            kb.reload_external_writes()
+
+    threading.Thread(target=_run, name=f"ingest-{job_id}", daemon=True).start()
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+# ─── CLI ──────────────────────────────────────────────────────
+
+def _emit(message: dict):
+    print(json.dumps(message), flush=True)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Ingesta masiva de CVs a la base de conocimiento")
+    parser.add_argument("folder", help="Carpeta con PDFs / imágenes / .txt")
+    parser.add_argument("--user-id", required=True, help="Usuario dueño de los documentos")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de extracción")
+    parser.add_argument("--evaluate", action="store_true", help="Evaluar cada CV con el LLM")
+    parser.add_argument("--eval-concurrency", type=int, default=EVAL_CONCURRENCY, help="Lotes evaluándose a la vez")
+    parser.add_argument("--no-recursive", action="store_true")
+    parser.add_argument("--db", default=None, help="Ruta de la KB (default: data/conocimiento.db)")
+    parser.add_argument("--json", action="store_true", help="Avance y reporte como líneas JSON en stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    from core.embeddings import get_embedder
+    from core.knowledge_db import KnowledgeBase
+
+    kb = KnowledgeBase(
+        args.db,
+        embedder=get_embedder(),
+        compress_min_bytes=int(os.getenv("KB_COMPRESS_MIN_BYTES", "0")) or None,
+    )
+    evaluator = None
+    if args.evaluate:
+        from core.ai_clients import GroqClient, MistralClient, OllamaClient
+        from core.cv_batch import BatchCVEvaluator, providers_from_clients
+
+        evaluator = BatchCVEvaluator(kb, providers_from_clients(GroqClient(), MistralClient(), OllamaClient()))
+
+    report = ingest_folder(
+        args.folder, kb, args.user_id,
+        workers=args.workers,
+        evaluator=evaluator,
+        eval_concurrency=args.eval_concurrency,
+        recursive=not args.no_recursive,
+        on_progress=(lambda snapshot: _emit({"progress": snapshot})) if args.json else None,
+    )
+    kb.close()
+    if args.json:
+        _emit({"report": report})
+        return
+    print(
+        f"\n📊 {report['files']} archivos · {report['duplicates']} duplicados · "
+        f"{report['stored']} guardados · {report['failed']} fallidos · "
+        f"{report['evaluated']} evaluados · {report['files_per_s']} archivos/s"
+    )
+    for err in report["errors"][:20]:
+        print(f"   ⚠️ {err}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,12 @@ Construye el system prompt enriquecido con RAG automático,
 temas del usuario, vocabulario, y capacidades disponibles.
 Evita que el usuario tenga que repetirle a Raymundo qué hacer y cómo actuar.
 
+Las partes que dependen de la BD (KB, temas, vocabulario) se cachean por
+usuario: el bloque KB se invalida cuando la KnowledgeBase cambia de
+generación (cualquier escritura), temas y vocabulario cuando cambia la
+generación del usuario en MemorySystem, y todo expira por TTL o con
+invalidate().
+
 Uso:
     ctx = ContextManager(knowledge_base, memory_system)
     prompt = ctx.build_system_prompt(
@@ -15,16 +21,28 @@ Uso:
 from __future__ import annotations
 
 import logging
+import threading
 from typing import TYPE_CHECKING
 
+from core.cache import TTLCache
 from core.config import config_agente, _get_mode
+from core.token_budget import truncate_to_tokens
 
 if TYPE_CHECKING:
+    from core.conversation_db import ConversationDB
     from core.knowledge_db import KnowledgeBase
     from core.memory import MemorySystem
 
 logger = logging.getLogger(__name__)
 
+# Tope de tokens del bloque de conocimiento (RAG) dentro del system prompt
+KB_CONTEXT_MAX_TOKENS = 1500
+
+# Caché por usuario de las partes del prompt que salen de la BD
+PROMPT_CACHE_SIZE = 256
+PROMPT_CACHE_TTL = 60       # segundos (los temas cambian con cada mensaje)
+KB_QUERIES_PER_USER = 16    # bloques KB distintos cacheados por usuario
+
 
 # ── Capacidades disponibles (se inyecta como reminder) ───────────
 _CAPABILITIES_ES = """
@@ -49,9 +67,108 @@ class ContextManager:
         self,
         knowledge_base: KnowledgeBase | None = None,
         memory_system: MemorySystem | None = None,
+        cache_size: int = PROMPT_CACHE_SIZE,
+        cache_ttl: float = PROMPT_CACHE_TTL,
+        conversation_db: ConversationDB | None = None,
     ):
         self.kb = knowledge_base
         self.memory = memory_system
+        self.conversation_db = conversation_db
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # Las entradas se comparten entre los hilos de Flask
+        self._lock = threading.Lock()
+
+    # ─── Caché por usuario ──────────────────────────────────────
+
+    def invalidate(self, user_id: str | None = None):
+        """Descarta el contexto cacheado de un usuario (o de todos si es None)."""
+        if user_id is None:
+            self._cache.clear()
+        else:
+            self._cache.invalidate(user_id)
+
+    def get_cache_stats(self) -> dict:
+        return self._cache.get_stats()
+
+    def _memory_generation(self, user_id: str | None) -> int | None:
+        generation = getattr(self.memory, "generation", None)
+        return generation(user_id) if callable(generation) else None
+
+    def _user_entry(self, user_id: str | None) -> dict:
+        """
+        Temas y vocabulario del usuario + bloques KB por query, cacheados.
+        Temas y vocabulario se recargan si el usuario escribió desde entonces.
+        """
+        key = user_id or ""
+        generation = self._memory_generation(user_id)
+        entry = self._cache.get(key)
+        if entry is None or entry["gen"] != generation:
+            entry = {
+                "gen": generation,
+                "temas": self._load_temas(user_id),
+                "vocab": self._load_vocab(user_id),
+                # Los bloques KB tienen su propia generación: se conservan
+                "kb": entry["kb"] if entry is not None else {},
+            }
+            self._cache.put(key, entry)
+        return entry
+
+    def _kb_block(self, entry: dict, query: str, user_id: str | None) -> str:
+        """Bloque KB del query; se reutiliza mientras la KB no cambie."""
+        generation = getattr(self.kb, "generation", None)
+        qkey = " ".join(query.lower().split())
+        with self._lock:
+            cached = entry["kb"].get(qkey)
+        if cached is not None and generation is not None and cached[0] == generation:
+            return cached[1]
+
+        kb_context = ""
+        try:
+            kb_context = self.kb.build_knowledge_context(
+                query=query, user_id=user_id
+            )
+            if kb_context:
+                kb_context = truncate_to_tokens(kb_context, KB_CONTEXT_MAX_TOKENS)
+        except Exception as e:
+            logger.warning(f"⚠️ Error obteniendo contexto KB: {e}")
+            return ""
+
+        with self._lock:
+            kb_cache = entry["kb"]
+            kb_cache.pop(qkey, None)
+            kb_cache[qkey] = (generation, kb_context)
+            while len(kb_cache) > KB_QUERIES_PER_USER:
+                kb_cache.pop(next(iter(kb_cache)))
+        return kb_context
+
+    def _load_temas(self, user_id: str | None) -> str:
+        if not (self.memory and user_id):
+            return ""
+        try:
+            temas = self.memory.get_temas_frecuentes(
+                user_id=user_id, top_n=8
+            )
+            if temas:
+                temas_str = ", ".join(temas)
+                return (
+                    f"\n\nTEMAS FRECUENTES DE ESTE USUARIO: "
+                    f"Suele hablar de: {temas_str}. "
+                    f"Usa este contexto para dar respuestas más relevantes "
+                    f"y anticipar sus necesidades."
+                )
+        except Exception as e:
+            logger.warning(f"⚠️ Error obteniendo temas: {e}")
+        return ""
+
+    def _load_vocab(self, user_id: str | None) -> str:
+        if not self.memory:
+            return ""
+        try:
+            return self.memory.get_vocabulario_hint(
+                user_id=user_id
+            ) or ""
+        except Exception:
+            return ""
 
     def build_system_prompt(
         self,
@@ -68,6 +185,7 @@ class ContextManager:
         1. Personalidad base (archivo .md)
         2. Capacidades disponibles (herramientas)
         3. Conocimiento RAG relevante al query
+           (+ turnos viejos relevantes del historial, vía FTS)
         4. Temas frecuentes del usuario
         5. Estilo/vocabulario del usuario
         6. Nombre del interlocutor
@@ -86,44 +204,30 @@ class ContextManager:
         if include_capabilities:
             parts.append(f"\n\n{_CAPABILITIES_ES}")
 
+        entry = self._user_entry(user_id)
+
         # ── 3. Conocimiento RAG relevante ───────────────────────
         if self.kb and query:
+            kb_context = self._kb_block(entry, query, user_id)
+            if kb_context:
+                parts.append(f"\n\n{kb_context}")
+
+        # ── 3b. Turnos viejos relevantes (búsqueda en historial) ─
+        if self.conversation_db and user_id and query:
             try:
-                kb_context = self.kb.build_knowledge_context(
-                    query=query, user_id=user_id
-                )
-                if kb_context:
-                    parts.append(f"\n\n{kb_context}")
+                recall = self.conversation_db.recall_context(user_id, query)
+                if recall:
+                    parts.append(f"\n\n{recall}")
             except Exception as e:
-                logger.warning(f"⚠️ Error obteniendo contexto KB: {e}")
+                logger.warning(f"⚠️ Error buscando en historial: {e}")
 
         # ── 4. Temas frecuentes del usuario ─────────────────────
-        if self.memory and user_id:
-            try:
-                temas = self.memory.get_temas_frecuentes(
-                    user_id=user_id, top_n=8
-                )
-                if temas:
-                    temas_str = ", ".join(temas)
-                    parts.append(
-                        f"\n\nTEMAS FRECUENTES DE ESTE USUARIO: "
-                        f"Suele hablar de: {temas_str}. "
-                        f"Usa este contexto para dar respuestas más relevantes "
-                        f"y anticipar sus necesidades."
-                    )
-            except Exception as e:
-                logger.warning(f"⚠️ Error obteniendo temas: {e}")
+        if entry["temas"]:
+            parts.append(entry["temas"])
 
         # ── 5. Estilo / vocabulario del usuario ─────────────────
-        if self.memory:
-            try:
-                vocab_hint = self.memory.get_vocabulario_hint(
-                    user_id=user_id
-                )
-                if vocab_hint:
-                    parts.append(vocab_hint)
-            except Exception:
-                pass
+        if entry["vocab"]:
+            parts.append(entry["vocab"])
 
         # ── 6. Nombre del interlocutor ──────────────────────────
         if user_name and user_name.strip() and user_name != user_id:
@@ -6,20 +6,56 @@ entre reinicios del servidor y a lo largo de días/semanas.
 
 Esquema:
     messages(id, user_id, role, content, timestamp)
+    summaries(id, user_id, summary, messages_from, messages_to, created_at, level)
+        — level 0 = resumen de mensajes; level N = resumen de resúmenes
+    summary_state(user_id, last_summarized_id, unsummarized_count)
+        — watermark por usuario mantenido por triggers sobre `messages`
+    messages_fts(content)
+        — índice FTS5 (external content) de `messages`, sincronizado por triggers
+    messages_archive(id, user_id, first_id, last_id, first_ts, last_ts,
+                     n_messages, codec, raw_bytes, payload, archived_at)
+        — almacenamiento frío: bloques comprimidos de mensajes ya resumidos
 
 Uso:
     db = ConversationDB()                     # Abre/crea data/conversaciones.db
+    db = ConversationDB(write_behind=True)    # Inserts agrupados en segundo plano
+    db.start_background_summaries(fn)         # Resúmenes fuera del request
     db.add_message("user123", "user", "Hola")
     history = db.get_history("user123")       # Últimos N mensajes
     summary = db.get_summary("user123")       # Resumen compacto de historial antiguo
+    hits = db.search("user123", "vacaciones cancún")   # BM25 + snippets
+    db.archive_old_messages(retention_days=90)          # mueve lo viejo a frío
+    db.restore_archived("user123")                      # ...y lo regresa
+    for line in db.export_ndjson(): ...                 # respaldo en streaming
+    db.import_ndjson(open("respaldo.ndjson", "rb"))
 """
 
 from __future__ import annotations
 
+import base64
+import json
+import logging
+import queue
+import re
 import sqlite3
+import threading
 import time
+import zlib
+from collections import Counter
 from pathlib import Path
-from typing import Callable
+from typing import Callable, Iterable, Iterator
+
+from core.cache import TTLCache
+from core.db_maintenance import TableCounter, install_counters, read_counters, run_maintenance
+from core.sqlite_pool import SQLitePool
+from core.token_budget import count_tokens, truncate_to_tokens
+
+try:
+    import zstandard as zstd
+except ImportError:  # dependencia opcional: se usa zlib
+    zstd = None
+
+logger = logging.getLogger(__name__)
 
 
 _DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "data" / "conversaciones.db"
@@ -30,15 +66,127 @@ RECENT_PAIRS = 8   # 16 mensajes = contexto manejable sin sobrecargar el LLM
 # Cuántos mensajes viejos se resumen para dar contexto largo
 SUMMARY_WINDOW = 60  # mensajes antiguos a considerar para resumen
 
+# Mínimo de mensajes fuera de la ventana reciente para que valga la pena resumir
+MIN_TO_SUMMARIZE = 6  # 3 pares
+
+# Tope duro de tokens de resúmenes por usuario que se mandan al LLM.
+# Al rebasarlo, los resúmenes más viejos se pliegan en un resumen-de-resúmenes.
+SUMMARY_TOKEN_BUDGET = 600
+SUMMARY_FANOUT = 4        # cuántos resúmenes viejos se pliegan en uno
+MAX_FOLDS_PER_PASS = 4    # límite de llamadas al LLM por compactación
+
+# Caché de contexto por usuario (build_context_messages)
+CONTEXT_CACHE_SIZE = 256
+CONTEXT_CACHE_TTL = 300  # segundos
+
+# Búsqueda en historial (FTS5)
+SEARCH_LIMIT = 5
+RECALL_MAX_TOKENS = 400   # tope del bloque de turnos viejos relevantes
+SNIPPET_TOKENS = 24       # palabras alrededor de cada coincidencia
+
+# Archivo frío: mensajes ya resumidos y más viejos que la retención
+ARCHIVE_RETENTION_DAYS = 90
+ARCHIVE_BLOCK_SIZE = 500   # mensajes por bloque comprimido
+ARCHIVE_ZLIB_LEVEL = 6
+ARCHIVE_ZSTD_LEVEL = 10
+
+# Export / import NDJSON: filas por lote (cada lote es una transacción corta)
+EXPORT_BATCH_SIZE = 1000
+IMPORT_LOOKUP_CHUNK = 500      # ids por consulta de colisiones (límite de parámetros de SQLite)
+
+# Palabras funcionales que no aportan a la búsqueda
+_SEARCH_STOPWORDS = frozenset(
+    "de del la el los las un una unos unas en es que al por con para su"
+    " me te se lo le nos les a o y e ni si no mi tu como cual cuál qué que"
+    " dije dijiste sobre acerca".split()
+)
+
+# Write-behind: se hace commit de lo acumulado cada N ms o al juntar M filas
+WRITE_BEHIND_FLUSH_MS = 50
+WRITE_BEHIND_MAX_ROWS = 64
+WRITE_BEHIND_MAX_PENDING = 2000  # tope de la cola; al llenarse se escribe en el hilo que llama
+
+
+def _compress_block(rows: list[tuple]) -> tuple[str, int, bytes]:
+    """Serializa y comprime un bloque de mensajes. Devuelve (codec, bytes crudos, payload)."""
+    raw = json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if zstd is not None:
+        return "zstd", len(raw), zstd.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(raw)
+    return "zlib", len(raw), zlib.compress(raw, ARCHIVE_ZLIB_LEVEL)
+
+
+def _decompress_block(codec: str, payload: bytes) -> list[list]:
+    if codec == "zstd":
+        if zstd is None:
+            raise RuntimeError("Bloque archivado con zstd pero `zstandard` no está instalado")
+        raw = zstd.ZstdDecompressor().decompress(payload)
+    else:
+        raw = zlib.decompress(payload)
+    return json.loads(raw.decode("utf-8"))
+
+
+_INSERT_MESSAGE_SQL = (
+    "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)"
+)
+
 
 class ConversationDB:
     """Capa de persistencia para conversaciones por usuario."""
 
-    def __init__(self, db_path: str | Path | None = None):
+    def __init__(
+        self,
+        db_path: str | Path | None = None,
+        write_behind: bool = False,
+        flush_interval_ms: int = WRITE_BEHIND_FLUSH_MS,
+        flush_max_rows: int = WRITE_BEHIND_MAX_ROWS,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        summary_token_budget: int = SUMMARY_TOKEN_BUDGET,
+        context_cache_size: int = CONTEXT_CACHE_SIZE,
+        context_cache_ttl: float = CONTEXT_CACHE_TTL,
+    ):
+        """
+        Args:
+            write_behind: Si es True, `add_message` solo encola el insert y un hilo
+                en segundo plano hace commit de los mensajes acumulados en una sola
+                transacción (un fsync por lote en vez de uno por mensaje).
+            flush_interval_ms: Espera máxima antes de escribir un lote.
+            flush_max_rows: Filas que disparan la escritura sin esperar el intervalo.
+            max_pending: Tamaño máximo de la cola antes de escribir de forma síncrona.
+            summary_token_budget: Tokens máximos de resúmenes por usuario en el contexto.
+            context_cache_size: Usuarios cuyo contexto se cachea (0 = sin caché).
+            context_cache_ttl: Segundos que vive un contexto cacheado.
+        """
         self._db_path = str(db_path or _DEFAULT_DB_PATH)
         Path(self._db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._pool = SQLitePool(self._db_path)
+        self._summary_token_budget = summary_token_budget
+        self._last_maintenance: dict | None = None
         self._init_db()
 
+        # Caché de contexto: se actualiza al agregar mensajes y se invalida al
+        # resumir/borrar. La versión por usuario evita cachear un contexto
+        # construido antes de una escritura concurrente.
+        self._context_cache = TTLCache(maxsize=context_cache_size, ttl=context_cache_ttl)
+        self._cache_versions: Counter = Counter()
+        self._cache_lock = threading.Lock()
+
+        # Estado del modo write-behind
+        self._flush_interval = flush_interval_ms / 1000
+        self._flush_max_rows = flush_max_rows
+        self._max_pending = max_pending
+        self._pending: list[tuple] = []
+        self._pending_users: Counter = Counter()  # user_id → filas aún sin commit
+        self._pending_cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._summary_worker: SummaryWorker | None = None
+        self._writer: threading.Thread | None = None
+        if write_behind:
+            self._writer = threading.Thread(
+                target=self._writer_loop, name="conversation-db-writer", daemon=True,
+            )
+            self._writer.start()
+
     # ─── Inicialización ───────────────────────────────────────
 
     def _init_db(self):
@@ -56,6 +204,11 @@ class ConversationDB:
                 CREATE INDEX IF NOT EXISTS idx_messages_user_ts
                 ON messages(user_id, timestamp)
             """)
+            # Paginación por cursor (user_id, id) para export
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_user_id
+                ON messages(user_id, id)
+            """)
             # Tabla para resúmenes compactados de historial viejo
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS summaries (
@@ -71,22 +224,218 @@ class ConversationDB:
                 CREATE INDEX IF NOT EXISTS idx_summaries_user
                 ON summaries(user_id)
             """)
+            # Migración: nivel jerárquico de cada resumen
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(summaries)")}
+            if "level" not in columns:
+                conn.execute("ALTER TABLE summaries ADD COLUMN level INTEGER NOT NULL DEFAULT 0")
+            self._init_summary_state(conn)
+            self._fts = self._init_fts(conn)
+            # Almacenamiento frío: bloques comprimidos de mensajes ya resumidos
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages_archive (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id     TEXT    NOT NULL,
+                    first_id    INTEGER NOT NULL,
+                    last_id     INTEGER NOT NULL,
+                    first_ts    REAL    NOT NULL,
+                    last_ts     REAL    NOT NULL,
+                    n_messages  INTEGER NOT NULL,
+                    codec       TEXT    NOT NULL,
+                    raw_bytes   INTEGER NOT NULL,
+                    payload     BLOB    NOT NULL,
+                    archived_at REAL    NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_archive_user
+                ON messages_archive(user_id, first_id)
+            """)
+            install_counters(conn, self._COUNTERS)
 
-    def _conn(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self._db_path)
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA busy_timeout=5000")
-        return conn
+    def _init_summary_state(self, conn):
+        """
+        Watermark de resúmenes por usuario: último id resumido y cuántos mensajes
+        hay después de él. Los triggers lo mantienen al insertar/borrar mensajes,
+        así `_auto_summarize` sabe en O(1) si hay algo que compactar.
+        """
+        existed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'summary_state'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS summary_state (
+                user_id             TEXT    PRIMARY KEY,
+                last_summarized_id  INTEGER NOT NULL DEFAULT 0,
+                unsummarized_count  INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        if not existed:
+            # BD anterior a la tabla: calcular el watermark una sola vez
+            conn.execute("""
+                INSERT OR IGNORE INTO summary_state (user_id, last_summarized_id, unsummarized_count)
+                SELECT m.user_id,
+                       COALESCE(s.last_id, 0),
+                       SUM(m.id > COALESCE(s.last_id, 0))
+                FROM messages m
+                LEFT JOIN (
+                    SELECT user_id, MAX(messages_to) AS last_id
+                    FROM summaries GROUP BY user_id
+                ) s ON s.user_id = m.user_id
+                GROUP BY m.user_id
+            """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_state_insert
+            AFTER INSERT ON messages
+            BEGIN
+                INSERT INTO summary_state (user_id, last_summarized_id, unsummarized_count)
+                VALUES (NEW.user_id, 0, 1)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    unsummarized_count = unsummarized_count + (NEW.id > last_summarized_id);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_state_delete
+            AFTER DELETE ON messages
+            BEGIN
+                UPDATE summary_state
+                SET unsummarized_count = unsummarized_count - 1
+                WHERE user_id = OLD.user_id AND OLD.id > last_summarized_id;
+            END
+        """)
+
+    def _init_fts(self, conn) -> bool:
+        """
+        Índice FTS5 sobre `messages.content` (external content: no duplica el
+        texto). Devuelve False si el SQLite no trae FTS5; `search` cae a LIKE.
+        """
+        existed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone()
+        try:
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    content,
+                    content = 'messages',
+                    content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"⚠️ SQLite sin FTS5, búsqueda en historial por LIKE: {e}")
+            return False
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_fts_insert
+            AFTER INSERT ON messages
+            BEGIN
+                INSERT INTO messages_fts (rowid, content) VALUES (NEW.id, NEW.content);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete
+            AFTER DELETE ON messages
+            BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content)
+                VALUES ('delete', OLD.id, OLD.content);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_fts_update
+            AFTER UPDATE OF content ON messages
+            BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content)
+                VALUES ('delete', OLD.id, OLD.content);
+                INSERT INTO messages_fts (rowid, content) VALUES (NEW.id, NEW.content);
+            END
+        """)
+        if not existed:
+            # BD anterior al índice: indexar el historial existente una sola vez
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        return True
+
+    def _conn(self):
+        """Conexión prestada del pool (commit al salir del `with`)."""
+        return self._pool.connection()
+
+    def close(self):
+        """Escribe lo pendiente y cierra las conexiones abiertas hacia la BD."""
+        if self._summary_worker is not None:
+            self._summary_worker.stop()
+            self._summary_worker = None
+        if self._writer is not None:
+            with self._pending_cond:
+                self._stopping = True
+                self._pending_cond.notify_all()
+            self._writer.join(timeout=5)
+            self._writer = None
+        self.flush()
+        self._pool.close()
 
     # ─── Escritura ────────────────────────────────────────────
 
     def add_message(self, user_id: str, role: str, content: str):
-        """Guarda un mensaje en la BD."""
-        with self._conn() as conn:
-            conn.execute(
-                "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
-                (user_id, role, content, time.time()),
-            )
+        """Guarda un mensaje en la BD (o lo encola si está activo write-behind)."""
+        row = (user_id, role, content, time.time())
+        if self._writer is None:
+            with self._conn() as conn:
+                conn.execute(_INSERT_MESSAGE_SQL, row)
+            self._cache_append(user_id, role, content)
+            return
+
+        with self._pending_cond:
+            self._pending.append(row)
+            self._pending_users[user_id] += 1
+            pending = len(self._pending)
+            # Despertar al escritor con el primer mensaje del lote y al llenarlo
+            if pending == 1 or pending >= self._flush_max_rows:
+                self._pending_cond.notify()
+        self._cache_append(user_id, role, content)
+        # Backpressure: si la cola se llenó, escribir desde este hilo
+        if pending >= self._max_pending:
+            self.flush()
+
+    def flush(self) -> int:
+        """Escribe en una sola transacción los mensajes encolados. Devuelve cuántos."""
+        with self._flush_lock:
+            with self._pending_cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                with self._conn() as conn:
+                    conn.executemany(_INSERT_MESSAGE_SQL, batch)
+            except Exception as e:
+                # Devolver el lote a la cola para reintentarlo en el siguiente flush
+                with self._pending_cond:
+                    self._pending[:0] = batch
+                logger.warning(f"⚠️ Error escribiendo lote de mensajes: {e}")
+                return 0
+            # Solo después del commit los mensajes dejan de contar como pendientes
+            with self._pending_cond:
+                self._pending_users.subtract(r[0] for r in batch)
+                for uid in {r[0] for r in batch}:
+                    if self._pending_users[uid] <= 0:
+                        del self._pending_users[uid]
+            return len(batch)
+
+    def _writer_loop(self):
+        """Hilo de group-commit: espera el primer mensaje, junta más y escribe."""
+        while True:
+            with self._pending_cond:
+                while not self._pending and not self._stopping:
+                    self._pending_cond.wait()
+                if self._stopping:
+                    break
+                if len(self._pending) < self._flush_max_rows:
+                    self._pending_cond.wait(self._flush_interval)
+            self.flush()
+
+    def _ensure_visible(self, user_id: str):
+        """Read-your-writes: si el usuario tiene mensajes sin commit, escribirlos ya."""
+        if self._pending_users.get(user_id):
+            self.flush()
+
+    def pending_writes(self) -> int:
+        """Mensajes encolados que aún no llegan a la BD."""
+        return sum(self._pending_users.values())
 
     # ─── Lectura ──────────────────────────────────────────────
 
@@ -96,6 +445,7 @@ class ConversationDB:
         [{"role": "user"|"assistant", "content": "..."}]
         ordenados cronológicamente (más viejo primero).
         """
+        self._ensure_visible(user_id)
         with self._conn() as conn:
             rows = conn.execute(
                 """SELECT role, content FROM messages
@@ -109,6 +459,7 @@ class ConversationDB:
 
     def get_old_messages(self, user_id: str, offset: int, limit: int = SUMMARY_WINDOW) -> list[dict]:
         """Mensajes más antiguos para generar resúmenes."""
+        self._ensure_visible(user_id)
         with self._conn() as conn:
             rows = conn.execute(
                 """SELECT id, role, content FROM messages
@@ -120,6 +471,7 @@ class ConversationDB:
         return [{"id": r[0], "role": r[1], "content": r[2]} for r in rows]
 
     def count_messages(self, user_id: str) -> int:
+        self._ensure_visible(user_id)
         with self._conn() as conn:
             row = conn.execute(
                 "SELECT COUNT(*) FROM messages WHERE user_id = ?",
@@ -129,40 +481,621 @@ class ConversationDB:
 
     def clear_history(self, user_id: str):
         """Borra todo el historial de un usuario."""
+        self._ensure_visible(user_id)
         with self._conn() as conn:
+            conn.execute("DELETE FROM summary_state WHERE user_id = ?", (user_id,))
             conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
             conn.execute("DELETE FROM summaries WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM messages_archive WHERE user_id = ?", (user_id,))
+        self.invalidate_context(user_id)
+
+    # ─── Búsqueda en historial ────────────────────────────────
+
+    @staticmethod
+    def _search_terms(query: str) -> list[str]:
+        words = re.findall(r"\w+", query.lower())
+        return [w for w in words if len(w) > 2 and w not in _SEARCH_STOPWORDS]
+
+    def search(
+        self,
+        user_id: str,
+        query: str,
+        limit: int = SEARCH_LIMIT,
+        before_id: int | None = None,
+    ) -> list[dict]:
+        """
+        Busca en el historial del usuario con FTS5, ordenado por BM25.
+
+        Los términos se combinan con OR y por prefijo ("vacacion*"), así una
+        pregunta en lenguaje natural encuentra turnos con cualquiera de sus
+        palabras y BM25 premia los que tienen más y más raras.
+
+        Args:
+            before_id: Solo mensajes con id menor (p. ej. excluir la ventana reciente).
+
+        Returns:
+            [{"id", "role", "content", "snippet", "timestamp", "score"}] — score
+            menor = más relevante (convención de bm25()).
+        """
+        terms = self._search_terms(query)
+        if not terms:
+            return []
+        self._ensure_visible(user_id)
+        max_id = before_id if before_id is not None else -1
+        if not self._fts:
+            return self._search_like(user_id, terms, limit, max_id)
+
+        match = " OR ".join(f'"{t}"*' for t in terms)
+        with self._conn() as conn:
+            rows = conn.execute(
+                """SELECT m.id, m.role, m.content, m.timestamp,
+                          snippet(messages_fts, 0, '«', '»', '…', ?),
+                          bm25(messages_fts)
+                   FROM messages_fts
+                   JOIN messages m ON m.id = messages_fts.rowid
+                   WHERE messages_fts MATCH ?
+                     AND m.user_id = ?
+                     AND (? < 0 OR m.id < ?)
+                   ORDER BY bm25(messages_fts)
+                   LIMIT ?""",
+                (SNIPPET_TOKENS, match, user_id, max_id, max_id, limit),
+            ).fetchall()
+        return [
+            {"id": r[0], "role": r[1], "content": r[2], "timestamp": r[3],
+             "snippet": r[4], "score": r[5]}
+            for r in rows
+        ]
+
+    def _search_like(self, user_id: str, terms: list[str], limit: int, max_id: int) -> list[dict]:
+        """Fallback sin FTS5: LIKE por término, ordenado por coincidencias y recencia."""
+        hits_expr = " + ".join("(content LIKE ?)" for _ in terms)
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"""SELECT id, role, content, timestamp, {hits_expr} AS hits
+                    FROM messages
+                    WHERE user_id = ? AND (? < 0 OR id < ?)
+                    ORDER BY hits DESC, id DESC
+                    LIMIT ?""",
+                (*(f"%{t}%" for t in terms), user_id, max_id, max_id, limit * 4),
+            ).fetchall()
+        return [
+            {"id": r[0], "role": r[1], "content": r[2], "timestamp": r[3],
+             "snippet": r[2][:200], "score": -float(r[4])}
+            for r in rows if r[4]
+        ][:limit]
+
+    def recall_context(
+        self,
+        user_id: str,
+        query: str,
+        limit: int = SEARCH_LIMIT,
+        max_tokens: int = RECALL_MAX_TOKENS,
+    ) -> str:
+        """
+        Bloque de texto con los turnos viejos más relevantes al query, para
+        inyectar en el system prompt. Excluye la ventana reciente (ya va
+        completa en el contexto) y respeta `max_tokens`.
+        """
+        if not query or not query.strip():
+            return ""
+        self._ensure_visible(user_id)
+        with self._conn() as conn:
+            row = conn.execute(
+                """SELECT MIN(id) FROM (
+                       SELECT id FROM messages WHERE user_id = ?
+                       ORDER BY id DESC LIMIT ?
+                   )""",
+                (user_id, RECENT_PAIRS * 2),
+            ).fetchone()
+        if not row or row[0] is None:
+            return ""
+        hits = self.search(user_id, query, limit=limit, before_id=row[0])
+        if not hits:
+            return ""
+
+        header = "[FRAGMENTOS RELEVANTES DE CONVERSACIONES ANTERIORES]:"
+        lines = [header]
+        used = count_tokens(header)
+        for h in sorted(hits, key=lambda h: h["id"]):
+            fecha = time.strftime("%Y-%m-%d", time.localtime(h["timestamp"]))
+            quien = "Usuario" if h["role"] == "user" else "Tú"
+            line = f"- ({fecha}) {quien}: {h['snippet']}"
+            cost = count_tokens(line)
+            if used + cost > max_tokens:
+                continue
+            lines.append(line)
+            used += cost
+        return "\n".join(lines) if len(lines) > 1 else ""
+
+    # ─── Archivo frío ─────────────────────────────────────────
+
+    def archive_old_messages(
+        self,
+        retention_days: float = ARCHIVE_RETENTION_DAYS,
+        block_size: int = ARCHIVE_BLOCK_SIZE,
+        user_id: str | None = None,
+    ) -> dict:
+        """
+        Mueve a `messages_archive` los mensajes ya resumidos (id <= watermark)
+        y más viejos que `retention_days`, en bloques comprimidos por usuario.
+
+        Cada bloque es su propia transacción corta (insert del bloque + delete
+        de sus filas), así el job no bloquea la BD aunque haya mucho que mover.
+        Los mensajes archivados salen también del índice FTS.
+
+        Returns:
+            {"users", "blocks", "messages", "raw_bytes", "stored_bytes", "duration_s"}
+        """
+        start = time.time()
+        cutoff = start - retention_days * 86400
+        stats = {"users": 0, "blocks": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+
+        with self._conn() as conn:
+            if user_id is None:
+                users = [r[0] for r in conn.execute(
+                    "SELECT user_id FROM summary_state WHERE last_summarized_id > 0"
+                )]
+            else:
+                users = [user_id]
+
+        for uid in users:
+            archived_any = False
+            while True:
+                with self._conn() as conn:
+                    rows = conn.execute(
+                        """SELECT id, role, content, timestamp FROM messages
+                           WHERE user_id = ?
+                             AND id <= (SELECT last_summarized_id FROM summary_state WHERE user_id = ?)
+                             AND timestamp < ?
+                           ORDER BY id
+                           LIMIT ?""",
+                        (uid, uid, cutoff, block_size),
+                    ).fetchall()
+                    if not rows:
+                        break
+                    codec, raw_bytes, payload = _compress_block([list(r) for r in rows])
+                    conn.execute(
+                        """INSERT INTO messages_archive
+                           (user_id, first_id, last_id, first_ts, last_ts, n_messages,
+                            codec, raw_bytes, payload, archived_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        (uid, rows[0][0], rows[-1][0], min(r[3] for r in rows),
+                         max(r[3] for r in rows), len(rows), codec, raw_bytes, payload, time.time()),
+                    )
+                    conn.executemany(
+                        "DELETE FROM messages WHERE id = ?", ((r[0],) for r in rows),
+                    )
+                archived_any = True
+                stats["blocks"] += 1
+                stats["messages"] += len(rows)
+                stats["raw_bytes"] += raw_bytes
+                stats["stored_bytes"] += len(payload)
+                if len(rows) < block_size:
+                    break
+            if archived_any:
+                stats["users"] += 1
+
+        stats["duration_s"] = round(time.time() - start, 3)
+        if stats["messages"]:
+            logger.info(
+                f"🧊 Archivados {stats['messages']} mensajes de {stats['users']} usuarios "
+                f"({stats['raw_bytes']} → {stats['stored_bytes']} bytes)"
+            )
+        return stats
+
+    def get_archived_messages(self, user_id: str) -> list[dict]:
+        """Lee (sin restaurar) los mensajes archivados del usuario, en orden."""
+        with self._conn() as conn:
+            blocks = conn.execute(
+                "SELECT codec, payload FROM messages_archive WHERE user_id = ? ORDER BY first_id",
+                (user_id,),
+            ).fetchall()
+        return [
+            {"id": r[0], "role": r[1], "content": r[2], "timestamp": r[3]}
+            for codec, payload in blocks
+            for r in _decompress_block(codec, payload)
+        ]
+
+    def restore_archived(self, user_id: str) -> int:
+        """
+        Regresa a `messages` los mensajes archivados del usuario, con sus ids
+        originales (el watermark no cambia: ya estaban resumidos). Devuelve cuántos.
+        """
+        restored = 0
+        with self._conn() as conn:
+            blocks = conn.execute(
+                "SELECT id, codec, payload FROM messages_archive WHERE user_id = ? ORDER BY first_id",
+                (user_id,),
+            ).fetchall()
+            for block_id, codec, payload in blocks:
+                rows = _decompress_block(codec, payload)
+                cursor = conn.executemany(
+                    """INSERT OR IGNORE INTO messages (id, user_id, role, content, timestamp)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    ((r[0], user_id, r[1], r[2], r[3]) for r in rows),
+                )
+                restored += cursor.rowcount
+                conn.execute("DELETE FROM messages_archive WHERE id = ?", (block_id,))
+        if restored:
+            self.invalidate_context(user_id)
+            logger.info(f"♻️ Restaurados {restored} mensajes archivados de {user_id}")
+        return restored
+
+    # ─── Estadísticas y mantenimiento ─────────────────────────
+
+    _COUNTERS = {
+        "messages": TableCounter("messages"),
+        "summaries": TableCounter("summaries"),
+        "archive_blocks": TableCounter("messages_archive"),
+        "archive_messages": TableCounter("messages_archive", value="{row}.n_messages"),
+        "archive_raw_bytes": TableCounter("messages_archive", value="{row}.raw_bytes"),
+        "archive_stored_bytes": TableCounter("messages_archive", value="LENGTH({row}.payload)"),
+    }
+
+    def get_stats(self) -> dict:
+        """Mensajes activos y resúmenes (conteos mantenidos por triggers, sin COUNT(*))."""
+        with self._conn() as conn:
+            return read_counters(conn, ["messages", "summaries"])
+
+    def run_maintenance(self) -> dict:
+        """Escribe lo pendiente y corre incremental_vacuum + optimize + wal_checkpoint(TRUNCATE)."""
+        self.flush()
+        self._last_maintenance = run_maintenance(self._pool, self._db_path, self._COUNTERS)
+        return self._last_maintenance
+
+    def get_maintenance_stats(self) -> dict | None:
+        return self._last_maintenance
+
+    def get_archive_stats(self) -> dict:
+        with self._conn() as conn:
+            counts = read_counters(conn)
+        blocks, messages = counts["archive_blocks"], counts["archive_messages"]
+        raw_bytes, stored_bytes = counts["archive_raw_bytes"], counts["archive_stored_bytes"]
+        return {
+            "blocks": blocks,
+            "messages": messages,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+            "ratio": round(raw_bytes / stored_bytes, 2) if stored_bytes else 0.0,
+        }
+
+    # ─── Export / import NDJSON ───────────────────────────────
+
+    # tabla → (tipo de registro, columnas exportadas)
+    _EXPORT_TABLES = {
+        "messages": ("message", ("id", "user_id", "role", "content", "timestamp")),
+        "summaries": ("summary", ("id", "user_id", "summary", "messages_from",
+                                  "messages_to", "created_at", "level")),
+        "messages_archive": ("archive", ("id", "user_id", "first_id", "last_id", "first_ts",
+                                         "last_ts", "n_messages", "codec", "raw_bytes",
+                                         "payload", "archived_at")),
+    }
+    _IMPORT_TABLES = {kind: (table, cols) for table, (kind, cols) in _EXPORT_TABLES.items()}
+
+    @staticmethod
+    def _encode_cursor(table: str, user_id: str, row_id: int) -> str:
+        return f"{table}:{row_id}:{user_id}"
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple[str, str, int]:
+        table, row_id, user_id = cursor.split(":", 2)
+        return table, user_id, int(row_id)
+
+    def export_ndjson(
+        self,
+        user_id: str | None = None,
+        cursor: str | None = None,
+        limit: int | None = None,
+        batch_size: int = EXPORT_BATCH_SIZE,
+    ) -> Iterator[str]:
+        """
+        Exporta mensajes, resúmenes y bloques archivados como NDJSON (una línea
+        por registro, con "type"), en streaming y con memoria acotada.
+
+        Pagina por keyset `(user_id, id) > (?, ?)` sobre el índice, así cada
+        lote es una lectura corta e independiente (no hay OFFSET ni una
+        transacción abierta durante todo el export).
+
+        Args:
+            user_id: Exportar solo un usuario (None = todos).
+            cursor: Reanudar donde terminó un export anterior.
+            limit: Máximo de registros; si se alcanza, la última línea es
+                   {"type": "cursor", "next": "..."} para pedir la siguiente página.
+        """
+        # El cursor se valida aquí (no dentro del generador) para fallar antes de streamear
+        start = (next(iter(self._EXPORT_TABLES)), "", -1)
+        if cursor:
+            try:
+                start = self._decode_cursor(cursor)
+            except ValueError:
+                raise ValueError(f"Cursor inválido: {cursor}") from None
+            if start[0] not in self._EXPORT_TABLES:
+                raise ValueError(f"Cursor inválido: {cursor}")
+        self.flush()
+        return self._export_lines(start, user_id, limit, batch_size)
+
+    def _export_lines(
+        self, start: tuple[str, str, int], user_id: str | None, limit: int | None, batch_size: int,
+    ) -> Iterator[str]:
+        tables = list(self._EXPORT_TABLES)
+        start_table, after_user, after_id = start
+        emitted = 0
+        for table in tables[tables.index(start_table):]:
+            kind, cols = self._EXPORT_TABLES[table]
+            user_filter = " AND user_id = ?" if user_id is not None else ""
+            sql = (
+                f"SELECT {', '.join(cols)} FROM {table} "
+                f"WHERE (user_id, id) > (?, ?){user_filter} "
+                f"ORDER BY user_id, id LIMIT ?"
+            )
+            while True:
+                page = batch_size if limit is None else min(batch_size, limit - emitted)
+                if page <= 0:
+                    yield json.dumps({
+                        "type": "cursor",
+                        "next": self._encode_cursor(table, after_user, after_id),
+                    }) + "\n"
+                    return
+                params = [after_user, after_id]
+                if user_id is not None:
+                    params.append(user_id)
+                with self._conn() as conn:
+                    rows = conn.execute(sql, (*params, page)).fetchall()
+                for row in rows:
+                    record = {"type": kind, **dict(zip(cols, row))}
+                    if kind == "archive":
+                        record["payload"] = base64.b64encode(record["payload"]).decode("ascii")
+                    yield json.dumps(record, ensure_ascii=False) + "\n"
+                emitted += len(rows)
+                if len(rows) < page:
+                    break
+                after_user, after_id = rows[-1][1], rows[-1][0]
+            after_user, after_id = "", -1
+
+    def import_ndjson(self, lines: Iterable[str | bytes], batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+        """
+        Importa un export NDJSON en lotes conservando los ids originales
+        (los resúmenes y el archivo frío apuntan a rangos de ids de mensajes).
+
+        Un registro cuyo id ya existe con el mismo contenido se omite, así
+        reimportar el mismo archivo es idempotente. Si el id existe con OTRO
+        contenido (p. ej. un respaldo de otra instancia) es una colisión: no
+        se sobrescribe ni se inserta, se cuenta en "collisions".
+        Al final recalcula el watermark de resúmenes de los usuarios tocados.
+
+        Returns:
+            {"message": n, "summary": n, "archive": n, "skipped": n,
+             "collisions": n, "errors": n}
+        """
+        self.flush()
+        stats = {"message": 0, "summary": 0, "archive": 0, "skipped": 0, "collisions": 0, "errors": 0}
+        buffers: dict[str, list[tuple]] = {kind: [] for kind in self._IMPORT_TABLES}
+        users: set[str] = set()
+
+        def _write(kind: str):
+            batch = buffers[kind]
+            if not batch:
+                return
+            table, cols = self._IMPORT_TABLES[kind]
+            with self._conn() as conn:
+                existing: dict[int, tuple] = {}
+                for i in range(0, len(batch), IMPORT_LOOKUP_CHUNK):
+                    ids = [row[0] for row in batch[i:i + IMPORT_LOOKUP_CHUNK]]
+                    for row in conn.execute(
+                        f"SELECT {', '.join(cols)} FROM {table} "
+                        f"WHERE id IN ({', '.join('?' * len(ids))})",
+                        ids,
+                    ):
+                        existing[row[0]] = tuple(row)
+                fresh = []
+                for row in batch:
+                    current = existing.get(row[0])
+                    if current is None:
+                        fresh.append(row)
+                    elif current == row:
+                        stats["skipped"] += 1
+                    else:
+                        stats["collisions"] += 1
+                        logger.debug(f"Import: {kind} id={row[0]} ya existe con otro contenido")
+                # rowcount no incluye lo que escriben los triggers (FTS, watermark)
+                inserted = conn.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(cols)}) "
+                    f"VALUES ({', '.join('?' * len(cols))})",
+                    fresh,
+                ).rowcount if fresh else 0
+            stats[kind] += inserted
+            stats["skipped"] += len(fresh) - inserted   # repetidos dentro del mismo archivo
+            buffers[kind] = []
+
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                kind = record.get("type")
+                if kind == "cursor":
+                    continue
+                table, cols = self._IMPORT_TABLES[kind]
+                if kind == "archive":
+                    record["payload"] = base64.b64decode(record["payload"])
+                buffers[kind].append(tuple(record[c] for c in cols))
+                users.add(record["user_id"])
+            except (ValueError, KeyError, TypeError) as e:
+                stats["errors"] += 1
+                logger.warning(f"⚠️ Línea NDJSON inválida: {e}")
+                continue
+            if len(buffers[kind]) >= batch_size:
+                _write(kind)
+        for kind in buffers:
+            _write(kind)
+
+        self._recompute_summary_state(users)
+        for uid in users:
+            self.invalidate_context(uid)
+        if stats["collisions"]:
+            logger.warning(f"⚠️ Import NDJSON: {stats['collisions']} registros con id en conflicto no se importaron")
+        logger.info(f"📥 Import NDJSON: {stats}")
+        return stats
+
+    def _recompute_summary_state(self, users: Iterable[str]):
+        """Recalcula el watermark a partir de resúmenes y mensajes (tras un import)."""
+        with self._conn() as conn:
+            for uid in users:
+                row = conn.execute(
+                    "SELECT COALESCE(MAX(messages_to), 0) FROM summaries WHERE user_id = ?", (uid,),
+                ).fetchone()
+                last_id = row[0]
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE user_id = ? AND id > ?", (uid, last_id),
+                ).fetchone()[0]
+                conn.execute(
+                    """INSERT INTO summary_state (user_id, last_summarized_id, unsummarized_count)
+                       VALUES (?, ?, ?)
+                       ON CONFLICT(user_id) DO UPDATE SET
+                           last_summarized_id = excluded.last_summarized_id,
+                           unsummarized_count = excluded.unsummarized_count""",
+                    (uid, last_id, pending),
+                )
+
+    # ─── Caché de contexto ────────────────────────────────────
+
+    def _cache_append(self, user_id: str, role: str, content: str):
+        """Write-through: agrega el mensaje al contexto cacheado del usuario."""
+        def _append(ctx: list[dict]) -> list[dict]:
+            head = ctx[:1] if ctx and ctx[0]["role"] == "system" else []
+            recent = ctx[len(head):] + [{"role": role, "content": content}]
+            return head + recent[-RECENT_PAIRS * 2:]
+
+        with self._cache_lock:
+            self._cache_versions[user_id] += 1
+            self._context_cache.update(user_id, _append)
+
+    def invalidate_context(self, user_id: str):
+        """Descarta el contexto cacheado del usuario."""
+        with self._cache_lock:
+            self._cache_versions[user_id] += 1
+            self._context_cache.invalidate(user_id)
+
+    def get_context_cache_stats(self) -> dict:
+        return self._context_cache.get_stats()
 
     # ─── Resúmenes ────────────────────────────────────────────
 
     def save_summary(self, user_id: str, summary: str, msg_from: int, msg_to: int):
-        """Guarda un resumen compactado de un rango de mensajes."""
+        """Guarda un resumen compactado de un rango de mensajes y avanza el watermark."""
         with self._conn() as conn:
             conn.execute(
                 """INSERT INTO summaries (user_id, summary, messages_from, messages_to, created_at)
                    VALUES (?, ?, ?, ?, ?)""",
                 (user_id, summary, msg_from, msg_to, time.time()),
             )
+            # Descontar solo los mensajes entre el watermark anterior y msg_to
+            conn.execute(
+                """UPDATE summary_state
+                   SET unsummarized_count = MAX(0, unsummarized_count - (
+                           SELECT COUNT(*) FROM messages
+                           WHERE user_id = ? AND id > last_summarized_id AND id <= ?
+                       )),
+                       last_summarized_id = MAX(last_summarized_id, ?)
+                   WHERE user_id = ?""",
+                (user_id, msg_to, msg_to, user_id),
+            )
+        self.invalidate_context(user_id)
 
-    def get_summaries(self, user_id: str) -> list[str]:
-        """Devuelve todos los resúmenes de un usuario, ordenados cronológicamente."""
+    def get_summaries(self, user_id: str, max_tokens: int | None = None) -> list[str]:
+        """
+        Devuelve los resúmenes de un usuario, ordenados cronológicamente.
+        Con `max_tokens`, conserva solo los más recientes que caben en ese tope
+        (recortando el más reciente si por sí solo lo rebasa).
+        """
         with self._conn() as conn:
             rows = conn.execute(
                 """SELECT summary FROM summaries
                    WHERE user_id = ?
-                   ORDER BY messages_from ASC""",
+                   ORDER BY messages_from DESC""",
                 (user_id,),
             ).fetchall()
-        return [r[0] for r in rows]
+        if max_tokens is None:
+            return [r[0] for r in reversed(rows)]
+
+        kept: list[str] = []
+        used = 0
+        for (text,) in rows:
+            tokens = count_tokens(text)
+            if used + tokens > max_tokens:
+                if not kept:
+                    kept.append(truncate_to_tokens(text, max_tokens))
+                break
+            kept.append(text)
+            used += tokens
+        return list(reversed(kept))
+
+    def compact_summaries(self, user_id: str, summarize_fn: Callable[[str], str]) -> int:
+        """
+        Pliega los resúmenes más viejos del usuario en resúmenes-de-resúmenes
+        mientras el total rebase `summary_token_budget`. Devuelve cuántos pliegues hizo.
+        """
+        folds = 0
+        while folds < MAX_FOLDS_PER_PASS:
+            with self._conn() as conn:
+                rows = conn.execute(
+                    """SELECT id, summary, messages_from, messages_to, level
+                       FROM summaries WHERE user_id = ?
+                       ORDER BY messages_from ASC""",
+                    (user_id,),
+                ).fetchall()
+            total = sum(count_tokens(r[1]) for r in rows)
+            if total <= self._summary_token_budget or len(rows) < 2:
+                break
+
+            group = rows[:SUMMARY_FANOUT]
+            joined = "\n---\n".join(r[1] for r in group)
+            folded = summarize_fn(
+                f"Combina estos resúmenes de conversaciones anteriores en UNO solo de máximo "
+                f"5 oraciones. Conserva nombres, fechas, decisiones y datos clave; "
+                f"descarta lo repetido:\n\n{joined}"
+            )
+            if not folded or folded.startswith("❌"):
+                break  # get_summaries(max_tokens=...) sigue garantizando el tope
+
+            with self._conn() as conn:
+                conn.executemany("DELETE FROM summaries WHERE id = ?", [(r[0],) for r in group])
+                conn.execute(
+                    """INSERT INTO summaries
+                       (user_id, summary, messages_from, messages_to, created_at, level)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (user_id, folded, group[0][2], max(r[3] for r in group),
+                     time.time(), max(r[4] for r in group) + 1),
+                )
+            folds += 1
+        if folds:
+            self.invalidate_context(user_id)
+        return folds
 
     def get_last_summarized_id(self, user_id: str) -> int:
         """ID del último mensaje ya resumido."""
+        return self.get_summary_state(user_id)[0]
+
+    def get_summary_state(self, user_id: str, flush: bool = True) -> tuple[int, int]:
+        """
+        (último id resumido, mensajes sin resumir) — lookup por llave primaria.
+        Con flush=False no espera a los mensajes encolados (write-behind).
+        """
+        if flush:
+            self._ensure_visible(user_id)
         with self._conn() as conn:
             row = conn.execute(
-                "SELECT MAX(messages_to) FROM summaries WHERE user_id = ?",
+                "SELECT last_summarized_id, unsummarized_count FROM summary_state WHERE user_id = ?",
                 (user_id,),
             ).fetchone()
-        return row[0] if row and row[0] else 0
+        return (row[0], row[1]) if row else (0, 0)
+
+    def needs_summary(self, user_id: str, flush: bool = True) -> bool:
+        """True si hay suficientes mensajes sin resumir fuera de la ventana reciente."""
+        _, pending = self.get_summary_state(user_id, flush=flush)
+        return pending - RECENT_PAIRS * 2 >= MIN_TO_SUMMARIZE
 
     # ─── Contexto para LLM ───────────────────────────────────
 
@@ -176,20 +1109,35 @@ class ConversationDB:
         1. Resúmenes compactados del historial viejo (si existen)
         2. Últimos RECENT_PAIRS*2 mensajes completos
 
-        Si `summarize_fn` se proporciona y hay mensajes viejos sin resumir,
-        los compacta automáticamente.
+        Si hay resúmenes en segundo plano (`start_background_summaries`), solo
+        encola la compactación y usa los resúmenes que existan en este momento.
+        Si no, y `summarize_fn` se proporciona, compacta de forma síncrona.
+
+        El resultado se cachea por usuario: los mensajes nuevos se agregan al
+        caché (write-through) y resumir o borrar historial lo invalida.
 
         Returns:
             [{"role": "system"|"user"|"assistant", "content": "..."}]
         """
-        context = []
-
-        # 1. Auto-compactar mensajes viejos si hay función de resumen
-        if summarize_fn:
+        # 1. Auto-compactar mensajes viejos (en segundo plano si hay worker)
+        if self._summary_worker is not None:
+            # El watermark puede ir unos ms detrás de la cola write-behind; basta
+            if self.needs_summary(user_id, flush=False):
+                self._summary_worker.enqueue(user_id)
+        elif summarize_fn:
             self._auto_summarize(user_id, summarize_fn)
 
-        # 2. Agregar resúmenes existentes como contexto del sistema
-        summaries = self.get_summaries(user_id)
+        cached = self._context_cache.get(user_id)
+        if cached is not None:
+            return [dict(m) for m in cached]
+
+        with self._cache_lock:
+            version = self._cache_versions[user_id]
+        context = []
+        self._ensure_visible(user_id)
+
+        # 2. Agregar resúmenes existentes (con tope de tokens) como contexto del sistema
+        summaries = self.get_summaries(user_id, max_tokens=self._summary_token_budget)
         if summaries:
             combined = "\n---\n".join(summaries)
             context.append({
@@ -203,36 +1151,42 @@ class ConversationDB:
         recent = self.get_history(user_id, limit=RECENT_PAIRS * 2)
         context.extend(recent)
 
+        with self._cache_lock:
+            if self._cache_versions[user_id] == version:
+                self._context_cache.put(user_id, [dict(m) for m in context])
         return context
 
-    def _auto_summarize(self, user_id: str, summarize_fn: Callable[[str], str]):
+    def start_background_summaries(self, summarize_fn: Callable[[str], str]) -> SummaryWorker:
+        """Activa el worker que compacta historial viejo fuera del request."""
+        if self._summary_worker is None:
+            self._summary_worker = SummaryWorker(self, summarize_fn)
+        return self._summary_worker
+
+    def get_summary_worker_stats(self) -> dict | None:
+        return self._summary_worker.get_stats() if self._summary_worker else None
+
+    def _auto_summarize(self, user_id: str, summarize_fn: Callable[[str], str]) -> bool:
         """
-        Si hay más de RECENT_PAIRS*2 mensajes sin resumir,
-        compacta los bloques viejos en resúmenes.
+        Si hay más de RECENT_PAIRS*2 mensajes sin resumir (según el watermark),
+        compacta los más viejos en un resumen. Devuelve True si guardó uno.
         """
-        total = self.count_messages(user_id)
-        recent_count = RECENT_PAIRS * 2
-        if total <= recent_count:
-            return  # No hay nada viejo que resumir
-
-        last_summarized = self.get_last_summarized_id(user_id)
+        last_summarized, pending = self.get_summary_state(user_id)
+        # Los mensajes a resumir son los que están FUERA de la ventana reciente
+        to_compact = pending - RECENT_PAIRS * 2
+        if to_compact < MIN_TO_SUMMARIZE:
+            return False  # No vale la pena resumir menos de 3 pares
 
-        # Obtener mensajes no resumidos que ya no están en la ventana reciente
+        # Traer solo la ventana exacta a compactar (como máximo SUMMARY_WINDOW)
         with self._conn() as conn:
-            rows = conn.execute(
+            to_summarize = conn.execute(
                 """SELECT id, role, content FROM messages
                    WHERE user_id = ? AND id > ?
-                   ORDER BY timestamp ASC, id ASC""",
-                (user_id, last_summarized),
+                   ORDER BY timestamp ASC, id ASC
+                   LIMIT ?""",
+                (user_id, last_summarized, min(to_compact, SUMMARY_WINDOW)),
             ).fetchall()
-
-        if len(rows) <= recent_count:
-            return
-
-        # Los mensajes a resumir son los que están FUERA de la ventana reciente
-        to_summarize = rows[:-recent_count]
-        if len(to_summarize) < 6:
-            return  # No vale la pena resumir menos de 3 pares
+        if len(to_summarize) < MIN_TO_SUMMARIZE:
+            return False
 
         # Construir texto para resumir
         lines = []
@@ -252,6 +1206,91 @@ class ConversationDB:
             msg_from = to_summarize[0][0]
             msg_to = to_summarize[-1][0]
             self.save_summary(user_id, summary, msg_from, msg_to)
+            self.compact_summaries(user_id, summarize_fn)
+            return True
+        return False
+
+
+# ══════════════════════════════════════════════════════════════
+# Resúmenes en segundo plano
+# ══════════════════════════════════════════════════════════════
+
+class SummaryWorker:
+    """
+    Hilo que compacta historial viejo sin bloquear el /chat.
+
+    La cola deduplica por usuario: si un usuario ya está encolado, volver a
+    pedirlo no agrega trabajo. Si después de un resumen aún queda backlog
+    (más de SUMMARY_WINDOW mensajes pendientes), el usuario se re-encola.
+    """
+
+    def __init__(self, db: ConversationDB, summarize_fn: Callable[[str], str]):
+        self._db = db
+        self._summarize_fn = summarize_fn
+        self._queue: queue.Queue = queue.Queue()
+        self._queued: dict[str, float] = {}  # user_id → momento en que se encoló
+        self._lock = threading.Lock()
+        self._stats = {
+            "processed": 0,
+            "summaries_saved": 0,
+            "errors": 0,
+            "last_lag_s": 0.0,
+            "max_lag_s": 0.0,
+            "last_duration_s": 0.0,
+        }
+        self._thread = threading.Thread(
+            target=self._run, name="conversation-summary-worker", daemon=True,
+        )
+        self._thread.start()
+
+    def enqueue(self, user_id: str) -> bool:
+        """Encola la compactación del usuario. False si ya estaba en la cola."""
+        with self._lock:
+            if user_id in self._queued:
+                return False
+            self._queued[user_id] = time.time()
+        self._queue.put(user_id)
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+    def _run(self):
+        while True:
+            user_id = self._queue.get()
+            if user_id is None:
+                break
+            with self._lock:
+                enqueued_at = self._queued.pop(user_id, time.time())
+            started = time.time()
+            lag = started - enqueued_at
+            try:
+                saved = self._db._auto_summarize(user_id, self._summarize_fn)
+                if saved and self._db.needs_summary(user_id):
+                    self.enqueue(user_id)  # todavía hay backlog viejo
+            except Exception as e:
+                saved = False
+                with self._lock:
+                    self._stats["errors"] += 1
+                logger.warning(f"⚠️ Error resumiendo historial de {user_id}: {e}")
+            with self._lock:
+                self._stats["processed"] += 1
+                self._stats["summaries_saved"] += int(bool(saved))
+                self._stats["last_lag_s"] = round(lag, 3)
+                self._stats["max_lag_s"] = round(max(self._stats["max_lag_s"], lag), 3)
+                self._stats["last_duration_s"] = round(time.time() - started, 3)
+
+    def get_stats(self) -> dict:
+        """Profundidad de la cola, lag (espera en cola) y contadores."""
+        now = time.time()
+        with self._lock:
+            oldest = min(self._queued.values(), default=None)
+            return {
+                **self._stats,
+                "queue_depth": len(self._queued),
+                "oldest_wait_s": round(now - oldest, 3) if oldest else 0.0,
+            }
 
 
 # ══════════════════════════════════════════════════════════════
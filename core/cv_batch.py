@@ -0,0 +1,399 @@
+"""
+cv_batch.py — Evaluación de CVs por lotes, con salida JSON estricta.
+
+En lugar de una evaluación en texto libre por llamada (y regex para sacar
+nombre / nivel / veredicto), cada CV se evalúa pidiendo un objeto JSON con
+esquema fijo:
+
+    {"name": str | null, "skills": [str], "level": "Junior|Mid|Senior|Lead",
+     "verdict": "Contratar|Considerar|Pasar", "score": 0-100,
+     "role": str | null, "summary": str}
+
+    • Concurrencia acotada POR PROVEEDOR (Groq / Mistral / Ollama, cada uno
+      con su semáforo): un lote usa todos los proveedores disponibles a la
+      vez y, si uno falla o devuelve JSON inválido, el CV pasa al siguiente.
+    • Los resultados se escriben a la KB por lotes (evaluaciones, personas
+      y hechos, cada grupo en una transacción) conforme van llegando.
+
+Uso:
+    from core.cv_batch import BatchCVEvaluator, providers_from_clients
+    evaluator = BatchCVEvaluator(kb, providers_from_clients(groq=groq, mistral=mistral, ollama=ollama))
+    report = evaluator.evaluate_documents(kb.pending_cv_ids(user_id="rh"))
+
+CLI (evalúa los CVs pendientes):
+    python -m core.cv_batch --user-id rh --limit 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from core.knowledge_db import KnowledgeBase
+
+logger = logging.getLogger(__name__)
+
+
+LEVELS = ("Junior", "Mid", "Senior", "Lead")
+VERDICTS = ("Contratar", "Considerar", "Pasar")
+MAX_SKILLS = 12
+CV_MAX_CHARS = 3000          # mismo recorte que EvaluateCVAdapter
+EVAL_TEMPERATURE = 0.2
+EVAL_MAX_TOKENS = 700
+WRITE_BATCH_SIZE = 25        # evaluaciones por escritura a la KB
+DEFAULT_CONCURRENCY = {"groq": 4, "mistral": 2, "ollama": 1}
+
+CV_EVAL_SCHEMA = {
+    "type": "object",
+    "required": ["name", "skills", "level", "verdict", "score"],
+    "properties": {
+        "name": {"type": ["string", "null"], "description": "Nombre completo del candidato"},
+        "skills": {"type": "array", "items": {"type": "string"}, "maxItems": MAX_SKILLS},
+        "level": {"enum": list(LEVELS)},
+        "verdict": {"enum": list(VERDICTS)},
+        "score": {"type": "integer", "minimum": 0, "maximum": 100},
+        "role": {"type": ["string", "null"], "description": "Puesto donde rendiría más"},
+        "summary": {"type": "string", "description": "Perfil y justificación en 2-3 líneas"},
+    },
+}
+
+_SYSTEM_PROMPT = f"""Eres un experto de Recursos Humanos de Axoloit, una startup mexicana de tecnología.
+Evalúas CVs y respondes ÚNICAMENTE con un objeto JSON (sin texto extra ni markdown) que cumpla este esquema:
+
+{json.dumps(CV_EVAL_SCHEMA, ensure_ascii=False, indent=1)}
+
+- skills: las habilidades técnicas más fuertes, nombres cortos ("Python", "AWS").
+- score: qué tan buen candidato es en general (0-100).
+- name: null si el CV no trae nombre. Sé directo y honesto."""
+
+
+class EvaluationError(ValueError):
+    """El proveedor no respondió o su JSON no cumple el esquema."""
+
+
+# ─── Esquema ──────────────────────────────────────────────────
+
+def _pick(value, allowed: tuple[str, ...], field_name: str) -> str:
+    if isinstance(value, str):
+        for option in allowed:
+            if value.strip().lower() == option.lower():
+                return option
+    raise EvaluationError(f"'{field_name}' inválido: {value!r}")
+
+
+def parse_evaluation(raw: str) -> dict:
+    """Valida y normaliza la respuesta JSON del LLM; EvaluationError si no cumple el esquema."""
+    text = re.sub(r"^```(?:json)?|```$", "", (raw or "").strip()).strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise EvaluationError("La respuesta no contiene un objeto JSON")
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise EvaluationError(f"JSON inválido: {e}") from e
+    if not isinstance(data, dict):
+        raise EvaluationError("La respuesta no es un objeto JSON")
+    missing = [k for k in CV_EVAL_SCHEMA["required"] if k not in data]
+    if missing:
+        raise EvaluationError(f"Faltan campos: {', '.join(missing)}")
+
+    name = data["name"]
+    if name is not None and not isinstance(name, str):
+        raise EvaluationError(f"'name' inválido: {name!r}")
+    name = " ".join(name.split()) if name else None
+    skills = data["skills"]
+    if not isinstance(skills, list) or not all(isinstance(s, str) for s in skills):
+        raise EvaluationError("'skills' debe ser una lista de textos")
+    score = data["score"]
+    if isinstance(score, str) and score.strip().isdigit():
+        score = int(score.strip())
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 100:
+        raise EvaluationError(f"'score' inválido: {score!r}")
+    role = data.get("role")
+    summary = data.get("summary")
+    return {
+        "name": name or None,
+        "skills": list(dict.fromkeys(s.strip()[:100] for s in skills if s.strip()))[:MAX_SKILLS],
+        "level": _pick(data["level"], LEVELS, "level"),
+        "verdict": _pick(data["verdict"], VERDICTS, "verdict"),
+        "score": int(round(score)),
+        "role": role.strip() if isinstance(role, str) and role.strip() else None,
+        "summary": summary.strip() if isinstance(summary, str) else "",
+    }
+
+
+def render_evaluation(data: dict) -> str:
+    """Texto que se guarda en documents.evaluation (lo que lee el contexto del LLM)."""
+    lines = [
+        f"Nombre: {data['name'] or 'sin nombre'}",
+        f"Nivel sugerido: {data['level']}",
+        f"Veredicto: {data['verdict']}",
+        f"Puntaje: {data['score']}/100",
+    ]
+    if data.get("role"):
+        lines.append(f"Puesto recomendado: {data['role']}")
+    if data["skills"]:
+        lines.append(f"Fortalezas: {', '.join(data['skills'])}")
+    if data.get("summary"):
+        lines.append(f"Resumen: {data['summary']}")
+    return "\n".join(lines)
+
+
+# ─── Proveedores ──────────────────────────────────────────────
+
+@dataclass
+class Provider:
+    """Un LLM con su límite de llamadas simultáneas. chat(messages, temperature, max_tokens) → str | None."""
+    name: str
+    chat: Callable[[list[dict], float, int], str | None]
+    concurrency: int = 1
+    stats: Counter = field(default_factory=Counter)
+
+    def __post_init__(self):
+        self.semaphore = threading.BoundedSemaphore(max(1, self.concurrency))
+
+
+def providers_from_clients(groq=None, mistral=None, ollama=None, concurrency: dict | None = None) -> list[Provider]:
+    """Proveedores disponibles (en orden de preferencia), con JSON mode activado."""
+    limits = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+    providers = []
+    for name, client in (("groq", groq), ("mistral", mistral)):
+        if client is not None and getattr(client, "client", None):
+            providers.append(Provider(
+                name,
+                lambda m, t, k, c=client: c.chat(m, temperature=t, max_tokens=k, json_mode=True),
+                limits[name],
+            ))
+    if ollama is not None:
+        providers.append(Provider(
+            "ollama",
+            lambda m, t, k: ollama.chat(m, temperature=t, max_tokens=k, json_mode=True),
+            limits["ollama"],
+        ))
+    return providers
+
+
+# ─── Evaluador ────────────────────────────────────────────────
+
+class BatchCVEvaluator:
+    """Evalúa muchos CVs a la vez repartiéndolos entre proveedores y los guarda en la KB."""
+
+    def __init__(self, knowledge_base: KnowledgeBase, providers: list[Provider]):
+        self.kb = knowledge_base
+        self.providers = providers
+        self.max_workers = sum(p.concurrency for p in providers) or 1
+
+    @staticmethod
+    def _messages(cv_text: str, context: str = "") -> list[dict]:
+        user = f"CV DEL CANDIDATO:\n{cv_text[:CV_MAX_CHARS]}"
+        if context:
+            user += f"\n\nCONTEXTO DE LA EMPRESA / NECESIDADES:\n{context}"
+        return [{"role": "system", "content": _SYSTEM_PROMPT}, {"role": "user", "content": user}]
+
+    def _call(self, messages: list[dict], start: int = 0) -> tuple[str, dict]:
+        """
+        (proveedor, evaluación). Empieza por un proveedor con cupo libre (rotando
+        desde `start`); si falla o su JSON no cumple el esquema, prueba el siguiente.
+        """
+        if not self.providers:
+            raise EvaluationError("No hay proveedores de IA configurados")
+        k = start % len(self.providers)
+        remaining = self.providers[k:] + self.providers[:k]
+        errors = []
+        while remaining:
+            # El primero con cupo libre; si todos están ocupados, esperar al siguiente en turno
+            provider = next((p for p in remaining if p.semaphore.acquire(blocking=False)), None)
+            if provider is None:
+                provider = remaining[0]
+                provider.semaphore.acquire()
+            remaining.remove(provider)
+            try:
+                provider.stats["calls"] += 1
+                raw = provider.chat(messages, EVAL_TEMPERATURE, EVAL_MAX_TOKENS)
+                error = "sin respuesta"
+            except Exception as e:
+                raw, error = None, str(e)
+            finally:
+                provider.semaphore.release()
+            if not raw:
+                provider.stats["failed"] += 1
+                errors.append(f"{provider.name}: {error}")
+                continue
+            try:
+                return provider.name, parse_evaluation(raw)
+            except EvaluationError as e:
+                provider.stats["invalid"] += 1
+                errors.append(f"{provider.name}: {e}")
+        raise EvaluationError("; ".join(errors))
+
+    def evaluate_text(self, cv_text: str, context: str = "") -> dict:
+        """Evaluación estructurada de un CV (sin guardar nada), con `provider`."""
+        provider, data = self._call(self._messages(cv_text, context))
+        return {**data, "provider": provider}
+
+    def evaluate_batch(
+        self,
+        items: list[dict],
+        context: str = "",
+        on_progress: Callable[[dict], None] | None = None,
+    ) -> dict:
+        """
+        Evalúa y guarda un lote. Cada item: {"doc_id", "text", "user_id"}.
+
+        Returns:
+            {"total", "evaluated", "failed", "by_provider": {nombre: n},
+             "elapsed_s", "docs_per_s", "results": [{"doc_id", "name", "score",
+             "verdict", "level", "provider"}], "errors"}
+        """
+        start = time.time()
+        report = {"total": len(items), "evaluated": 0, "failed": 0, "by_provider": Counter(),
+                  "elapsed_s": 0.0, "docs_per_s": 0.0, "results": [], "errors": []}
+        pending: list[tuple[dict, dict]] = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(self._call, self._messages(item["text"], context), i): item
+                for i, item in enumerate(items)
+            }
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    provider, data = future.result()
+                except Exception as e:
+                    report["failed"] += 1
+                    report["errors"].append(f"doc {item['doc_id']}: {e}")
+                    continue
+                report["evaluated"] += 1
+                report["by_provider"][provider] += 1
+                report["results"].append({
+                    "doc_id": item["doc_id"], "name": data["name"], "score": data["score"],
+                    "verdict": data["verdict"], "level": data["level"], "provider": provider,
+                })
+                pending.append((item, data))
+                if len(pending) >= WRITE_BATCH_SIZE:
+                    self._write_back(pending)
+                    pending = []
+                if on_progress:
+                    on_progress({k: v for k, v in report.items() if k != "results"})
+        if pending:
+            self._write_back(pending)
+
+        elapsed = time.time() - start
+        report["elapsed_s"] = round(elapsed, 2)
+        report["docs_per_s"] = round(report["evaluated"] / max(elapsed, 1e-6), 2)
+        report["by_provider"] = dict(report["by_provider"])
+        report["results"].sort(key=lambda r: -r["score"])
+        logger.info(
+            f"🧾 Evaluación por lotes: {report['evaluated']}/{report['total']} CVs "
+            f"en {report['elapsed_s']}s ({report['by_provider']})"
+        )
+        return report
+
+    def evaluate_documents(self, doc_ids: list[int], context: str = "", on_progress=None) -> dict:
+        """Evalúa documentos que ya están en la KB (cada uno se guarda a nombre de su usuario)."""
+        items = [
+            {"doc_id": d["id"], "text": d["content"], "user_id": d["user_id"]}
+            for d in self.kb.get_documents(doc_ids)
+        ]
+        return self.evaluate_batch(items, context=context, on_progress=on_progress)
+
+    def _write_back(self, results: list[tuple[dict, dict]]):
+        """Evaluaciones, personas y hechos de un grupo de resultados, cada uno en una transacción."""
+        named = [(item, data) for item, data in results if data["name"]]
+        self.kb.store_people_bulk([
+            {"name": data["name"], "skills": data["skills"] or None, "level": data["level"],
+             "verdict": data["verdict"], "role": data["role"], "added_by": item["user_id"]}
+            for item, data in named
+        ])
+        self.kb.update_evaluations_bulk([
+            {"doc_id": item["doc_id"], "evaluation": render_evaluation(data), "person_name": data["name"]}
+            for item, data in results
+        ])
+        self.kb.add_facts_bulk([
+            {"person_name": data["name"], "user_id": item["user_id"], "source": "cv_eval",
+             "fact": f"CV evaluado: {data['score']}/100, {data['verdict']}. Doc ID: {item['doc_id']}"}
+            for item, data in named
+        ])
+
+    def get_stats(self) -> dict:
+        return {p.name: {"concurrency": p.concurrency, **p.stats} for p in self.providers}
+
+
+# ─── Jobs en segundo plano (para el endpoint HTTP) ────────────
+
+_jobs: dict[str, dict] = {}
+_jobs_lock = threading.Lock()
+
+
+def start_evaluation_job(
+    evaluator: BatchCVEvaluator, doc_ids: list[int], context: str = "",
+) -> str:
+    """Lanza `evaluate_documents` en un hilo y devuelve el id del job (ver `get_job`)."""
+    job_id = uuid.uuid4().hex[:12]
+    job = {"id": job_id, "status": "running", "documents": len(doc_ids),
+           "progress": None, "report": None, "error": None}
+    with _jobs_lock:
+        _jobs[job_id] = job
+
+    def _run():
+        try:
+            job["report"] = evaluator.evaluate_documents(
+                doc_ids, context=context, on_progress=lambda snapshot: job.update(progress=snapshot),
+            )
+            job["status"] = "done"
+        except Exception as e:
+            logger.error(f"❌ Error en evaluación por lotes: {e}")
+            job["status"] = "error"
+            job["error"] = str(e)
+
+    threading.Thread(target=_run, name=f"cv-eval-{job_id}", daemon=True).start()
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+# ─── CLI ──────────────────────────────────────────────────────
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Evalúa por lotes los CVs de la KB que no tienen evaluación")
+    parser.add_argument("--user-id", default=None, help="Solo los CVs de este usuario")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--context", default="", help="Necesidades de la empresa / vacante")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    from core.ai_clients import GroqClient, MistralClient, OllamaClient
+    from core.embeddings import get_embedder
+    from core.knowledge_db import KnowledgeBase
+
+    kb = KnowledgeBase(embedder=get_embedder())
+    evaluator = BatchCVEvaluator(kb, providers_from_clients(GroqClient(), MistralClient(), OllamaClient()))
+    report = evaluator.evaluate_documents(kb.pending_cv_ids(args.user_id, args.limit), context=args.context)
+    kb.close()
+    print(
+        f"\n📊 {report['evaluated']}/{report['total']} evaluados · {report['failed']} fallidos · "
+        f"{report['docs_per_s']} CVs/s · {report['by_provider']}"
+    )
+    for r in report["results"][:20]:
+        print(f"   {r['score']:>3}  {r['verdict']:<10} {r['level']:<6} {r['name'] or '(sin nombre)'}")
+    for err in report["errors"][:20]:
+        print(f"   ⚠️ {err}")
+
+
+if __name__ == "__main__":
+    main()
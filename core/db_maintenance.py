@@ -0,0 +1,256 @@
+"""
+db_maintenance.py — Mantenimiento de las bases SQLite locales
+(data/conocimiento.db y data/conversaciones.db).
+
+    • Contadores mantenidos por triggers (tabla `table_counts`): las
+      estadísticas leen una fila en lugar de hacer COUNT(*) / SUM() sobre
+      toda la tabla en cada /stats.
+    • run_maintenance(): incremental_vacuum, PRAGMA optimize y
+      wal_checkpoint(TRUNCATE), con tiempos y bytes recuperados. La primera
+      vez cambia la BD a auto_vacuum=INCREMENTAL (requiere un VACUUM completo).
+    • MaintenanceScheduler: hilo que corre el mantenimiento cuando ya pasó el
+      intervalo Y el servidor lleva un rato sin requests.
+
+Uso:
+    COUNTERS = {"cvs": TableCounter("documents", where="{row}.doc_type = 'cv'")}
+    with pool.connection() as conn:
+        install_counters(conn, COUNTERS)
+        read_counters(conn)                       # {"cvs": 12}
+    report = run_maintenance(pool, "data/conocimiento.db", COUNTERS)
+
+    scheduler = MaintenanceScheduler({"kb": kb.run_maintenance}, last_activity=lambda: ultimo_request)
+    scheduler.start()
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+COUNTERS_TABLE = "table_counts"
+AUTO_VACUUM_INCREMENTAL = 2
+OPTIMIZE_ANALYSIS_LIMIT = 400   # filas por índice que muestrea PRAGMA optimize (acota su duración)
+
+MAINTENANCE_INTERVAL_S = 6 * 3600
+MAINTENANCE_IDLE_S = 120        # sin requests durante este tiempo = servidor ocioso
+MAINTENANCE_POLL_S = 60
+
+
+# ─── Contadores por triggers ──────────────────────────────────
+
+@dataclass(frozen=True)
+class TableCounter:
+    """
+    Agregado de una tabla mantenido por triggers.
+
+    where: condición sobre la fila, con `{row}` como alias (None = todas).
+    value: expresión sumada por fila ("1" = conteo; p. ej. "{row}.n_messages").
+    """
+    table: str
+    where: str | None = None
+    value: str = "1"
+
+    def term(self, row: str) -> str:
+        value = self.value.format(row=row)
+        if self.where is None:
+            return f"({value})"
+        return f"(CASE WHEN COALESCE({self.where.format(row=row)}, 0) THEN {value} ELSE 0 END)"
+
+
+def install_counters(conn, counters: dict[str, TableCounter]):
+    """
+    Crea los triggers de cada contador y siembra su valor inicial (solo para
+    contadores nuevos, en la misma transacción que los triggers).
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {COUNTERS_TABLE} (
+            name  TEXT    PRIMARY KEY,
+            n     INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    existing = {r[0] for r in conn.execute(f"SELECT name FROM {COUNTERS_TABLE}")}
+    for name, counter in counters.items():
+        update = f"UPDATE {COUNTERS_TABLE} SET n = n {{op}} {{term}} WHERE name = '{name}';"
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_count_{name}_insert AFTER INSERT ON {counter.table}
+            BEGIN {update.format(op="+", term=counter.term("NEW"))} END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_count_{name}_delete AFTER DELETE ON {counter.table}
+            BEGIN {update.format(op="-", term=counter.term("OLD"))} END
+        """)
+        if counter.where is not None or counter.value != "1":
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_count_{name}_update AFTER UPDATE ON {counter.table}
+                BEGIN {update.format(op="+", term=f"{counter.term('NEW')} - {counter.term('OLD')}")} END
+            """)
+        if name not in existing:
+            conn.execute(
+                f"INSERT INTO {COUNTERS_TABLE} (name, n) "
+                f"SELECT ?, COALESCE(SUM({counter.term(counter.table)}), 0) FROM {counter.table}",
+                (name,),
+            )
+
+
+def read_counters(conn, names: list[str] | None = None) -> dict[str, int]:
+    rows = conn.execute(f"SELECT name, n FROM {COUNTERS_TABLE}").fetchall()
+    return {name: n for name, n in rows if names is None or name in names}
+
+
+def reconcile_counters(conn, counters: dict[str, TableCounter]) -> dict[str, int]:
+    """Recalcula los contadores y corrige los que se desviaron. Devuelve {nombre: desviación}."""
+    drift = {}
+    current = read_counters(conn)
+    for name, counter in counters.items():
+        actual = conn.execute(
+            f"SELECT COALESCE(SUM({counter.term(counter.table)}), 0) FROM {counter.table}"
+        ).fetchone()[0]
+        if current.get(name) != actual:
+            drift[name] = actual - (current.get(name) or 0)
+            conn.execute(
+                f"INSERT INTO {COUNTERS_TABLE} (name, n) VALUES (?, ?) "
+                f"ON CONFLICT(name) DO UPDATE SET n = excluded.n",
+                (name, actual),
+            )
+    return drift
+
+
+# ─── Mantenimiento ────────────────────────────────────────────
+
+def _files_size(db_path: str) -> int:
+    return sum(
+        os.path.getsize(path)
+        for path in (db_path, f"{db_path}-wal")
+        if os.path.exists(path)
+    )
+
+
+def run_maintenance(pool, db_path: str, counters: dict[str, TableCounter] | None = None) -> dict:
+    """
+    Corre el mantenimiento completo sobre una BD del pool.
+
+    Returns:
+        {"db", "bytes_before", "bytes_after", "reclaimed_bytes", "freelist_pages",
+         "counter_drift", "checkpoint": {...}, "timings_s": {paso: s}, "duration_s"}
+    """
+    started = time.perf_counter()
+    timings: dict[str, float] = {}
+    report: dict = {"db": os.path.basename(db_path), "bytes_before": _files_size(db_path)}
+
+    def _step(name: str, fn: Callable):
+        t = time.perf_counter()
+        result = fn()
+        timings[name] = round(time.perf_counter() - t, 4)
+        return result
+
+    with pool.connection() as conn:
+        report["freelist_pages"] = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            # Cambiar el modo solo surte efecto tras un VACUUM completo (una vez por BD)
+            conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+            _step("vacuum_full", lambda: conn.execute("VACUUM"))
+        else:
+            _step("incremental_vacuum", lambda: conn.execute("PRAGMA incremental_vacuum").fetchall())
+        if counters:
+            report["counter_drift"] = _step("reconcile_counters", lambda: reconcile_counters(conn, counters))
+            conn.commit()
+        conn.execute(f"PRAGMA analysis_limit = {OPTIMIZE_ANALYSIS_LIMIT}")
+        _step("optimize", lambda: conn.execute("PRAGMA optimize").fetchall())
+        busy, log_frames, checkpointed = _step(
+            "wal_checkpoint", lambda: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone(),
+        )
+
+    report["checkpoint"] = {"busy": bool(busy), "log_frames": log_frames, "checkpointed_frames": checkpointed}
+    report["bytes_after"] = _files_size(db_path)
+    report["reclaimed_bytes"] = max(report["bytes_before"] - report["bytes_after"], 0)
+    report["timings_s"] = timings
+    report["duration_s"] = round(time.perf_counter() - started, 4)
+    report["finished_at"] = time.time()
+    logger.info(
+        f"🧽 Mantenimiento {report['db']}: {report['reclaimed_bytes'] / 1024:.0f} KB recuperados "
+        f"en {report['duration_s']:.2f}s"
+    )
+    return report
+
+
+# ─── Programador en tiempo ocioso ─────────────────────────────
+
+class MaintenanceScheduler:
+    """Corre los trabajos de mantenimiento cada `interval_s`, solo con el servidor ocioso."""
+
+    def __init__(
+        self,
+        jobs: dict[str, Callable[[], dict]],
+        interval_s: float = MAINTENANCE_INTERVAL_S,
+        idle_s: float = MAINTENANCE_IDLE_S,
+        poll_s: float = MAINTENANCE_POLL_S,
+        last_activity: Callable[[], float] | None = None,
+    ):
+        """
+        Args:
+            jobs: {nombre: función sin argumentos que devuelve su reporte}.
+            last_activity: time.time() del último request; None = siempre ocioso.
+        """
+        self.jobs = jobs
+        self.interval_s = interval_s
+        self.idle_s = idle_s
+        self.poll_s = poll_s
+        self._last_activity = last_activity
+        self._last_run = 0.0
+        self._runs = 0
+        self._reports: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _idle(self) -> bool:
+        return self._last_activity is None or time.time() - self._last_activity() >= self.idle_s
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_s):
+            if time.time() - self._last_run >= self.interval_s and self._idle():
+                self.run_now()
+
+    def run_now(self) -> dict[str, dict]:
+        """Corre todos los trabajos (uno tras otro) y devuelve sus reportes."""
+        with self._lock:
+            reports = {}
+            for name, job in self.jobs.items():
+                try:
+                    reports[name] = job()
+                except Exception as e:
+                    logger.warning(f"⚠️ Error en mantenimiento de {name}: {e}")
+                    reports[name] = {"error": str(e), "finished_at": time.time()}
+            self._reports.update(reports)
+            self._last_run = time.time()
+            self._runs += 1
+            return reports
+
+    def get_stats(self) -> dict:
+        next_in = max(self._last_run + self.interval_s - time.time(), 0) if self._last_run else 0
+        return {
+            "runs": self._runs,
+            "last_run_at": self._last_run or None,
+            "next_due_in_s": round(next_in),
+            "interval_s": self.interval_s,
+            "idle_s": self.idle_s,
+            "reports": dict(self._reports),
+        }
@@ -0,0 +1,130 @@
+"""
+embeddings.py — Embedders intercambiables para la búsqueda semántica de la KB.
+
+Un embedder convierte textos en vectores float32 normalizados (norma 1), así
+la similitud coseno es un simple producto punto.
+
+    OllamaEmbedder   — endpoint de embeddings de Ollama local (semántico real)
+    HashingEmbedder  — determinista y sin dependencias: palabras + trigramas
+                       hasheados. Sirve para pruebas y como respaldo sin Ollama.
+
+Uso:
+    from core.embeddings import get_embedder
+    emb = get_embedder()                  # según KB_EMBEDDER (ollama | hash | none)
+    vecs = emb.embed(["Python y AWS Lambda", "Contador con SAP"])  # (2, dim) float32
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+OLLAMA_URL = "http://localhost:11434"
+OLLAMA_EMBED_MODEL = "nomic-embed-text"
+HASH_DIM = 384
+OLLAMA_RETRY_S = 60  # tras un fallo, no reintentar contra Ollama durante este tiempo
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def _fold(text: str) -> str:
+    """Minúsculas y sin acentos."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+class HashingEmbedder:
+    """Embedder determinista: palabras y trigramas de caracteres → `dim` cubetas con signo."""
+
+    def __init__(self, dim: int = HASH_DIM):
+        self.dim = dim
+        self.name = f"hash-{dim}"
+
+    def _features(self, text: str) -> list[str]:
+        words = re.findall(r"\w+", _fold(text))
+        feats = list(words)
+        for w in words:
+            padded = f"#{w}#"
+            feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return feats
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat in self._features(text or ""):
+                h = zlib.crc32(feat.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        return _normalize(out)
+
+
+class OllamaEmbedder:
+    """Embeddings vía Ollama (`/api/embed`, con respaldo a `/api/embeddings`)."""
+
+    def __init__(self, model: str = OLLAMA_EMBED_MODEL, url: str = OLLAMA_URL, timeout: float = 30):
+        self.model = model
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.name = f"ollama:{model}"
+        self._retry_at = 0.0
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        if time.monotonic() < self._retry_at:
+            raise RuntimeError("Ollama no disponible (reintento pendiente)")
+        try:
+            return self._embed(texts)
+        except Exception:
+            self._retry_at = time.monotonic() + OLLAMA_RETRY_S
+            raise
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        response = requests.post(
+            f"{self.url}/api/embed",
+            json={"model": self.model, "input": texts},
+            timeout=self.timeout,
+        )
+        if response.status_code == 404:
+            # Ollama < 0.3: un texto por request
+            vectors = [self._embed_one(t) for t in texts]
+        else:
+            response.raise_for_status()
+            vectors = response.json()["embeddings"]
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def _embed_one(self, text: str) -> list[float]:
+        response = requests.post(
+            f"{self.url}/api/embeddings",
+            json={"model": self.model, "prompt": text},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["embedding"]
+
+
+def get_embedder(kind: str | None = None):
+    """
+    Embedder según `kind` o la variable KB_EMBEDDER:
+    "ollama" (default), "hash", o "none" para desactivar la búsqueda semántica.
+    """
+    kind = (kind or os.getenv("KB_EMBEDDER", "ollama")).lower()
+    if kind == "none":
+        return None
+    if kind == "hash":
+        return HashingEmbedder()
+    return OllamaEmbedder(
+        model=os.getenv("OLLAMA_EMBED_MODEL", OLLAMA_EMBED_MODEL),
+        url=os.getenv("OLLAMA_URL", OLLAMA_URL),
+    )
@@ -0,0 +1,191 @@
+"""
+gazetteer.py — Detección de menciones de personas conocidas en un texto.
+
+Autómata Aho-Corasick sobre texto "plegado" (minúsculas, sin acentos,
+espacios colapsados): encuentra TODAS las apariciones de todos los nombres
+y alias en una sola pasada lineal sobre el mensaje, sin importar cuántas
+personas haya en la KB. Solo cuenta coincidencias de palabra completa
+("Ana" no coincide dentro de "banana") y, si dos se traslapan, gana la
+más larga ("Juan Pérez" sobre "Juan").
+
+Los nombres se agregan / quitan en caliente; el autómata se reconstruye
+de forma perezosa en la siguiente búsqueda (O(total de caracteres)).
+
+Uso:
+    gaz = Gazetteer()
+    gaz.add(1, ["Juan Pérez", "JP"])
+    gaz.add(2, ["María José López"])
+    gaz.find("¿Qué opinas de juan perez y de MARIA JOSE LOPEZ?")
+    # [Mention(person_ids=(1,), alias="juan perez", start=15, end=25, text="juan perez"), ...]
+"""
+
+from __future__ import annotations
+
+import threading
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+
+MIN_ALIAS_CHARS = 3     # alias más cortos generan demasiados falsos positivos
+
+
+def fold(text: str) -> tuple[str, list[int]]:
+    """
+    Texto plegado y, por cada carácter plegado, su índice en el original
+    (para devolver las menciones con offsets del texto real).
+    """
+    chars: list[str] = []
+    offsets: list[int] = []
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            if chars and chars[-1] != " ":
+                chars.append(" ")
+                offsets.append(i)
+            continue
+        for c in unicodedata.normalize("NFKD", ch.lower()):
+            if not unicodedata.combining(c):
+                chars.append(c)
+                offsets.append(i)
+    return "".join(chars), offsets
+
+
+def fold_alias(alias: str) -> str:
+    return fold(alias)[0].strip()
+
+
+@dataclass(frozen=True)
+class Mention:
+    person_ids: tuple[int, ...]   # más de uno si el alias es ambiguo
+    alias: str                    # alias plegado que coincidió
+    start: int                    # offsets en el texto original
+    end: int
+    text: str
+
+
+class AhoCorasick:
+    """Autómata inmutable: patrón plegado → payload."""
+
+    def __init__(self, patterns: dict[str, object]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[int, object]]] = [[]]
+        for pattern, payload in patterns.items():
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append((len(pattern), payload))
+
+        # Enlaces de falla por BFS; cada estado hereda las salidas de su falla
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def iter(self, text: str):
+        """(fin exclusivo, largo, payload) de cada aparición de cada patrón."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, payload in out[state]:
+                yield i + 1, length, payload
+
+
+class Gazetteer:
+    """Nombres / alias de personas → ids, con búsqueda Aho-Corasick."""
+
+    def __init__(self, min_chars: int = MIN_ALIAS_CHARS):
+        self.min_chars = min_chars
+        self._patterns: dict[str, set[int]] = {}
+        self._by_person: dict[int, set[str]] = {}
+        self._automaton: AhoCorasick | None = None
+        self._lock = threading.Lock()
+        self._builds = 0
+
+    def add(self, person_id: int, aliases: list[str]):
+        """Registra nombres / alias de una persona (idempotente)."""
+        with self._lock:
+            for alias in aliases:
+                key = fold_alias(alias or "")
+                if len(key) < self.min_chars or key in self._by_person.get(person_id, ()):
+                    continue
+                self._patterns.setdefault(key, set()).add(person_id)
+                self._by_person.setdefault(person_id, set()).add(key)
+                self._automaton = None
+
+    def remove(self, person_id: int):
+        with self._lock:
+            for key in self._by_person.pop(person_id, ()):
+                ids = self._patterns.get(key)
+                if ids:
+                    ids.discard(person_id)
+                    if not ids:
+                        del self._patterns[key]
+                self._automaton = None
+
+    def clear(self):
+        with self._lock:
+            self._patterns.clear()
+            self._by_person.clear()
+            self._automaton = None
+
+    def _get_automaton(self) -> AhoCorasick:
+        with self._lock:
+            if self._automaton is None:
+                self._automaton = AhoCorasick(
+                    {key: tuple(sorted(ids)) for key, ids in self._patterns.items()}
+                )
+                self._builds += 1
+            return self._automaton
+
+    def find(self, text: str) -> list[Mention]:
+        """Menciones de palabra completa, sin traslapes (gana la más larga), en orden de aparición."""
+        if not text or not self._patterns:
+            return []
+        folded, offsets = fold(text)
+        hits = []
+        for end, length, ids in self._get_automaton().iter(folded):
+            start = end - length
+            if (start > 0 and folded[start - 1].isalnum()) or (end < len(folded) and folded[end].isalnum()):
+                continue
+            hits.append((start, end, ids))
+
+        mentions: list[Mention] = []
+        taken_until = -1
+        for start, end, ids in sorted(hits, key=lambda h: (h[0], -(h[1] - h[0]))):
+            if start < taken_until:
+                continue
+            taken_until = end
+            o_start, o_end = offsets[start], offsets[end - 1] + 1
+            mentions.append(Mention(ids, folded[start:end], o_start, o_end, text[o_start:o_end]))
+        return mentions
+
+    def person_ids(self, text: str) -> list[int]:
+        """Ids mencionados en `text`, sin repetir, en orden de aparición."""
+        return list(dict.fromkeys(pid for m in self.find(text) for pid in m.person_ids))
+
+    def get_stats(self) -> dict:
+        return {
+            "people": len(self._by_person),
+            "aliases": len(self._patterns),
+            "states": len(self._automaton) if self._automaton is not None else None,
+            "builds": self._builds,
+        }
@@ -7,7 +7,27 @@ para que Raymundo funcione como asistente de RH con memoria a largo plazo.
 Tablas:
     documents   — CVs, imágenes, archivos recibidos (texto extraído + metadata)
     people      — Personas conocidas (candidatos, contactos)
+    person_skills — Skills normalizados de cada persona (filtros facetados)
     facts       — Hechos/datos aprendidos en conversaciones sobre personas
+    passages    — Fragmentos traslapados de cada documento: solo offsets; el
+                  texto sale de documents.content (vista passages_text)
+    *_fts       — Índices FTS5 (BM25, sin acentos) de las tres tablas, por triggers
+    table_counts — Conteos mantenidos por triggers (get_stats en O(1))
+    embeddings  — Vectores float32 de documentos y hechos (búsqueda semántica)
+    person_cards — Ficha de contexto ya armada por persona (perfil + hechos +
+                   evaluaciones) y sus tokens; se refresca en cada escritura
+    person_aliases — Otros nombres de una persona ("JP", "Juanito"); junto
+                   con people.name alimentan el gazetteer (core/gazetteer.py)
+                   que detecta menciones en los mensajes
+
+Compresión opcional (compress_min_bytes): `content` y `evaluation` de
+documents grandes se guardan como BLOB zlib/zstd con un marcador. FTS5
+indexa el texto descomprimido (función SQL kb_text() en los triggers y la
+vista documents_text), así que la búsqueda no cambia; el texto completo se
+descomprime solo al devolver filas a quien lo pide. Los fragmentos
+(passages) no guardan copia: se recortan del documento descomprimido.
+Ojo: kb_text() solo existe en las conexiones de KnowledgeBase, no en el
+CLI de sqlite3.
 
 Uso:
     kb = KnowledgeBase()
@@ -15,36 +35,307 @@ Uso:
     kb.store_person("Alan García", cv_doc_id=doc_id, skills=["Python", "React"])
     kb.add_fact("Alan García", "Tiene 3 años de experiencia en backend", user_id)
     results = kb.search_people(query="Python senior")
+    pool = kb.find_candidates(skills=["Python", "React"], level="Senior")
     person = kb.get_person("Alan García")
+
+    kb = KnowledgeBase(embedder=get_embedder())          # + búsqueda semántica
+    hits = kb.hybrid_search("backend con experiencia en la nube")
 """
 
 from __future__ import annotations
 
+import copy
+import functools
+import hashlib
+import inspect
 import json
+import logging
 import re
 import sqlite3
+import threading
 import time
+import unicodedata
+import zlib
+from collections import Counter
 from pathlib import Path
 from typing import Callable
 
+from core.cache import TTLCache
+from core.db_maintenance import TableCounter, install_counters, read_counters, run_maintenance
+from core.gazetteer import Gazetteer
+from core.token_budget import count_tokens
+from core.sqlite_pool import SQLitePool
+
+try:
+    import numpy as np
+except ImportError:  # sin numpy no hay búsqueda semántica; la de palabras sigue igual
+    np = None
+
+try:
+    import zstandard as zstd
+except ImportError:  # dependencia opcional: se usa zlib
+    zstd = None
+
+logger = logging.getLogger(__name__)
+
 
 _DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "data" / "conocimiento.db"
 
+# Índices FTS5: tabla → columnas indexadas y su peso en bm25()
+_FTS_COLUMNS = {
+    "documents": {"person_name": 5.0, "title": 3.0, "content": 1.0, "evaluation": 2.0},
+    "people": {"name": 5.0, "role": 3.0, "skills": 4.0, "experience": 1.0,
+               "education": 1.0, "notes": 1.0},
+    "facts": {"person_name": 3.0, "fact": 1.0},
+    "passages": {"text": 1.0},
+}
+_RECENCY_COLUMN = {"documents": "timestamp", "people": "updated_at", "facts": "timestamp",
+                   "passages": "id"}
+# Columnas que pueden guardarse comprimidas (FTS5 las indexa vía kb_text())
+_PACKED_COLUMNS = {"documents": ("content", "evaluation")}
+# Tablas cuyo texto se lee de una vista (passages no guarda copia del contenido)
+_TEXT_VIEWS = {"passages": "passages_text"}
+
+# Fragmentos (passages) de documentos: tamaño y traslape en caracteres
+PASSAGE_CHARS = 600
+PASSAGE_OVERLAP = 120
+
+# Personas mencionadas en el query cuya ficha completa entra al contexto
+CONTEXT_MAX_MENTIONS = 3
+# Tamaño de las evaluaciones que build_knowledge_context lee de la BD
+CONTEXT_EVAL_SNIPPET = 1500
+
+# Búsqueda semántica
+EMBED_MAX_CHARS = 2000     # texto de cada documento que se manda al embedder
+EMBED_BATCH = 32
+RRF_K = 60                 # constante de Reciprocal Rank Fusion
+SEMANTIC_MIN_SCORE = 0.35  # similitud coseno mínima para contar como candidato
+
+# Compresión de textos grandes: BLOB = marcador + codec (b"z" zlib | b"s" zstd) + datos
+COMPRESS_MIN_BYTES = 4096
+_PACKED_MAGIC = b"KBZ\x01"
+_ZLIB_LEVEL = 6
+_ZSTD_LEVEL = 9
+
+
+_MISS = object()
+
+
+def pack_text(text: str | None, min_bytes: int | None) -> str | bytes | None:
+    """Comprime `text` si rebasa `min_bytes` (None / 0 = nunca) y si de verdad ahorra espacio."""
+    if not text or not min_bytes:
+        return text
+    raw = text.encode("utf-8")
+    if len(raw) < min_bytes:
+        return text
+    if zstd is not None:
+        packed = _PACKED_MAGIC + b"s" + zstd.ZstdCompressor(level=_ZSTD_LEVEL).compress(raw)
+    else:
+        packed = _PACKED_MAGIC + b"z" + zlib.compress(raw, _ZLIB_LEVEL)
+    return packed if len(packed) < len(raw) else text
+
+
+def unpack_text(value: str | bytes | None) -> str | None:
+    """Inverso de `pack_text`; los textos sin comprimir pasan tal cual."""
+    if not isinstance(value, bytes) or not value.startswith(_PACKED_MAGIC):
+        return value
+    codec, payload = value[len(_PACKED_MAGIC):len(_PACKED_MAGIC) + 1], value[len(_PACKED_MAGIC) + 1:]
+    if codec == b"s":
+        if zstd is None:
+            raise RuntimeError("Texto comprimido con zstd pero `zstandard` no está instalado")
+        return zstd.ZstdDecompressor().decompress(payload).decode("utf-8")
+    return zlib.decompress(payload).decode("utf-8")
+
+
+def _register_sql_functions(conn: sqlite3.Connection):
+    """kb_text(x): texto descomprimido; lo usan los triggers FTS y la vista documents_text."""
+    conn.create_function("kb_text", 1, unpack_text, deterministic=True)
+
+
+def _cache_key_part(value):
+    """Valor hasheable y normalizado para la llave del caché (queries sin mayúsculas ni espacios extra)."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_cache_key_part(v) for v in value)
+    return value
+
+
+def _cached_read(*tables: str):
+    """
+    Cachea el resultado de un método de lectura de KnowledgeBase. La llave
+    lleva los argumentos normalizados y la generación de cada tabla de la que
+    depende el método: al escribir en ellas la llave cambia, así que la
+    invalidación es exacta y las entradas viejas simplemente expiran del LRU.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._result_cache.maxsize <= 0:
+                return method(self, *args, **kwargs)
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            key = (
+                method.__name__,
+                tuple((k, _cache_key_part(v)) for k, v in bound.arguments.items() if k != "self"),
+                self._generations(tables),
+            )
+            result = self._result_cache.get(key, _MISS)
+            if result is _MISS:
+                result = method(self, *args, **kwargs)
+                self._result_cache.put(key, result)
+            return copy.deepcopy(result)  # quien llama puede modificar su copia
+        return wrapper
+    return decorator
+
+
+def normalize_skill(skill: str) -> str:
+    """Forma canónica de un skill: minúsculas, sin acentos ni espacios de más ("Node.JS " → "node.js")."""
+    text = unicodedata.normalize("NFKD", skill.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text).strip(" ,;:-")
+
+
+def content_hash(data: bytes | str) -> str:
+    """sha256 hex del media crudo (bytes) o del texto (str), para deduplicar documentos."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _text_hash(text: str) -> str:
+    # store_document recibe un argumento `content_hash` que oculta la función
+    return content_hash(text)
+
+
+def chunk_text(
+    text: str, size: int = PASSAGE_CHARS, overlap: int = PASSAGE_OVERLAP,
+) -> list[tuple[int, int]]:
+    """
+    Parte `text` en ventanas de ~`size` caracteres que se traslapan `overlap`.
+    Los cortes se recorren al último salto de línea, punto o espacio de la
+    ventana para no partir palabras. Devuelve [(inicio, fin)].
+    """
+    n = len(text)
+    if n <= size:
+        return [(0, n)] if text.strip() else []
+    spans = []
+    start = 0
+    while start < n:
+        end = min(start + size, n)
+        if end < n:
+            floor = start + size * 3 // 4
+            for sep in ("\n", ". ", " "):
+                cut = text.rfind(sep, floor, end)
+                if cut != -1:
+                    end = cut + len(sep)
+                    break
+        if text[start:end].strip():
+            spans.append((start, end))
+        if end >= n:
+            break
+        next_start = max(end - overlap, start + 1)
+        # Empezar el siguiente fragmento en inicio de palabra
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return spans
+
 
 class KnowledgeBase:
     """Base de conocimiento persistente para documentos, personas y hechos."""
 
-    def __init__(self, db_path: str | Path | None = None):
+    def __init__(
+        self,
+        db_path: str | Path | None = None,
+        embedder=None,
+        cache_size: int = 512,
+        cache_ttl: float = 300.0,
+        compress_min_bytes: int | None = None,
+    ):
+        """
+        Args:
+            embedder: Objeto con `.name` y `.embed(texts) -> ndarray` (ver
+                      core/embeddings.py). None = sin búsqueda semántica.
+            cache_size / cache_ttl: Caché de resultados de búsquedas (0 = sin caché).
+            compress_min_bytes: Comprimir content/evaluation de documentos desde
+                      este tamaño (p. ej. COMPRESS_MIN_BYTES). None = sin compresión;
+                      lo ya comprimido se sigue leyendo igual.
+        """
         self._db_path = str(db_path or _DEFAULT_DB_PATH)
         Path(self._db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._pool = SQLitePool(self._db_path, row_factory=sqlite3.Row, on_connect=_register_sql_functions)
+        self._compress_min_bytes = compress_min_bytes
+        self._gazetteer = Gazetteer()
+        self._gazetteer_loaded = False
+        self._gazetteer_lock = threading.Lock()
+        # Contador de escrituras: los cachés comparan contra él para invalidarse
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+        self._table_generations: Counter = Counter()  # por tabla: llave del caché de resultados
+        self._result_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._last_maintenance: dict | None = None
+        self._embedder = embedder if np is not None else None
+        self._vectors: dict | None = None   # matriz en memoria de los embeddings
+        self._vectors_version = 0           # cambia cada vez que se guardan vectores
+        self._vectors_lock = threading.Lock()
         self._init_db()
 
-    def _conn(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self._db_path)
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA busy_timeout=5000")
-        conn.row_factory = sqlite3.Row
-        return conn
+    def _conn(self):
+        """Conexión prestada del pool (commit al salir del `with`)."""
+        return self._pool.connection()
+
+    def read_transaction(self):
+        """Conexión con transacción de lectura: varias consultas, una misma foto de la KB."""
+        return self._pool.read_transaction()
+
+    def close(self):
+        """Cierra las conexiones abiertas hacia la BD."""
+        self._pool.close()
+
+    @property
+    def db_path(self) -> str:
+        return self._db_path
+
+    def reload_external_writes(self):
+        """
+        Otro proceso escribió en la BD (p. ej. la ingesta masiva en subproceso):
+        descarta lo que esta instancia tiene en memoria (resultados cacheados,
+        matriz de vectores y gazetteer), que se recargan en el siguiente uso.
+        """
+        with self._gazetteer_lock:
+            self._gazetteer.clear()
+            self._gazetteer_loaded = False
+        with self._vectors_lock:
+            self._vectors_version += 1
+        self._bump_generation("documents", "people", "facts")
+
+    @property
+    def generation(self) -> int:
+        """Cambia con cada escritura; sirve para invalidar cachés de lectura."""
+        return self._generation
+
+    def _bump_generation(self, *tables: str):
+        """Marca una escritura en `tables` ("documents", "people", "facts")."""
+        with self._generation_lock:
+            self._generation += 1
+            for table in tables:
+                self._table_generations[table] += 1
+
+    def _generations(self, tables: tuple[str, ...]) -> tuple[int, ...]:
+        # "embeddings" cambia al guardar vectores (p. ej. el reindexado en segundo plano)
+        return tuple(
+            self._vectors_version if t == "embeddings" else self._table_generations[t]
+            for t in tables
+        )
+
+    def get_cache_stats(self) -> dict:
+        """Hits/misses del caché de resultados y generación actual de cada tabla."""
+        return {
+            **self._result_cache.get_stats(),
+            "generaciones": dict(self._table_generations),
+        }
 
     # Palabras funcionales cortas que no aportan a las búsquedas
     _STOPWORDS = frozenset(
@@ -80,6 +371,28 @@ class KnowledgeBase:
             conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_docs_person ON documents(person_name)
             """)
+            # Migración: hashes para no guardar (ni volver a pasar por OCR) duplicados.
+            # content_hash = sha256 del media crudo; text_hash = sha256 del texto
+            # extraído (lo único que se puede calcular para documentos viejos).
+            doc_columns = {r[1] for r in conn.execute("PRAGMA table_info(documents)")}
+            needs_dedup = "text_hash" not in doc_columns
+            if "content_hash" not in doc_columns:
+                conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+            if needs_dedup:
+                conn.execute("ALTER TABLE documents ADD COLUMN text_hash TEXT")
+            conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_docs_user_hash
+                ON documents(user_id, content_hash) WHERE content_hash IS NOT NULL
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_docs_user_text_hash
+                ON documents(user_id, text_hash) WHERE text_hash IS NOT NULL
+            """)
+            # Las búsquedas por persona comparan sin mayúsculas (COLLATE NOCASE)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_docs_person_nocase
+                ON documents(person_name COLLATE NOCASE, timestamp)
+            """)
             conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_docs_type ON documents(doc_type)
             """)
@@ -107,6 +420,70 @@ class KnowledgeBase:
                 ON people(name COLLATE NOCASE)
             """)
 
+            skills_existed = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'person_skills'"
+            ).fetchone()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS person_skills (
+                    person_id   INTEGER NOT NULL,
+                    skill_norm  TEXT    NOT NULL,
+                    PRIMARY KEY (person_id, skill_norm)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_person_skills_skill
+                ON person_skills(skill_norm, person_id)
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_people_skills_delete
+                AFTER DELETE ON people
+                BEGIN
+                    DELETE FROM person_skills WHERE person_id = OLD.id;
+                END
+            """)
+            if not skills_existed:
+                # BD anterior al índice de skills: llenarlo desde people.skills (JSON)
+                for row in conn.execute("SELECT id, skills FROM people WHERE skills IS NOT NULL").fetchall():
+                    self._store_skills(conn, row["id"], self._person_from_row(row)["skills"])
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS person_aliases (
+                    person_id   INTEGER NOT NULL,
+                    alias       TEXT    NOT NULL,
+                    PRIMARY KEY (person_id, alias)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_people_aliases_delete
+                AFTER DELETE ON people
+                BEGIN
+                    DELETE FROM person_aliases WHERE person_id = OLD.id;
+                END
+            """)
+
+            cards_existed = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'person_cards'"
+            ).fetchone()
+            # scope '*' = sin filtro de usuario; scope <added_by> = solo lo de su autor
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS person_cards (
+                    person_id   INTEGER NOT NULL,
+                    scope       TEXT    NOT NULL,
+                    profile     TEXT    NOT NULL,
+                    card        TEXT    NOT NULL,
+                    tokens      INTEGER NOT NULL,
+                    updated_at  REAL    NOT NULL,
+                    PRIMARY KEY (person_id, scope)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_people_cards_delete
+                AFTER DELETE ON people
+                BEGIN
+                    DELETE FROM person_cards WHERE person_id = OLD.id;
+                END
+            """)
+
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS facts (
                     id          INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -121,6 +498,270 @@ class KnowledgeBase:
                 CREATE INDEX IF NOT EXISTS idx_facts_person
                 ON facts(person_name COLLATE NOCASE)
             """)
+            passage_columns = {r[1] for r in conn.execute("PRAGMA table_info(passages)")}
+            if "text" in passage_columns:
+                # BD con copia del texto en cada fragmento (sin comprimir): se rehacen
+                # solo con offsets. Son datos derivados de documents.
+                for suffix in ("insert", "delete", "update"):
+                    conn.execute(f"DROP TRIGGER IF EXISTS trg_passages_fts_{suffix}")
+                conn.execute("DROP TRIGGER IF EXISTS trg_documents_passages_delete")
+                conn.execute("DROP TABLE IF EXISTS passages_fts")
+                conn.execute("DROP TABLE passages")
+                passage_columns = set()
+            passages_existed = bool(passage_columns)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS passages (
+                    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                    doc_id       INTEGER NOT NULL,
+                    user_id      TEXT    NOT NULL,
+                    seq          INTEGER NOT NULL,
+                    start_offset INTEGER NOT NULL,
+                    end_offset   INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_passages_doc ON passages(doc_id, seq)
+            """)
+            conn.execute("""
+                CREATE VIEW IF NOT EXISTS passages_text AS
+                SELECT p.id, p.doc_id, p.user_id, p.seq, p.start_offset, p.end_offset,
+                       substr(kb_text(d.content), p.start_offset + 1, p.end_offset - p.start_offset) AS text
+                FROM passages p JOIN documents d ON d.id = p.doc_id
+            """)
+            # BEFORE: el índice FTS de los fragmentos necesita el texto del documento para borrarlos
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_documents_passages_delete
+                BEFORE DELETE ON documents
+                BEGIN
+                    DELETE FROM passages WHERE doc_id = OLD.id;
+                END
+            """)
+
+            self._fts = all(self._init_fts(conn, table) for table in _FTS_COLUMNS)
+
+            if not passages_existed:
+                # BD anterior a los fragmentos: partir los documentos existentes una vez
+                docs = conn.execute("SELECT id, user_id, kb_text(content) AS content FROM documents").fetchall()
+                for doc in docs:
+                    self._store_passages(conn, doc["id"], doc["user_id"], doc["content"])
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    source     TEXT    NOT NULL,
+                    source_id  INTEGER NOT NULL,
+                    model      TEXT    NOT NULL,
+                    user_id    TEXT,
+                    dim        INTEGER NOT NULL,
+                    vector     BLOB    NOT NULL,
+                    PRIMARY KEY (source, source_id, model)
+                ) WITHOUT ROWID
+            """)
+            for table in ("documents", "facts"):
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_embeddings_delete
+                    AFTER DELETE ON {table}
+                    BEGIN
+                        DELETE FROM embeddings WHERE source = '{table}' AND source_id = OLD.id;
+                    END
+                """)
+            install_counters(conn, self._COUNTERS)
+
+            if not cards_existed:
+                # BD anterior a las fichas: armarlas todas una vez
+                self._refresh_cards(conn, [r[0] for r in conn.execute("SELECT name FROM people")])
+
+        if needs_dedup:
+            # BD anterior a text_hash: hashear y deduplicar lo existente una vez
+            self.dedup_documents()
+
+    def _init_fts(self, conn, table: str) -> bool:
+        """
+        Crea `<table>_fts` (external content, sin duplicar texto) y sus triggers.
+        Si la BD ya tenía datos, indexa lo existente una sola vez.
+        """
+        if table in _TEXT_VIEWS:
+            return self._init_passages_fts(conn)
+        fts = f"{table}_fts"
+        cols = list(_FTS_COLUMNS[table])
+        packed = _PACKED_COLUMNS.get(table, ())
+        existed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,),
+        ).fetchone()
+        content = table
+        if packed:
+            # FTS5 lee el texto (rebuild, snippet) de una vista que lo descomprime
+            content = f"{table}_text"
+            conn.execute(f"""
+                CREATE VIEW IF NOT EXISTS {content} AS
+                SELECT id, {', '.join(f"kb_text({c}) AS {c}" if c in packed else c for c in cols)}
+                FROM {table}
+            """)
+            trigger_sql = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f"trg_{fts}_insert",),
+            ).fetchone()
+            if existed and trigger_sql and "kb_text" not in trigger_sql[0]:
+                # BD anterior a la compresión: reconstruir el índice sobre la vista
+                for suffix in ("insert", "delete", "update"):
+                    conn.execute(f"DROP TRIGGER IF EXISTS trg_{fts}_{suffix}")
+                conn.execute(f"DROP TABLE {fts}")
+                existed = None
+        try:
+            conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                    {', '.join(cols)},
+                    content = '{content}',
+                    content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"⚠️ SQLite sin FTS5, búsqueda en KB por LIKE: {e}")
+            return False
+        col_list = ", ".join(cols)
+        new_vals = ", ".join(f"kb_text(NEW.{c})" if c in packed else f"NEW.{c}" for c in cols)
+        old_vals = ", ".join(f"kb_text(OLD.{c})" if c in packed else f"OLD.{c}" for c in cols)
+        # Comprimir / descomprimir en su lugar no cambia el texto: no reindexar
+        changed = (
+            " WHEN " + " OR ".join(f"kb_text(OLD.{c}) IS NOT kb_text(NEW.{c})" for c in packed)
+            + "".join(f" OR OLD.{c} IS NOT NEW.{c}" for c in cols if c not in packed)
+        ) if packed else ""
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {fts} (rowid, {col_list}) VALUES (NEW.id, {new_vals});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {col_list}) VALUES ('delete', OLD.id, {old_vals});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {col_list} ON {table}{changed}
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {col_list}) VALUES ('delete', OLD.id, {old_vals});
+                INSERT INTO {fts} (rowid, {col_list}) VALUES (NEW.id, {new_vals});
+            END
+        """)
+        if not existed:
+            conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        return True
+
+    def _init_passages_fts(self, conn) -> bool:
+        """
+        passages_fts lee el texto de la vista passages_text (recorte de
+        documents.content, descomprimido con kb_text). Los fragmentos no se
+        actualizan: solo se insertan y se borran junto con su documento.
+        """
+        existed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'passages_fts'",
+        ).fetchone()
+        try:
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5(
+                    text,
+                    content = 'passages_text',
+                    content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"⚠️ SQLite sin FTS5, búsqueda en KB por LIKE: {e}")
+            return False
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_passages_fts_insert AFTER INSERT ON passages
+            BEGIN
+                INSERT INTO passages_fts (rowid, text)
+                SELECT id, text FROM passages_text WHERE id = NEW.id;
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_passages_fts_delete AFTER DELETE ON passages
+            BEGIN
+                INSERT INTO passages_fts (passages_fts, rowid, text)
+                SELECT 'delete', OLD.id,
+                       substr(kb_text(content), OLD.start_offset + 1, OLD.end_offset - OLD.start_offset)
+                FROM documents WHERE id = OLD.doc_id;
+            END
+        """)
+        if not existed:
+            conn.execute("INSERT INTO passages_fts (passages_fts) VALUES ('rebuild')")
+        return True
+
+    @staticmethod
+    def _fts_match(words: list[str]) -> str:
+        """Query FTS5: cada palabra por prefijo, unidas con OR (BM25 ordena)."""
+        return " OR ".join(f'"{w}"*' for w in words)
+
+    def _search_sql(
+        self,
+        table: str,
+        words: list[str],
+        limit: int,
+        user_col: str,
+        user_id: str | None,
+        columns: str = "t.*",
+        extra_where: str = "",
+    ) -> tuple[str, list]:
+        """
+        SQL de búsqueda sobre `table` (alias `t`): BM25 sobre FTS5, o LIKE por
+        palabra ordenado por fecha si no hay FTS5. `columns` permite traer solo
+        lo necesario (p. ej. un substr del contenido en vez del CV completo).
+        """
+        filters = ""
+        filter_params: list = []
+        if user_id:
+            filters += f" AND t.{user_col} = ?"
+            filter_params.append(user_id)
+        if extra_where:
+            filters += f" AND {extra_where}"
+
+        source = _TEXT_VIEWS.get(table, table)
+        if self._fts:
+            fts = f"{table}_fts"
+            weights = ", ".join(str(w) for w in _FTS_COLUMNS[table].values())
+            sql = (
+                f"SELECT {columns} FROM {fts} JOIN {source} t ON t.id = {fts}.rowid "
+                f"WHERE {fts} MATCH ?{filters} "
+                f"ORDER BY bm25({fts}, {weights}) LIMIT ?"
+            )
+            return sql, [self._fts_match(words), *filter_params, limit]
+
+        cols = list(_FTS_COLUMNS[table])
+        packed = _PACKED_COLUMNS.get(table, ())
+        word_cond = "(" + " OR ".join(
+            f"kb_text(t.{c}) LIKE ?" if c in packed else f"t.{c} LIKE ?" for c in cols
+        ) + ")"
+        like_params = [f"%{w}%" for w in words for _ in cols]
+        sql = (
+            f"SELECT {columns} FROM {source} t "
+            f"WHERE ({' OR '.join([word_cond] * len(words))}){filters} "
+            f"ORDER BY t.{_RECENCY_COLUMN[table]} DESC LIMIT ?"
+        )
+        return sql, [*like_params, *filter_params, limit]
+
+    @staticmethod
+    def _person_from_row(row) -> dict:
+        d = dict(row)
+        if d.get("skills"):
+            try:
+                d["skills"] = json.loads(d["skills"])
+            except (json.JSONDecodeError, TypeError):
+                pass
+        return d
+
+    @staticmethod
+    def _doc_from_row(row) -> dict:
+        """Fila de documents con content / evaluation ya descomprimidos."""
+        d = dict(row)
+        for col in _PACKED_COLUMNS["documents"]:
+            if col in d:
+                d[col] = unpack_text(d[col])
+        return d
+
+    def _pack(self, text: str | None) -> str | bytes | None:
+        return pack_text(text, self._compress_min_bytes)
 
     # ═══════════════════════════════════════════════════════════
     # Documentos
@@ -135,6 +776,7 @@ class KnowledgeBase:
         title: str | None = None,
         evaluation: str | None = None,
         source: str = "whatsapp",
+        content_hash: str | None = None,
     ) -> int:
         """
         Guarda un documento (CV, imagen, archivo) con su texto extraído.
@@ -145,37 +787,384 @@ class KnowledgeBase:
             person_name: Nombre de la persona asociada (si es CV)
             evaluation: Texto de la evaluación de RH (si aplica)
             source: "whatsapp", "gui", "upload"
+            content_hash: sha256 del media crudo (ver `content_hash()`). Si el
+                          usuario ya tiene un documento con ese hash, o uno
+                          con el mismo texto, no se inserta otro y se
+                          devuelve el id existente.
 
         Returns:
-            ID del documento insertado.
+            ID del documento insertado (o del duplicado ya existente).
         """
+        doc = {
+            "user_id": user_id, "doc_type": doc_type, "person_name": person_name, "title": title,
+            "content": content, "evaluation": evaluation, "source": source, "content_hash": content_hash,
+        }
         with self._conn() as conn:
-            cursor = conn.execute(
-                """INSERT INTO documents
-                   (user_id, doc_type, person_name, title, content, evaluation, source, timestamp)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, doc_type, person_name, title, content, evaluation, source, time.time()),
+            doc_id, created = self._insert_document(conn, doc, time.time())
+            if not created:
+                return doc_id
+            self._store_passages(conn, doc_id, user_id, content)
+            self._refresh_cards(conn, [person_name])
+        self._embed_rows("documents", [(doc_id, user_id, self._document_text(person_name, title, content))])
+        self._bump_generation("documents")
+        return doc_id
+
+    def store_documents_bulk(self, docs: list[dict]) -> list[int]:
+        """
+        Guarda varios documentos en UNA transacción (fragmentos incluidos) y
+        calcula sus embeddings en lote. Cada dict lleva los argumentos de
+        `store_document`. Devuelve los ids en el mismo orden; un duplicado
+        (mismo user_id + content_hash o text_hash) devuelve el id existente.
+        """
+        ids: list[int] = []
+        new_rows: list[tuple[int, str, str]] = []
+        now = time.time()
+        with self._conn() as conn:
+            for d in docs:
+                doc_id, created = self._insert_document(conn, {"source": "upload", **d}, now)
+                if not created:
+                    ids.append(doc_id)
+                    continue
+                self._store_passages(conn, doc_id, d["user_id"], d["content"])
+                ids.append(doc_id)
+                new_rows.append((doc_id, d["user_id"],
+                                 self._document_text(d.get("person_name"), d.get("title"), d["content"])))
+            self._refresh_cards(conn, [d.get("person_name") for d in docs])
+        self._embed_rows("documents", new_rows)
+        if new_rows:
+            self._bump_generation("documents")
+        return ids
+
+    def _insert_document(self, conn, d: dict, now: float) -> tuple[int, bool]:
+        """
+        (id, ¿nuevo?) de un documento. Si el usuario ya tiene ese media
+        (content_hash) o ese mismo texto (text_hash) devuelve el existente; en
+        el segundo caso le asigna el hash del media si no tenía, para que la
+        próxima vez que llegue ese archivo se salte el OCR.
+        """
+        media_hash = d.get("content_hash")
+        text_hash = _text_hash(d["content"])
+        if media_hash:
+            row = conn.execute(
+                "SELECT id FROM documents WHERE user_id = ? AND content_hash = ?",
+                (d["user_id"], media_hash),
+            ).fetchone()
+            if row:
+                return row["id"], False
+        row = conn.execute(
+            "SELECT id, content_hash FROM documents WHERE user_id = ? AND text_hash = ? ORDER BY id LIMIT 1",
+            (d["user_id"], text_hash),
+        ).fetchone()
+        if row:
+            if media_hash and row["content_hash"] is None:
+                conn.execute("UPDATE documents SET content_hash = ? WHERE id = ?", (media_hash, row["id"]))
+            return row["id"], False
+        cursor = conn.execute(
+            """INSERT INTO documents
+               (user_id, doc_type, person_name, title, content, evaluation, source, timestamp,
+                content_hash, text_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(user_id, content_hash) WHERE content_hash IS NOT NULL DO NOTHING""",
+            (d["user_id"], d["doc_type"], d.get("person_name"), d.get("title"), self._pack(d["content"]),
+             self._pack(d.get("evaluation")), d.get("source", "whatsapp"), now, media_hash, text_hash),
+        )
+        if cursor.rowcount == 0:   # otro hilo guardó el mismo media entre la consulta y el INSERT
+            return conn.execute(
+                "SELECT id FROM documents WHERE user_id = ? AND content_hash = ?",
+                (d["user_id"], media_hash),
+            ).fetchone()["id"], False
+        return cursor.lastrowid, True
+
+    def find_document_by_hash(self, user_id: str, content_hash: str) -> dict | None:
+        """Documento del usuario con ese hash (p. ej. el mismo CV reenviado), o None."""
+        with self._conn() as conn:
+            row = conn.execute(
+                "SELECT * FROM documents WHERE user_id = ? AND content_hash = ?",
+                (user_id, content_hash),
+            ).fetchone()
+        return self._doc_from_row(row) if row else None
+
+    def existing_hashes(self, user_id: str, hashes: list[str], column: str = "content_hash") -> set[str]:
+        """
+        Cuáles de `hashes` ya tiene guardados el usuario (consulta por lotes).
+        column: "content_hash" (media crudo) o "text_hash" (texto extraído).
+        """
+        if column not in ("content_hash", "text_hash"):
+            raise ValueError(f"Columna de hash inválida: {column}")
+        found: set[str] = set()
+        with self._conn() as conn:
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                found.update(r[0] for r in conn.execute(
+                    f"SELECT {column} FROM documents WHERE user_id = ? "
+                    f"AND {column} IN ({', '.join('?' * len(chunk))})",
+                    [user_id, *chunk],
+                ))
+        return found
+
+    def dedup_documents(self, batch_size: int = 200) -> dict:
+        """
+        Backfill: a los documentos sin text_hash les asigna el sha256 de su
+        texto y borra los duplicados exactos del mismo usuario. Se queda con
+        el más viejo y le pasa evaluación / persona / hash del media del
+        duplicado si no tenía.
+
+        El hash del media original no se puede recalcular para documentos
+        viejos: esos se reconocen por su texto después del OCR (ver
+        `_insert_document`), y desde ahí adoptan el hash del media.
+        Una versión previa de este backfill guardaba el hash del texto en
+        content_hash; se limpia para no mezclar los dos dominios.
+
+        Returns:
+            {"scanned", "hashed", "removed"}
+        """
+        stats = {"scanned": 0, "hashed": 0, "removed": 0}
+        last_id = 0
+        while True:
+            with self._conn() as conn:
+                rows = conn.execute(
+                    """SELECT id, user_id, content, evaluation, person_name, content_hash FROM documents
+                       WHERE text_hash IS NULL AND id > ? ORDER BY id LIMIT ?""",
+                    (last_id, batch_size),
+                ).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    digest = _text_hash(unpack_text(row["content"]))
+                    media_hash = row["content_hash"] if row["content_hash"] != digest else None
+                    keeper = conn.execute(
+                        "SELECT id FROM documents WHERE user_id = ? AND text_hash = ?",
+                        (row["user_id"], digest),
+                    ).fetchone()
+                    if keeper is None:
+                        conn.execute(
+                            "UPDATE documents SET text_hash = ?, content_hash = ? WHERE id = ?",
+                            (digest, media_hash, row["id"]),
+                        )
+                        stats["hashed"] += 1
+                        continue
+                    conn.execute("DELETE FROM documents WHERE id = ?", (row["id"],))
+                    conn.execute(
+                        """UPDATE documents
+                           SET evaluation = COALESCE(evaluation, ?),
+                               person_name = COALESCE(person_name, ?),
+                               content_hash = COALESCE(content_hash, ?)
+                           WHERE id = ?""",
+                        (row["evaluation"], row["person_name"], media_hash, keeper["id"]),
+                    )
+                    self._refresh_cards(conn, [row["person_name"]])
+                    stats["removed"] += 1
+                stats["scanned"] += len(rows)
+                last_id = rows[-1]["id"]
+        if stats["removed"] or stats["hashed"]:
+            self._bump_generation("documents")
+            logger.info(f"🧹 Dedup de documentos: {stats}")
+        return stats
+
+    def compress_documents(self, batch_size: int = 200) -> dict:
+        """
+        Migración en su lugar: comprime (o descomprime, si la compresión está
+        apagada) content / evaluation de los documentos existentes según
+        `compress_min_bytes`. Idempotente; el índice FTS no se toca porque el
+        texto no cambia.
+
+        Returns:
+            {"scanned", "changed", "bytes_before", "bytes_after"}
+        """
+        stats = {"scanned": 0, "changed": 0, "bytes_before": 0, "bytes_after": 0}
+        cols = _PACKED_COLUMNS["documents"]
+        # Solo las filas candidatas: textos grandes sin comprimir, o BLOBs si la compresión está apagada
+        if self._compress_min_bytes:
+            pending = " OR ".join(
+                f"(typeof({c}) = 'text' AND length(CAST({c} AS BLOB)) >= {int(self._compress_min_bytes)})"
+                for c in cols
             )
-            return cursor.lastrowid
+        else:
+            pending = " OR ".join(f"typeof({c}) = 'blob'" for c in cols)
+        last_id = 0
+        while True:
+            with self._conn() as conn:
+                rows = conn.execute(
+                    f"SELECT id, {', '.join(cols)} FROM documents WHERE id > ? AND ({pending}) "
+                    f"ORDER BY id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    old = [row[c] for c in cols]
+                    new = [v if isinstance(v, bytes) and self._compress_min_bytes else self._pack(unpack_text(v))
+                           for v in old]
+                    size = [len(v.encode("utf-8") if isinstance(v, str) else v) for v in old if v is not None]
+                    stats["bytes_before"] += sum(size)
+                    stats["bytes_after"] += sum(
+                        len(v.encode("utf-8") if isinstance(v, str) else v) for v in new if v is not None
+                    )
+                    if new != old:
+                        conn.execute(
+                            f"UPDATE documents SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?",
+                            (*new, row["id"]),
+                        )
+                        stats["changed"] += 1
+                stats["scanned"] += len(rows)
+                last_id = rows[-1]["id"]
+        if stats["changed"]:
+            logger.info(
+                f"🗜️ Compresión de documentos: {stats['changed']} reescritos, "
+                f"{stats['bytes_before'] / 1024:.0f} KB → {stats['bytes_after'] / 1024:.0f} KB"
+            )
+        return stats
+
+    @staticmethod
+    def _store_passages(conn, doc_id: int, user_id: str, content: str):
+        """Guarda los fragmentos traslapados de un documento (en la transacción de `conn`)."""
+        conn.executemany(
+            """INSERT INTO passages (doc_id, user_id, seq, start_offset, end_offset)
+               VALUES (?, ?, ?, ?, ?)""",
+            [
+                (doc_id, user_id, seq, start, end)
+                for seq, (start, end) in enumerate(chunk_text(content or ""))
+            ],
+        )
+
+    @_cached_read("documents")
+    def search_passages(
+        self, query: str, limit: int = 10, user_id: str | None = None, doc_type: str | None = None,
+    ) -> list[dict]:
+        """
+        Fragmentos de documentos más relevantes al query (BM25), con el
+        documento de origen y sus offsets dentro de `content`.
+        """
+        words = self._extract_search_words(query)
+        if not words:
+            return []
+        extra = ""
+        if doc_type:
+            extra = "t.doc_id IN (SELECT id FROM documents WHERE doc_type = ?)"
+        sql, params = self._search_sql(
+            "passages", words, limit, "user_id", user_id,
+            columns="t.id, t.doc_id, t.seq, t.start_offset, t.end_offset",
+            extra_where=extra,
+        )
+        if doc_type:
+            params.insert(-1, doc_type)
+        with self._conn() as conn:
+            rows = [dict(r) for r in conn.execute(sql, params)]
+            # El texto (recorte del documento descomprimido) solo de los que se devuelven
+            texts = self._passage_texts(conn, [r["id"] for r in rows])
+            for r in rows:
+                r["text"] = texts.get(r["id"], "")
+            docs = self._rows_by_id(
+                "documents", sorted({r["doc_id"] for r in rows}),
+                "id, doc_type, person_name, title", conn=conn,
+            )
+        for r in rows:
+            doc = docs.get(r["doc_id"], {})
+            r.update(doc_type=doc.get("doc_type"), person_name=doc.get("person_name"), title=doc.get("title"))
+        return rows
+
+    def _best_passages(self, conn, doc_ids: list[int], words: list[str]) -> dict[int, str]:
+        """Por documento, el fragmento que mejor coincide con `words` (o el primero)."""
+        if not doc_ids:
+            return {}
+        marks = ", ".join("?" * len(doc_ids))
+        best: dict[int, int] = {}   # doc_id → id del fragmento
+        if words and self._fts:
+            for r in conn.execute(
+                f"""SELECT p.doc_id, p.id FROM passages_fts
+                    JOIN passages p ON p.id = passages_fts.rowid
+                    WHERE passages_fts MATCH ? AND p.doc_id IN ({marks})
+                    ORDER BY bm25(passages_fts)""",
+                [self._fts_match(words), *doc_ids],
+            ):
+                best.setdefault(r["doc_id"], r["id"])
+        missing = [d for d in doc_ids if d not in best]
+        if missing:
+            for r in conn.execute(
+                f"SELECT doc_id, id FROM passages WHERE seq = 0 AND doc_id IN ({', '.join('?' * len(missing))})",
+                missing,
+            ):
+                best[r["doc_id"]] = r["id"]
+        texts = self._passage_texts(conn, list(best.values()))
+        return {doc_id: texts.get(pid, "") for doc_id, pid in best.items()}
+
+    @staticmethod
+    def _passage_texts(conn, passage_ids: list[int]) -> dict[int, str]:
+        """Texto de cada fragmento (recorte de su documento, descomprimido)."""
+        if not passage_ids:
+            return {}
+        return dict(conn.execute(
+            f"SELECT id, text FROM passages_text WHERE id IN ({', '.join('?' * len(passage_ids))})",
+            passage_ids,
+        ).fetchall())
 
     def update_document_evaluation(self, doc_id: int, evaluation: str, person_name: str | None = None):
         """Actualiza la evaluación de un documento ya guardado."""
         with self._conn() as conn:
+            previous = conn.execute("SELECT person_name FROM documents WHERE id = ?", (doc_id,)).fetchone()
             if person_name:
                 conn.execute(
                     "UPDATE documents SET evaluation = ?, person_name = ? WHERE id = ?",
-                    (evaluation, person_name, doc_id),
+                    (self._pack(evaluation), person_name, doc_id),
                 )
             else:
                 conn.execute(
                     "UPDATE documents SET evaluation = ? WHERE id = ?",
-                    (evaluation, doc_id),
+                    (self._pack(evaluation), doc_id),
+                )
+            self._refresh_cards(conn, [person_name, previous["person_name"] if previous else None])
+        self._bump_generation("documents")
+
+    def update_evaluations_bulk(self, updates: list[dict]) -> int:
+        """
+        Guarda varias evaluaciones en UNA transacción. Cada dict lleva doc_id,
+        evaluation y opcionalmente person_name (None = no tocar la persona).
+        Devuelve cuántos documentos se actualizaron.
+        """
+        changed = 0
+        names: list[str | None] = []
+        with self._conn() as conn:
+            for u in updates:
+                previous = conn.execute(
+                    "SELECT person_name FROM documents WHERE id = ?", (u["doc_id"],),
+                ).fetchone()
+                if previous is None:
+                    continue
+                conn.execute(
+                    "UPDATE documents SET evaluation = ?, person_name = COALESCE(?, person_name) WHERE id = ?",
+                    (self._pack(u["evaluation"]), u.get("person_name"), u["doc_id"]),
                 )
+                names += [u.get("person_name"), previous["person_name"]]
+                changed += 1
+            self._refresh_cards(conn, names)
+        if changed:
+            self._bump_generation("documents")
+        return changed
+
+    def get_documents(self, doc_ids: list[int]) -> list[dict]:
+        """Documentos por id (en el orden pedido; los que no existen se omiten)."""
+        rows: dict[int, dict] = {}
+        with self._conn() as conn:
+            for i in range(0, len(doc_ids), 500):
+                rows.update(self._rows_by_id("documents", doc_ids[i:i + 500], conn=conn))
+        return [rows[i] for i in doc_ids if i in rows]
+
+    def pending_cv_ids(self, user_id: str | None = None, limit: int | None = None) -> list[int]:
+        """Ids de CVs sin evaluación (p. ej. de una ingesta sin --evaluate), del más viejo al más nuevo."""
+        sql = "SELECT id FROM documents WHERE doc_type = 'cv' AND (evaluation IS NULL OR evaluation = '')"
+        params: list = []
+        if user_id:
+            sql += " AND user_id = ?"
+            params.append(user_id)
+        sql += " ORDER BY id LIMIT ?"
+        params.append(-1 if limit is None else limit)
+        with self._conn() as conn:
+            return [r[0] for r in conn.execute(sql, params)]
 
     def get_document(self, doc_id: int) -> dict | None:
         with self._conn() as conn:
             row = conn.execute("SELECT * FROM documents WHERE id = ?", (doc_id,)).fetchone()
-        return dict(row) if row else None
+        return self._doc_from_row(row) if row else None
 
     def get_documents_by_person(self, person_name: str) -> list[dict]:
         with self._conn() as conn:
@@ -183,7 +1172,7 @@ class KnowledgeBase:
                 "SELECT * FROM documents WHERE person_name = ? COLLATE NOCASE ORDER BY timestamp DESC",
                 (person_name,),
             ).fetchall()
-        return [dict(r) for r in rows]
+        return [self._doc_from_row(r) for r in rows]
 
     def get_documents_by_type(self, doc_type: str, limit: int = 50) -> list[dict]:
         with self._conn() as conn:
@@ -191,7 +1180,7 @@ class KnowledgeBase:
                 "SELECT * FROM documents WHERE doc_type = ? ORDER BY timestamp DESC LIMIT ?",
                 (doc_type, limit),
             ).fetchall()
-        return [dict(r) for r in rows]
+        return [self._doc_from_row(r) for r in rows]
 
     def get_recent_documents(self, user_id: str | None = None, limit: int = 20) -> list[dict]:
         with self._conn() as conn:
@@ -205,32 +1194,21 @@ class KnowledgeBase:
                     "SELECT * FROM documents ORDER BY timestamp DESC LIMIT ?",
                     (limit,),
                 ).fetchall()
-        return [dict(r) for r in rows]
+        return [self._doc_from_row(r) for r in rows]
 
+    @_cached_read("documents")
     def search_documents(self, query: str, limit: int = 20, user_id: str | None = None) -> list[dict]:
-        """Búsqueda de texto en documentos. Busca por cada palabra del query."""
+        """
+        Búsqueda de texto en documentos, por relevancia (BM25 sobre FTS5).
+        Sin FTS5 cae a LIKE por cada palabra, ordenado por fecha.
+        """
         words = self._extract_search_words(query)
         if not words:
             return []
-        conditions = []
-        params = []
-        for w in words:
-            p = f"%{w}%"
-            conditions.append(
-                "(content LIKE ? OR person_name LIKE ? OR title LIKE ? OR evaluation LIKE ?)"
-            )
-            params.extend([p, p, p, p])
-        where = " OR ".join(conditions)
-        if user_id:
-            where = f"user_id = ? AND ({where})"
-            params.insert(0, user_id)
-        params.append(limit)
+        sql, params = self._search_sql("documents", words, limit, "user_id", user_id)
         with self._conn() as conn:
-            rows = conn.execute(
-                f"SELECT * FROM documents WHERE {where} ORDER BY timestamp DESC LIMIT ?",
-                params,
-            ).fetchall()
-        return [dict(r) for r in rows]
+            rows = conn.execute(sql, params).fetchall()
+        return [self._doc_from_row(r) for r in rows]
 
     # ═══════════════════════════════════════════════════════════
     # Personas
@@ -250,47 +1228,154 @@ class KnowledgeBase:
         verdict: str | None = None,
         notes: str | None = None,
         added_by: str | None = None,
+        aliases: list[str] | None = None,
     ) -> int:
         """
-        Crea o actualiza una persona en la base.
-        Si ya existe (por nombre), actualiza solo los campos proporcionados.
-        """
-        skills_json = json.dumps(skills, ensure_ascii=False) if skills else None
-        existing = self.get_person(name)
-
-        if existing:
-            # Actualizar solo campos no-None
-            updates = {}
-            if role is not None: updates["role"] = role
-            if skills_json is not None: updates["skills"] = skills_json
-            if experience is not None: updates["experience"] = experience
-            if education is not None: updates["education"] = education
-            if contact is not None: updates["contact"] = contact
-            if location is not None: updates["location"] = location
-            if salary_range is not None: updates["salary_range"] = salary_range
-            if level is not None: updates["level"] = level
-            if verdict is not None: updates["verdict"] = verdict
-            if notes is not None: updates["notes"] = notes
-            updates["updated_at"] = time.time()
-
-            if updates:
-                set_clause = ", ".join(f"{k} = ?" for k in updates)
-                values = list(updates.values())
-                values.append(existing["id"])
-                with self._conn() as conn:
-                    conn.execute(f"UPDATE people SET {set_clause} WHERE id = ?", values)
-            return existing["id"]
-        else:
-            with self._conn() as conn:
-                cursor = conn.execute(
-                    """INSERT INTO people
-                       (name, role, skills, experience, education, contact, location,
-                        salary_range, level, verdict, notes, added_by, updated_at)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (name, role, skills_json, experience, education, contact, location,
-                     salary_range, level, verdict, notes, added_by, time.time()),
-                )
-                return cursor.lastrowid
+        Crea o actualiza una persona en la base (UPSERT atómico por nombre,
+        sin distinguir mayúsculas). Si ya existe, solo se actualizan los
+        campos proporcionados; `added_by` conserva al autor original.
+        `aliases` se suman a los que ya tenga (ver `add_person_aliases`).
+        """
+        with self._conn() as conn:
+            person_id = self._upsert_person(conn, {
+                "name": name, "role": role, "skills": skills, "experience": experience,
+                "education": education, "contact": contact, "location": location,
+                "salary_range": salary_range, "level": level, "verdict": verdict,
+                "notes": notes, "added_by": added_by, "aliases": aliases,
+            }, time.time())
+            self._refresh_cards(conn, [name])
+        self._gazetteer_add([(person_id, name, aliases)])
+        self._bump_generation("people")
+        return person_id
+
+    _PERSON_FIELDS = (
+        "role", "skills", "experience", "education", "contact", "location",
+        "salary_range", "level", "verdict", "notes",
+    )
+    _UPSERT_PERSON_SQL = f"""
+        INSERT INTO people (name, {", ".join(_PERSON_FIELDS)}, added_by, updated_at)
+        VALUES (?, {", ".join("?" * len(_PERSON_FIELDS))}, ?, ?)
+        ON CONFLICT(name COLLATE NOCASE) DO UPDATE SET
+            {", ".join(f"{f} = COALESCE(excluded.{f}, people.{f})" for f in _PERSON_FIELDS)},
+            added_by = COALESCE(people.added_by, excluded.added_by),
+            updated_at = excluded.updated_at
+        RETURNING id
+    """
+
+    @classmethod
+    def _upsert_person(cls, conn, person: dict, now: float) -> int:
+        values = {f: person.get(f) for f in cls._PERSON_FIELDS}
+        values["skills"] = json.dumps(values["skills"], ensure_ascii=False) if values["skills"] else None
+        person_id = conn.execute(
+            cls._UPSERT_PERSON_SQL,
+            (person["name"], *values.values(), person.get("added_by"), now),
+        ).fetchone()[0]
+        if values["skills"] is not None:
+            cls._store_skills(conn, person_id, person["skills"])
+        if person.get("aliases"):
+            conn.executemany(
+                "INSERT OR IGNORE INTO person_aliases (person_id, alias) VALUES (?, ?)",
+                [(person_id, a.strip()) for a in person["aliases"] if a and a.strip()],
+            )
+        return person_id
+
+    @staticmethod
+    def normalize_skills(skills: list[str] | str | None) -> list[str]:
+        """Skills normalizados y sin repetir; acepta lista o texto separado por comas."""
+        if not skills:
+            return []
+        if isinstance(skills, str):
+            skills = re.split(r"[,;]", skills)
+        return list(dict.fromkeys(n for n in (normalize_skill(str(s)) for s in skills) if n))
+
+    @classmethod
+    def _store_skills(cls, conn, person_id: int, skills: list[str] | str | None):
+        """Reemplaza los skills indexados de la persona (mismo criterio que people.skills)."""
+        conn.execute("DELETE FROM person_skills WHERE person_id = ?", (person_id,))
+        conn.executemany(
+            "INSERT INTO person_skills (person_id, skill_norm) VALUES (?, ?)",
+            [(person_id, skill) for skill in cls.normalize_skills(skills)],
+        )
+
+    def store_people_bulk(self, people: list[dict]) -> list[int]:
+        """
+        Crea o actualiza varias personas en UNA transacción. Cada dict lleva
+        los argumentos de `store_person`. Devuelve los ids en el mismo orden.
+        """
+        now = time.time()
+        with self._conn() as conn:
+            ids = [self._upsert_person(conn, p, now) for p in people]
+            self._refresh_cards(conn, [p["name"] for p in people])
+        self._gazetteer_add([(pid, p["name"], p.get("aliases")) for pid, p in zip(ids, people)])
+        if ids:
+            self._bump_generation("people")
+        return ids
+
+    def add_person_aliases(self, name: str, aliases: list[str]) -> bool:
+        """Agrega otros nombres con los que se menciona a la persona. False si no existe."""
+        with self._conn() as conn:
+            row = conn.execute("SELECT id FROM people WHERE name = ? COLLATE NOCASE", (name,)).fetchone()
+            if row is None:
+                return False
+            conn.executemany(
+                "INSERT OR IGNORE INTO person_aliases (person_id, alias) VALUES (?, ?)",
+                [(row["id"], a.strip()) for a in aliases if a and a.strip()],
+            )
+        self._gazetteer_add([(row["id"], name, aliases)])
+        self._bump_generation("people")
+        return True
+
+    def get_person_aliases(self, name: str) -> list[str]:
+        with self._conn() as conn:
+            return [r[0] for r in conn.execute(
+                "SELECT a.alias FROM person_aliases a JOIN people p ON p.id = a.person_id "
+                "WHERE p.name = ? COLLATE NOCASE ORDER BY a.alias",
+                (name,),
+            )]
+
+    # ─── Menciones (gazetteer) ────────────────────────────────
+
+    def _people_gazetteer(self) -> Gazetteer:
+        """Gazetteer de nombres + alias; se carga de la BD la primera vez que se usa."""
+        if not self._gazetteer_loaded:
+            with self._gazetteer_lock:
+                if not self._gazetteer_loaded:
+                    names: dict[int, list[str]] = {}
+                    with self._conn() as conn:
+                        for pid, name in conn.execute("SELECT id, name FROM people"):
+                            names.setdefault(pid, []).append(name)
+                        for pid, alias in conn.execute("SELECT person_id, alias FROM person_aliases"):
+                            names.setdefault(pid, []).append(alias)
+                    for pid, aliases in names.items():
+                        self._gazetteer.add(pid, aliases)
+                    self._gazetteer_loaded = True
+        return self._gazetteer
+
+    def _gazetteer_add(self, entries: list[tuple[int, str, list[str] | None]]):
+        """Escrituras de personas → gazetteer (solo si ya está cargado; si no, se cargará completo)."""
+        with self._gazetteer_lock:
+            if self._gazetteer_loaded:
+                for person_id, name, aliases in entries:
+                    self._gazetteer.add(person_id, [name, *(aliases or [])])
+
+    def mentioned_person_ids(self, text: str) -> list[int]:
+        """Ids de las personas conocidas (nombre o alias) mencionadas en `text`, en orden de aparición."""
+        return self._people_gazetteer().person_ids(text)
+
+    @_cached_read("people")
+    def find_mentioned_people(self, text: str, user_id: str | None = None) -> list[dict]:
+        """Personas mencionadas en `text` (una pasada Aho-Corasick), leídas por id."""
+        ids = self.mentioned_person_ids(text)
+        if not ids:
+            return []
+        sql = f"SELECT * FROM people WHERE id IN ({', '.join('?' * len(ids))})"
+        params: list = list(ids)
+        if user_id:
+            sql += " AND added_by = ?"
+            params.append(user_id)
+        with self._conn() as conn:
+            rows = {r["id"]: self._person_from_row(r) for r in conn.execute(sql, params)}
+        return [rows[i] for i in ids if i in rows]
 
     def get_person(self, name: str) -> dict | None:
         with self._conn() as conn:
@@ -325,50 +1410,100 @@ class KnowledgeBase:
             results.append(d)
         return results
 
+    @_cached_read("people")
     def search_people(self, query: str, limit: int = 20, user_id: str | None = None) -> list[dict]:
-        """Busca personas por cada palabra del query (nombre, skills, rol, etc.)."""
+        """Busca personas por cada palabra del query (nombre, skills, rol, etc.), por relevancia."""
         words = self._extract_search_words(query)
         if not words:
             return []
-        conditions = []
-        params = []
-        for w in words:
-            p = f"%{w}%"
-            conditions.append(
-                "(name LIKE ? OR role LIKE ? OR skills LIKE ?"
-                " OR experience LIKE ? OR education LIKE ? OR notes LIKE ?)"
+        sql, params = self._search_sql("people", words, limit, "added_by", user_id)
+        with self._conn() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [self._person_from_row(r) for r in rows]
+
+    _FACET_FIELDS = ("level", "verdict", "location")
+
+    @_cached_read("people")
+    def find_candidates(
+        self,
+        skills: list[str] | str | None = None,
+        level: list[str] | str | None = None,
+        verdict: list[str] | str | None = None,
+        location: str | None = None,
+        user_id: str | None = None,
+        limit: int = 20,
+        offset: int = 0,
+        facet_limit: int = 10,
+    ) -> dict:
+        """
+        Búsqueda facetada de candidatos. Filtros combinados con AND:
+        debe tener TODOS los `skills`; `level` / `verdict` aceptan uno o
+        varios valores (sin mayúsculas); `location` es una subcadena.
+
+        Returns:
+            {"total": n, "people": [...], "facets": {"level": {valor: n},
+             "verdict": {...}, "location": {...}, "skills": {skill: n}}}
+            Los conteos de facetas son sobre el conjunto filtrado; la faceta
+            de skills omite los que ya se pidieron.
+        """
+        where: list[str] = []
+        params: list = []
+        wanted = self.normalize_skills(skills)
+        if wanted:
+            where.append(
+                f"p.id IN (SELECT person_id FROM person_skills WHERE skill_norm IN "
+                f"({', '.join('?' * len(wanted))}) GROUP BY person_id HAVING COUNT(*) = ?)"
             )
-            params.extend([p, p, p, p, p, p])
-        where = " OR ".join(conditions)
+            params += [*wanted, len(wanted)]
+        for col, value in (("level", level), ("verdict", verdict)):
+            values = [value] if isinstance(value, str) else list(value or [])
+            if values:
+                where.append(f"p.{col} COLLATE NOCASE IN ({', '.join('?' * len(values))})")
+                params += values
+        if location:
+            where.append("p.location LIKE ?")
+            params.append(f"%{location}%")
         if user_id:
-            where = f"added_by = ? AND ({where})"
-            params.insert(0, user_id)
-        params.append(limit)
-        with self._conn() as conn:
+            where.append("p.added_by = ?")
+            params.append(user_id)
+        cond = " AND ".join(where) or "1"
+
+        with self.read_transaction() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM people p WHERE {cond}", params).fetchone()[0]
             rows = conn.execute(
-                f"SELECT * FROM people WHERE {where} ORDER BY updated_at DESC LIMIT ?",
-                params,
+                f"SELECT p.* FROM people p WHERE {cond} ORDER BY p.updated_at DESC LIMIT ? OFFSET ?",
+                [*params, limit, offset],
             ).fetchall()
-        results = []
-        for row in rows:
-            d = dict(row)
-            if d.get("skills"):
-                try:
-                    d["skills"] = json.loads(d["skills"])
-                except (json.JSONDecodeError, TypeError):
-                    pass
-            results.append(d)
-        return results
+            facets = {}
+            for col in self._FACET_FIELDS:
+                facets[col] = dict(conn.execute(
+                    f"SELECT p.{col}, COUNT(*) AS n FROM people p "
+                    f"WHERE {cond} AND p.{col} IS NOT NULL AND p.{col} != '' "
+                    f"GROUP BY p.{col} COLLATE NOCASE ORDER BY n DESC LIMIT ?",
+                    [*params, facet_limit],
+                ).fetchall())
+            exclude = f" AND s.skill_norm NOT IN ({', '.join('?' * len(wanted))})" if wanted else ""
+            facets["skills"] = dict(conn.execute(
+                f"SELECT s.skill_norm, COUNT(*) AS n FROM person_skills s "
+                f"JOIN people p ON p.id = s.person_id WHERE {cond}{exclude} "
+                f"GROUP BY s.skill_norm ORDER BY n DESC, s.skill_norm LIMIT ?",
+                [*params, *wanted, facet_limit],
+            ).fetchall())
+
+        return {"total": total, "people": [self._person_from_row(r) for r in rows], "facets": facets}
 
     def delete_person(self, name: str) -> bool:
         with self._conn() as conn:
-            cursor = conn.execute(
-                "DELETE FROM people WHERE name = ? COLLATE NOCASE", (name,),
-            )
+            deleted = conn.execute(
+                "DELETE FROM people WHERE name = ? COLLATE NOCASE RETURNING id", (name,),
+            ).fetchall()
             conn.execute(
                 "DELETE FROM facts WHERE person_name = ? COLLATE NOCASE", (name,),
             )
-        return cursor.rowcount > 0
+        for row in deleted:
+            self._gazetteer.remove(row["id"])
+        self._bump_generation("people", "facts")
+        return bool(deleted)
 
     # ═══════════════════════════════════════════════════════════
     # Hechos / datos aprendidos
@@ -377,10 +1512,33 @@ class KnowledgeBase:
     def add_fact(self, person_name: str, fact: str, user_id: str | None = None, source: str = "conversation"):
         """Registra un hecho sobre una persona."""
         with self._conn() as conn:
-            conn.execute(
+            cursor = conn.execute(
                 "INSERT INTO facts (person_name, fact, source, user_id, timestamp) VALUES (?, ?, ?, ?, ?)",
                 (person_name, fact, source, user_id, time.time()),
             )
+            self._refresh_cards(conn, [person_name])
+        self._embed_rows("facts", [(cursor.lastrowid, user_id, f"{person_name}: {fact}")])
+        self._bump_generation("facts")
+
+    def add_facts_bulk(self, facts: list[dict]) -> list[int]:
+        """
+        Registra varios hechos en UNA transacción y calcula sus embeddings en
+        lote. Cada dict lleva person_name, fact y opcionalmente user_id y source.
+        """
+        now = time.time()
+        rows: list[tuple[int, str | None, str]] = []
+        with self._conn() as conn:
+            for f in facts:
+                cursor = conn.execute(
+                    "INSERT INTO facts (person_name, fact, source, user_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    (f["person_name"], f["fact"], f.get("source", "conversation"), f.get("user_id"), now),
+                )
+                rows.append((cursor.lastrowid, f.get("user_id"), f"{f['person_name']}: {f['fact']}"))
+            self._refresh_cards(conn, [f["person_name"] for f in facts])
+        self._embed_rows("facts", rows)
+        if rows:
+            self._bump_generation("facts")
+        return [r[0] for r in rows]
 
     def get_facts(self, person_name: str) -> list[dict]:
         with self._conn() as conn:
@@ -390,92 +1548,381 @@ class KnowledgeBase:
             ).fetchall()
         return [dict(r) for r in rows]
 
+    @_cached_read("facts")
     def search_facts(self, query: str, limit: int = 30, user_id: str | None = None) -> list[dict]:
         words = self._extract_search_words(query)
         if not words:
             return []
-        conditions = []
-        params = []
-        for w in words:
-            p = f"%{w}%"
-            conditions.append("(fact LIKE ? OR person_name LIKE ?)")
-            params.extend([p, p])
-        where = " OR ".join(conditions)
-        if user_id:
-            where = f"user_id = ? AND ({where})"
-            params.insert(0, user_id)
-        params.append(limit)
+        sql, params = self._search_sql("facts", words, limit, "user_id", user_id)
         with self._conn() as conn:
-            rows = conn.execute(
-                f"SELECT * FROM facts WHERE {where} ORDER BY timestamp DESC LIMIT ?",
-                params,
-            ).fetchall()
+            rows = conn.execute(sql, params).fetchall()
         return [dict(r) for r in rows]
 
+    # ═══════════════════════════════════════════════════════════
+    # Búsqueda semántica (embeddings)
+    # ═══════════════════════════════════════════════════════════
+
+    @staticmethod
+    def _document_text(person_name: str | None, title: str | None, content: str) -> str:
+        return " ".join(p for p in (person_name, title, content[:EMBED_MAX_CHARS]) if p)
+
+    def _embed_rows(self, source: str, rows: list[tuple[int, str | None, str]]) -> int:
+        """Calcula y guarda vectores para `rows` = [(id, user_id, texto)]. Best-effort."""
+        if self._embedder is None or not rows:
+            return 0
+        stored = 0
+        for i in range(0, len(rows), EMBED_BATCH):
+            batch = rows[i:i + EMBED_BATCH]
+            try:
+                vectors = self._embedder.embed([text for _, _, text in batch])
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudieron calcular embeddings ({self._embedder.name}): {e}")
+                return stored
+            with self._conn() as conn:
+                conn.executemany(
+                    """INSERT OR REPLACE INTO embeddings (source, source_id, model, user_id, dim, vector)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    [
+                        (source, row_id, self._embedder.name, user_id, vec.shape[0],
+                         vec.astype(np.float32).tobytes())
+                        for (row_id, user_id, _), vec in zip(batch, vectors)
+                    ],
+                )
+            stored += len(batch)
+            with self._vectors_lock:
+                self._vectors_version += 1
+        return stored
+
+    def reindex_embeddings(self, limit: int | None = None) -> int:
+        """Calcula los vectores que falten (BD previa o embedder nuevo). Devuelve cuántos."""
+        if self._embedder is None:
+            return 0
+        model = self._embedder.name
+        lim = -1 if limit is None else limit
+        with self._conn() as conn:
+            docs = conn.execute(
+                """SELECT id, user_id, person_name, title, substr(kb_text(content), 1, ?) AS content
+                   FROM documents d
+                   WHERE NOT EXISTS (SELECT 1 FROM embeddings e
+                                     WHERE e.source = 'documents' AND e.source_id = d.id AND e.model = ?)
+                   LIMIT ?""",
+                (EMBED_MAX_CHARS, model, lim),
+            ).fetchall()
+            facts = conn.execute(
+                """SELECT id, user_id, person_name, fact FROM facts f
+                   WHERE NOT EXISTS (SELECT 1 FROM embeddings e
+                                     WHERE e.source = 'facts' AND e.source_id = f.id AND e.model = ?)
+                   LIMIT ?""",
+                (model, lim),
+            ).fetchall()
+        done = self._embed_rows(
+            "documents",
+            [(r["id"], r["user_id"], self._document_text(r["person_name"], r["title"], r["content"])) for r in docs],
+        )
+        done += self._embed_rows(
+            "facts", [(r["id"], r["user_id"], f"{r['person_name']}: {r['fact']}") for r in facts],
+        )
+        if done:
+            logger.info(f"🧭 {done} embeddings calculados ({model})")
+        return done
+
+    def vector_matrix(self) -> dict | None:
+        """
+        Todos los vectores del modelo actual en una matriz, recargada solo
+        cuando se guardan vectores nuevos. Los de filas borradas pueden quedar
+        hasta la recarga; quien la usa descarta los ids que ya no existen.
+        """
+        cached = self._vectors
+        if cached is not None and cached["version"] == self._vectors_version:
+            return cached
+        with self._vectors_lock:
+            version = self._vectors_version
+            if self._vectors is not None and self._vectors["version"] == version:
+                return self._vectors
+            with self._conn() as conn:
+                rows = conn.execute(
+                    "SELECT source, source_id, user_id, vector FROM embeddings WHERE model = ?",
+                    (self._embedder.name,),
+                ).fetchall()
+            if rows:
+                matrix = np.frombuffer(b"".join(r["vector"] for r in rows), dtype=np.float32)
+                matrix = matrix.reshape(len(rows), -1)
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            self._vectors = {
+                "version": version,
+                "matrix": matrix,
+                "sources": np.array([r["source"] for r in rows], dtype=object),
+                "ids": np.array([r["source_id"] for r in rows], dtype=np.int64),
+                "users": np.array([r["user_id"] for r in rows], dtype=object),
+            }
+            return self._vectors
+
+    def _semantic_ranking(
+        self, query_vec, source: str, limit: int, user_id: str | None = None,
+        min_score: float = SEMANTIC_MIN_SCORE,
+    ) -> list[tuple[int, float]]:
+        """[(id, similitud)] de `source`, de mayor a menor, con top-k por argpartition."""
+        vectors = self.vector_matrix()
+        if vectors is None or not len(vectors["ids"]):
+            return []
+        mask = vectors["sources"] == source
+        if user_id:
+            mask &= vectors["users"] == user_id
+        idx = np.flatnonzero(mask)
+        if not len(idx):
+            return []
+        scores = vectors["matrix"][idx] @ query_vec
+        k = min(limit, len(idx))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(vectors["ids"][idx[i]]), float(scores[i])) for i in top if scores[i] >= min_score]
+
+    def embed_query(self, query: str):
+        """Vector del query con el embedder de la KB (None si no hay o si falla)."""
+        if self._embedder is None or not query:
+            return None
+        try:
+            return self._embedder.embed([query])[0]
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo calcular embedding del query: {e}")
+            return None
+
+    @_cached_read("documents", "facts", "embeddings")
+    def semantic_search(
+        self, query: str, limit: int = 10, user_id: str | None = None, source: str = "documents",
+    ) -> list[dict]:
+        """Filas de `source` ("documents" | "facts") más parecidas al query, con `score` coseno."""
+        query_vec = self.embed_query(query)
+        if query_vec is None:
+            return []
+        ranking = self._semantic_ranking(query_vec, source, limit, user_id)
+        rows = self._rows_by_id(source, [row_id for row_id, _ in ranking])
+        return [{**rows[row_id], "score": score} for row_id, score in ranking if row_id in rows]
+
+    def _rows_by_id(self, source: str, ids: list[int], columns: str = "*", conn=None) -> dict[int, dict]:
+        if not ids:
+            return {}
+        sql = f"SELECT {columns} FROM {source} WHERE id IN ({', '.join('?' * len(ids))})"
+        from_row = self._doc_from_row if source == "documents" else dict
+        if conn is not None:
+            return {r["id"]: from_row(r) for r in conn.execute(sql, ids)}
+        with self._conn() as conn:
+            return {r["id"]: from_row(r) for r in conn.execute(sql, ids)}
+
+    @staticmethod
+    def _rrf(rankings: list[list[int]], limit: int) -> list[tuple[int, float]]:
+        """Reciprocal Rank Fusion: suma de 1/(k + rango) de cada lista."""
+        scores: dict[int, float] = {}
+        for ranking in rankings:
+            for rank, row_id in enumerate(ranking):
+                scores[row_id] = scores.get(row_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        return sorted(scores.items(), key=lambda kv: -kv[1])[:limit]
+
+    def _hybrid_ids(
+        self, conn, source: str, words: list[str], query_vec, limit: int, user_id: str | None,
+        extra_where: str = "",
+    ) -> list[int]:
+        """Ids de `source` fusionando BM25/LIKE y similitud semántica (si hay vector)."""
+        user_col = "user_id"
+        rankings = []
+        if words:
+            sql, params = self._search_sql(
+                source, words, limit * 2, user_col, user_id, columns="t.id", extra_where=extra_where,
+            )
+            rankings.append([r[0] for r in conn.execute(sql, params)])
+        if query_vec is not None:
+            semantic = [row_id for row_id, _ in self._semantic_ranking(query_vec, source, limit * 4, user_id)]
+            if extra_where and semantic:
+                # Aplicar el mismo filtro (p. ej. doc_type) a los candidatos semánticos
+                keep = {r[0] for r in conn.execute(
+                    f"SELECT t.id FROM {source} t WHERE t.id IN ({', '.join('?' * len(semantic))})"
+                    f" AND {extra_where}", semantic,
+                )}
+                semantic = [i for i in semantic if i in keep]
+            rankings.append(semantic[:limit * 2])
+        return [row_id for row_id, _ in self._rrf(rankings, limit)]
+
+    @_cached_read("documents", "facts", "embeddings")
+    def hybrid_search(
+        self, query: str, limit: int = 10, user_id: str | None = None, source: str = "documents",
+    ) -> list[dict]:
+        """
+        Búsqueda híbrida: fusiona (RRF) el ranking por palabras (BM25) con el
+        semántico. Sin embedder equivale a la búsqueda por palabras.
+        """
+        words = self._extract_search_words(query)
+        query_vec = self.embed_query(query)
+        with self._conn() as conn:
+            ids = self._hybrid_ids(conn, source, words, query_vec, limit, user_id)
+            rows = self._rows_by_id(source, ids, conn=conn)
+        return [rows[i] for i in ids if i in rows]
+
     # ═══════════════════════════════════════════════════════════
     # Contexto para LLM — construye resumen de conocimiento
     # ═══════════════════════════════════════════════════════════
 
+    @_cached_read("documents", "people", "facts", "embeddings")
     def build_knowledge_context(self, query: str | None = None, person_name: str | None = None, user_id: str | None = None) -> str:
         """
         Construye un bloque de texto con conocimiento relevante para inyectar al LLM.
         Se usa como contexto adicional en el system prompt.
         Cuando se proporciona user_id, solo devuelve conocimiento de ese usuario.
+
+        Todas las lecturas corren en una sola transacción (snapshot consistente,
+        una conexión), con el filtro de usuario en el SQL y trayendo solo
+        el fragmento (passage) más relevante de cada CV en vez de su texto completo.
+        La persona pedida sale de su ficha precomputada (person_cards): una
+        lectura por índice en vez de perfil + hechos + evaluaciones. Las
+        personas mencionadas por nombre o alias en el query (gazetteer) se
+        leen igual, por id.
         """
         parts = []
+        words = self._extract_search_words(query) if query else []
+        # El embedding del query y las menciones se calculan antes de abrir la transacción
+        query_vec = self.embed_query(query) if query else None
+        mentioned = self.mentioned_person_ids(query) if query else []
+
+        with self.read_transaction() as conn:
+            # Si se pregunta por una persona específica: su ficha ya armada
+            cards = []
+            if person_name:
+                card = self._person_card(conn, person_name, user_id)
+                if card:
+                    cards.append(card)
+            shown = {c["person_id"] for c in cards}
+            for person_id in [i for i in mentioned if i not in shown][:CONTEXT_MAX_MENTIONS]:
+                card = self._person_card(conn, user_id=user_id, person_id=person_id)
+                if card:
+                    cards.append(card)
+                    shown.add(person_id)
+            parts.extend(c["card"] for c in cards)
+            # Sus hechos ya van en la ficha: no repetirlos en "Datos relevantes"
+            shown_names = {c["name"].lower() for c in cards}
 
-        # Si se pregunta por una persona específica
-        if person_name:
-            person = self.get_person(person_name)
-            if person and (not user_id or person.get("added_by") == user_id):
-                parts.append(self._format_person(person))
-                # Agregar hechos
-                facts = self.get_facts(person_name)
-                if user_id:
-                    facts = [f for f in facts if f.get("user_id") == user_id]
-                if facts:
-                    facts_text = "\n".join(f"  - {f['fact']}" for f in facts[:15])
-                    parts.append(f"Datos adicionales sobre {person_name}:\n{facts_text}")
-                # Agregar documentos/CVs
-                docs = self.get_documents_by_person(person_name)
-                if user_id:
-                    docs = [d for d in docs if d.get("user_id") == user_id]
-                for doc in docs[:3]:
-                    if doc["doc_type"] == "cv" and doc.get("evaluation"):
-                        parts.append(f"Evaluación de CV de {person_name}:\n{doc['evaluation'][:1500]}")
-
-        # Búsqueda general
-        if query:
-            # Buscar personas relevantes
-            people = self.search_people(query, limit=5, user_id=user_id)
-            for p in people:
-                if not person_name or p["name"].lower() != person_name.lower():
-                    parts.append(self._format_person(p))
-            # Buscar hechos relevantes
-            facts = self.search_facts(query, limit=10, user_id=user_id)
-            if facts:
+            # Búsqueda general
+            if words:
+                # Buscar personas relevantes
+                sql, params = self._search_sql("people", words, 5, "added_by", user_id, columns="t.id, t.name")
+                found = [p for p in conn.execute(sql, params) if p["id"] not in shown]
+                profiles = dict(conn.execute(
+                    f"SELECT person_id, profile FROM person_cards WHERE scope = '*' "
+                    f"AND person_id IN ({', '.join('?' * len(found))})",
+                    [p["id"] for p in found],
+                ).fetchall()) if found else {}
+                for p in found:
+                    if p["id"] in profiles:
+                        parts.append(profiles[p["id"]])
+                    else:
+                        row = conn.execute("SELECT * FROM people WHERE id = ?", (p["id"],)).fetchone()
+                        parts.append(self._format_person(self._person_from_row(row)))
+            if words or query_vec is not None:
+                # Buscar hechos relevantes (palabras + semántica)
+                fact_ids = self._hybrid_ids(conn, "facts", words, query_vec, 10, user_id)
+                fact_rows = self._rows_by_id("facts", fact_ids, "id, person_name, fact", conn=conn)
                 seen = set()
                 fact_lines = []
-                for f in facts:
+                for f in (fact_rows[i] for i in fact_ids if i in fact_rows):
+                    if (f["person_name"] or "").lower() in shown_names:
+                        continue
                     key = (f["person_name"], f["fact"])
                     if key not in seen:
                         seen.add(key)
                         fact_lines.append(f"  - {f['person_name']}: {f['fact']}")
                 if fact_lines:
                     parts.append("Datos relevantes:\n" + "\n".join(fact_lines))
-            # Buscar documentos relevantes
-            docs = self.search_documents(query, limit=5, user_id=user_id)
-            for doc in docs:
-                if doc["doc_type"] == "cv":
-                    snippet = doc["content"][:500]
-                    parts.append(f"CV guardado ({doc.get('person_name', 'sin nombre')}): {snippet}...")
+                # Buscar CVs relevantes (solo el fragmento inicial del contenido)
+                doc_ids = self._hybrid_ids(
+                    conn, "documents", words, query_vec, 5, user_id, extra_where="t.doc_type = 'cv'",
+                )
+                doc_rows = self._rows_by_id("documents", doc_ids, "id, person_name", conn=conn)
+                passages = self._best_passages(conn, doc_ids, words)
+                for doc in (doc_rows[i] for i in doc_ids if i in doc_rows):
+                    snippet = passages.get(doc["id"], "")
+                    parts.append(f"CV guardado ({doc['person_name'] or 'sin nombre'}): {snippet}...")
 
         if not parts:
             return ""
 
         return "[CONOCIMIENTO ALMACENADO EN BASE DE DATOS]:\n" + "\n---\n".join(parts)
 
-    def _format_person(self, person: dict) -> str:
+    # ─── Fichas de persona (person_cards) ─────────────────────
+
+    @classmethod
+    def _render_card(cls, conn, person_row, user_id: str | None) -> tuple[str, str]:
+        """(perfil, ficha completa) de una persona: perfil + hechos recientes + evaluaciones de CV."""
+        name = person_row["name"]
+        profile = cls._format_person(cls._person_from_row(person_row))
+        parts = [profile]
+        user_filter = " AND user_id = ?" if user_id else ""
+        user_params = [user_id] if user_id else []
+        facts = conn.execute(
+            "SELECT fact FROM facts WHERE person_name = ? COLLATE NOCASE"
+            f"{user_filter} ORDER BY timestamp DESC LIMIT 15",
+            [name, *user_params],
+        ).fetchall()
+        if facts:
+            facts_text = "\n".join(f"  - {f['fact']}" for f in facts)
+            parts.append(f"Datos adicionales sobre {name}:\n{facts_text}")
+        evals = conn.execute(
+            "SELECT substr(kb_text(evaluation), 1, ?) AS evaluation FROM documents"
+            " WHERE person_name = ? COLLATE NOCASE AND doc_type = 'cv'"
+            f" AND evaluation IS NOT NULL AND evaluation != ''{user_filter}"
+            " ORDER BY timestamp DESC LIMIT 3",
+            [CONTEXT_EVAL_SNIPPET, name, *user_params],
+        ).fetchall()
+        for doc in evals:
+            parts.append(f"Evaluación de CV de {name}:\n{doc['evaluation']}")
+        return profile, "\n---\n".join(parts)
+
+    @classmethod
+    def _refresh_cards(cls, conn, names: list[str | None]):
+        """Rearma (en la transacción de `conn`) las fichas de las personas con esos nombres."""
+        now = time.time()
+        for name in {n.lower(): n for n in names if n}.values():
+            person = conn.execute("SELECT * FROM people WHERE name = ? COLLATE NOCASE", (name,)).fetchone()
+            if person is None:
+                continue
+            conn.execute("DELETE FROM person_cards WHERE person_id = ?", (person["id"],))
+            scopes = ["*"] + ([person["added_by"]] if person["added_by"] else [])
+            for scope in scopes:
+                profile, card = cls._render_card(conn, person, None if scope == "*" else scope)
+                conn.execute(
+                    "INSERT INTO person_cards (person_id, scope, profile, card, tokens, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (person["id"], scope, profile, card, count_tokens(card), now),
+                )
+
+    def _person_card(
+        self, conn, name: str | None = None, user_id: str | None = None, person_id: int | None = None,
+    ) -> dict | None:
+        sql = (
+            "SELECT p.id, p.name, c.card, c.tokens FROM people p "
+            "LEFT JOIN person_cards c ON c.person_id = p.id AND c.scope = ? "
+            + ("WHERE p.id = ?" if person_id is not None else "WHERE p.name = ? COLLATE NOCASE")
+        )
+        params: list = [user_id or "*", person_id if person_id is not None else name]
+        if user_id:
+            sql += " AND p.added_by = ?"
+            params.append(user_id)
+        row = conn.execute(sql, params).fetchone()
+        if row is None:
+            return None
+        if row["card"] is None:
+            # Ficha faltante (no debería pasar): se arma al vuelo sin escribir
+            person = conn.execute("SELECT * FROM people WHERE id = ?", (row["id"],)).fetchone()
+            card = self._render_card(conn, person, user_id)[1]
+            return {"person_id": row["id"], "name": row["name"], "card": card, "tokens": count_tokens(card)}
+        return {"person_id": row["id"], "name": row["name"], "card": row["card"], "tokens": row["tokens"]}
+
+    @_cached_read("documents", "people", "facts")
+    def get_person_card(self, name: str, user_id: str | None = None) -> dict | None:
+        """Ficha de contexto lista para inyectar al LLM: {"person_id", "name", "card", "tokens"}, o None."""
+        with self._conn() as conn:
+            return self._person_card(conn, name, user_id)
+
+    @staticmethod
+    def _format_person(person: dict) -> str:
         lines = [f"Persona: {person['name']}"]
         if person.get("role"): lines.append(f"  Rol: {person['role']}")
         if person.get("level"): lines.append(f"  Nivel: {person['level']}")
@@ -498,10 +1945,25 @@ class KnowledgeBase:
     # Stats
     # ═══════════════════════════════════════════════════════════
 
+    _COUNTERS = {
+        "documents": TableCounter("documents"),
+        "cvs": TableCounter("documents", where="{row}.doc_type = 'cv'"),
+        "people": TableCounter("people"),
+        "facts": TableCounter("facts"),
+        "docs_compressed": TableCounter("documents", where="typeof({row}.content) = 'blob'"),
+        "docs_content_bytes": TableCounter("documents", value="length(CAST({row}.content AS BLOB))"),
+    }
+
     def get_stats(self) -> dict:
+        """Conteos por tabla (mantenidos por triggers, sin COUNT(*))."""
         with self._conn() as conn:
-            docs = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
-            cvs = conn.execute("SELECT COUNT(*) FROM documents WHERE doc_type = 'cv'").fetchone()[0]
-            people = conn.execute("SELECT COUNT(*) FROM people").fetchone()[0]
-            facts = conn.execute("SELECT COUNT(*) FROM facts").fetchone()[0]
-        return {"documents": docs, "cvs": cvs, "people": people, "facts": facts}
+            return read_counters(conn, list(self._COUNTERS))
+
+    def run_maintenance(self) -> dict:
+        """incremental_vacuum + PRAGMA optimize + wal_checkpoint(TRUNCATE); ver core/db_maintenance.py."""
+        self._last_maintenance = run_maintenance(self._pool, self._db_path, self._COUNTERS)
+        return self._last_maintenance
+
+    def get_maintenance_stats(self) -> dict | None:
+        """Reporte del último mantenimiento (tiempos, bytes recuperados), o None si no ha corrido."""
+        return self._last_maintenance
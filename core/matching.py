@@ -0,0 +1,283 @@
+"""
+matching.py — Ranking vectorizado de candidatos contra una vacante.
+
+Califica a TODAS las personas de la KB de una sola vez (NumPy) combinando:
+
+    skills    — fracción de los skills requeridos que tiene (tabla person_skills)
+    semantic  — similitud coseno entre la vacante y sus CVs / hechos (embeddings)
+    level     — cercanía entre su nivel y el pedido (Junior < Mid < Senior < Lead)
+    recency   — qué tan reciente es su información (vida media de 180 días)
+
+Los componentes que no aplican (vacante sin skills conocidos, sin nivel, KB
+sin embedder) se descartan y los pesos restantes se renormalizan. Solo el
+top-k se manda después al LLM para la evaluación narrativa: O(k) llamadas
+en lugar de una por candidato.
+
+Uso:
+    from core.matching import CandidateRanker
+    ranker = CandidateRanker(kb)
+    shortlist = ranker.rank("Backend Senior con Python, AWS y Docker", top_k=10)
+    for c in shortlist["results"]:
+        print(c["name"], c["score"], c["breakdown"])
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from core.knowledge_db import normalize_skill
+
+if TYPE_CHECKING:
+    from core.knowledge_db import KnowledgeBase
+
+
+DEFAULT_WEIGHTS = {"skills": 0.45, "semantic": 0.30, "level": 0.15, "recency": 0.10}
+RECENCY_HALF_LIFE_DAYS = 180
+UNKNOWN_LEVEL_SCORE = 0.5   # candidato sin nivel registrado: ni premio ni castigo
+
+LEVELS = ("Junior", "Mid", "Senior", "Lead")
+_LEVEL_PATTERNS = [
+    (3, r"\b(?:tech lead|lead|lider|lider tecnico|principal|staff)\b"),
+    (1, r"\b(?:mid|semi ?senior|ssr|intermedio)\b"),
+    (2, r"\b(?:senior|sr)\b"),
+    (0, r"\b(?:junior|jr|trainee|becario|practicante)\b"),
+]
+
+
+@lru_cache(maxsize=512)
+def level_rank(level: str | None) -> int | None:
+    """0..3 para Junior / Mid / Senior / Lead (acepta sinónimos), None si no se reconoce."""
+    if not level:
+        return None
+    text = normalize_skill(level)
+    for rank, pattern in _LEVEL_PATTERNS:
+        if re.search(pattern, text):
+            return rank
+    return None
+
+
+# En la descripción de una vacante "lead" / "staff" suelen nombrar a OTRA
+# persona o al equipo ("reporta al tech lead", "integrarse al staff"): solo
+# cuentan como nivel si califican al puesto.
+_JOB_SENIORITY = [
+    (0, re.compile(r"\b(?:junior|jr|trainee|becario|practicante)\b")),
+    (1, re.compile(r"\b(?:mid|semi ?senior|ssr|intermedio)\b")),
+    (2, re.compile(r"\b(?:senior|sr)\b")),
+]
+_JOB_LEAD = re.compile(
+    r"\b(?:tech lead|team lead|lider tecnico|lider de equipo|lead|lider"
+    r"|(?:staff|principal) (?:engineer|developer|ingeniero|desarrollador)"
+    r"|(?:ingeniero|desarrollador) principal)\b"
+)
+# Palabra previa que convierte la mención en un tercero: "al lead", "del líder", "the lead"
+_NOT_ROLE_PREFIX = {
+    "al", "del", "el", "la", "los", "las", "un", "una", "su", "sus", "nuestro", "nuestra",
+    "de", "con", "para", "por", "a", "ante", "hacia", "tu", "the", "an", "our", "your",
+    "to", "with", "of", "for", "by",
+}
+
+
+@lru_cache(maxsize=512)
+def job_level(job_text: str | None) -> int | None:
+    """
+    Nivel que pide una vacante (0..3), None si no lo dice.
+    Manda la seniority explícita (junior / mid / senior); si menciona varias,
+    la más baja. "Lead" / "staff" solo cuentan si califican al puesto.
+    """
+    if not job_text:
+        return None
+    text = normalize_skill(job_text)
+    explicit = [rank for rank, pattern in _JOB_SENIORITY if pattern.search(text)]
+    if explicit:
+        return min(explicit)
+    for match in _JOB_LEAD.finditer(text):
+        previous = text[:match.start()].split()[-1:]
+        if not previous or previous[0].strip(",.;:()") not in _NOT_ROLE_PREFIX:
+            return 3
+    return None
+
+
+def _ngrams(text: str, n_max: int = 3) -> set[str]:
+    tokens = [t.rstrip(".") for t in re.findall(r"[\w+#.]+", normalize_skill(text))]
+    tokens = [t for t in tokens if t]
+    return {
+        " ".join(tokens[i:i + n])
+        for n in range(1, n_max + 1)
+        for i in range(len(tokens) - n + 1)
+    }
+
+
+class CandidateRanker:
+    """Rankea personas de la KB contra la descripción de una vacante."""
+
+    def __init__(self, knowledge_base: KnowledgeBase, weights: dict | None = None):
+        self.kb = knowledge_base
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+
+    # ─── Vacante ──────────────────────────────────────────────
+
+    def parse_job(self, job_text: str) -> dict:
+        """Skills (del vocabulario de la KB) y nivel mencionados en la vacante."""
+        with self.kb.read_transaction() as conn:
+            vocab = {r[0] for r in conn.execute("SELECT DISTINCT skill_norm FROM person_skills")}
+        return {
+            "skills": sorted(_ngrams(job_text) & vocab),
+            "level": job_level(job_text),
+        }
+
+    # ─── Ranking ──────────────────────────────────────────────
+
+    def rank(
+        self,
+        job_text: str = "",
+        skills: list[str] | str | None = None,
+        level: str | None = None,
+        user_id: str | None = None,
+        top_k: int = 10,
+    ) -> dict:
+        """
+        Califica a todos los candidatos y devuelve los `top_k` mejores.
+
+        Args:
+            job_text: Descripción de la vacante (para skills, nivel y similitud semántica).
+            skills / level: Requisitos explícitos; si no se dan se infieren de `job_text`.
+            user_id: Solo personas registradas por este usuario.
+
+        Returns:
+            {"job": {"skills", "level"}, "weights": {...}, "total_candidates": n,
+             "results": [{"person_id", "name", "role", "level", "score",
+                          "breakdown": {componente: 0..1}, "matched_skills", "missing_skills"}]}
+        """
+        parsed = self.parse_job(job_text) if job_text else {"skills": [], "level": None}
+        required = self.kb.normalize_skills(skills) or parsed["skills"]
+        target = level_rank(level) if level else parsed["level"]
+        query_vec = self.kb.embed_query(job_text) if job_text else None
+
+        people, pairs, doc_links = self._load(required, user_id, with_docs=query_vec is not None)
+        n = len(people["ids"])
+        job = {"skills": required, "level": LEVELS[target] if target is not None else None}
+        if not n:
+            return {"job": job, "weights": {}, "total_candidates": 0, "results": []}
+
+        components: dict[str, np.ndarray] = {}
+        if required:
+            overlap = np.bincount(pairs["rows"], minlength=n)
+            components["skills"] = overlap / len(required)
+        if target is not None:
+            ranks = people["levels"]
+            known = ranks >= 0
+            components["level"] = np.where(known, 1.0 - np.abs(ranks - target) / 3.0, UNKNOWN_LEVEL_SCORE)
+        if query_vec is not None and doc_links is not None:
+            components["semantic"] = self._semantic_scores(query_vec, doc_links, n)
+        age_days = np.maximum(time.time() - people["updated_at"], 0) / 86400
+        components["recency"] = 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+
+        total_weight = sum(self.weights[c] for c in components)
+        weights = {c: self.weights[c] / total_weight for c in components}
+        scores = sum(weights[c] * components[c] for c in components)
+
+        k = min(top_k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        results = []
+        for i in top:
+            matched = sorted(pairs["skills"][pairs["rows"] == i]) if required else []
+            results.append({
+                "person_id": int(people["ids"][i]),
+                "name": people["names"][i],
+                "role": people["roles"][i],
+                "level": people["level_labels"][i],
+                "score": round(float(scores[i]), 4),
+                "breakdown": {c: round(float(v[i]), 4) for c, v in components.items()},
+                "matched_skills": matched,
+                "missing_skills": [s for s in required if s not in matched],
+            })
+        return {
+            "job": job,
+            "weights": {c: round(w, 3) for c, w in weights.items()},
+            "total_candidates": n,
+            "results": results,
+        }
+
+    def _load(self, required: list[str], user_id: str | None, with_docs: bool):
+        """Personas, pares (persona, skill requerido) y vínculos documento/hecho → persona, en una lectura."""
+        where = " WHERE added_by = ?" if user_id else ""
+        params = [user_id] if user_id else []
+        with self.kb.read_transaction() as conn:
+            rows = conn.execute(
+                f"SELECT id, name, role, level, updated_at FROM people{where} ORDER BY id", params,
+            ).fetchall()
+            skill_rows = conn.execute(
+                f"SELECT s.person_id, s.skill_norm FROM person_skills s "
+                f"JOIN people p ON p.id = s.person_id "
+                f"WHERE s.skill_norm IN ({', '.join('?' * len(required))})"
+                f"{' AND p.added_by = ?' if user_id else ''}",
+                [*required, *params],
+            ).fetchall() if required and rows else []
+            links = None
+            if with_docs and rows:
+                links = {
+                    source: conn.execute(
+                        f"SELECT t.id, p.id FROM {source} t "
+                        f"JOIN people p ON p.name = t.person_name COLLATE NOCASE"
+                        f"{' WHERE p.added_by = ?' if user_id else ''}",
+                        params,
+                    ).fetchall()
+                    for source in ("documents", "facts")
+                }
+
+        ids = np.array([r["id"] for r in rows], dtype=np.int64)
+        people = {
+            "ids": ids,
+            "names": [r["name"] for r in rows],
+            "roles": [r["role"] for r in rows],
+            "level_labels": [r["level"] for r in rows],
+            "levels": np.array([
+                -1 if (rank := level_rank(r["level"])) is None else rank for r in rows
+            ], dtype=np.float64),
+            "updated_at": np.array([r["updated_at"] for r in rows], dtype=np.float64),
+        }
+
+        # id de persona → fila de la matriz (ids ordenados: searchsorted)
+        pairs = {
+            "rows": np.searchsorted(ids, np.array([r[0] for r in skill_rows], dtype=np.int64)),
+            "skills": np.array([r[1] for r in skill_rows], dtype=object),
+        }
+
+        doc_links = None
+        if links is not None:
+            doc_links = {
+                source: (
+                    np.array([r[0] for r in found], dtype=np.int64),
+                    np.searchsorted(ids, np.array([r[1] for r in found], dtype=np.int64)),
+                )
+                for source, found in links.items()
+            }
+        return people, pairs, doc_links
+
+    def _semantic_scores(self, query_vec, doc_links: dict, n: int) -> np.ndarray:
+        """Por persona, la mayor similitud coseno de la vacante con sus CVs y hechos."""
+        best = np.zeros(n, dtype=np.float64)
+        vectors = self.kb.vector_matrix()
+        if vectors is None or not len(vectors["ids"]):
+            return best
+        for source, (linked_ids, linked_rows) in doc_links.items():
+            if not len(linked_ids):
+                continue
+            mask = vectors["sources"] == source
+            vec_ids = vectors["ids"][mask]
+            order = np.argsort(linked_ids)
+            pos = np.searchsorted(linked_ids, vec_ids, sorter=order)
+            pos = np.minimum(pos, len(linked_ids) - 1)
+            hit = linked_ids[order[pos]] == vec_ids
+            if not hit.any():
+                continue
+            sims = vectors["matrix"][mask][hit] @ query_vec
+            np.maximum.at(best, linked_rows[order[pos[hit]]], np.clip(sims, 0.0, 1.0))
+        return best
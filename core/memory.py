@@ -91,8 +91,19 @@ class MemorySystem:
             "vocabulario_usuario": {},
             "max_items": 20,
         }
+        # Generación de escritura por usuario ("" = buckets globales):
+        # los cachés de contexto la comparan para saber si siguen vigentes.
+        self._generations: dict[str, int] = {}
         self.load_memory()
 
+    def generation(self, user_id=None) -> int:
+        """Contador de escrituras de vocabulario/estilo/temas del usuario."""
+        return self._generations.get(user_id or "", 0)
+
+    def _bump(self, user_id=None):
+        key = user_id or ""
+        self._generations[key] = self._generations.get(key, 0) + 1
+
     def load_memory(self):
         try:
             if self.memory_file.exists():
@@ -180,6 +191,8 @@ class MemorySystem:
                 self.memory[bucket] = {}
                 changed = True
         if changed:
+            self._bump(user_id)
+            self._bump()
             self.save_memory()
 
     def get_temas_frecuentes(self, user_id=None, top_n: int = 10) -> list:
@@ -251,4 +264,5 @@ class MemorySystem:
             self.memory["estilo_usuario"] = _trim(estilo_bucket, 50)
             self.memory["temas_usuario"] = _trim(temas_bucket, 80)
 
+        self._bump(user_id)
         self.save_memory()
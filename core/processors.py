@@ -77,6 +77,13 @@ class VisionProcessor:
         """Extrae texto de media base64. Detecta PDF vs imagen automáticamente."""
         try:
             raw = base64.b64decode(b64_data)
+        except Exception as e:
+            return f"❌ Error OCR: {e}"
+        return self.extract_text_from_bytes(raw, mimetype)
+
+    def extract_text_from_bytes(self, raw: bytes, mimetype: str | None = None) -> str:
+        """Extrae texto de media en bytes (PDF con PyPDF2, imagen con Tesseract)."""
+        try:
             is_pdf = (
                 (mimetype and "pdf" in mimetype.lower())
                 or raw[:5] == b"%PDF-"
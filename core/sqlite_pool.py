@@ -0,0 +1,156 @@
+"""
+sqlite_pool.py — Conexiones SQLite reutilizables para las bases locales.
+
+ConversationDB y KnowledgeBase abrían una conexión nueva en cada llamada
+(y nunca la cerraban). Este pool mantiene conexiones vivas entre llamadas:
+
+    • Los PRAGMA (WAL, busy_timeout) se aplican UNA vez por conexión.
+    • Cada conexión conserva su caché de sentencias preparadas
+      (`cached_statements`), que ahora sí se reutiliza entre requests.
+    • Las conexiones se prestan a un hilo a la vez y regresan al pool
+      al salir del bloque `with`, así que los hilos efímeros de Flask
+      no dejan descriptores abiertos.
+    • Dentro de un mismo hilo el préstamo es reentrante: un método que ya
+      tiene conexión y llama a otro reutiliza la misma (sin auto-bloquearse).
+
+Uso:
+    pool = SQLitePool("data/conversaciones.db")
+    with pool.connection() as conn:     # commit al salir, rollback si hay error
+        conn.execute("INSERT ...")
+    with pool.read_transaction() as conn:   # varias lecturas sobre la misma foto
+        conn.execute("SELECT ...")
+    pool.close()                        # cierra todas las conexiones ociosas
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+
+class SQLitePool:
+    """Pool de conexiones SQLite con PRAGMAs aplicados una sola vez."""
+
+    def __init__(
+        self,
+        db_path: str,
+        max_idle: int = 8,
+        row_factory: Callable | None = None,
+        busy_timeout_ms: int = 5000,
+        cached_statements: int = 256,
+        on_connect: Callable[[sqlite3.Connection], None] | None = None,
+    ):
+        """
+        Args:
+            on_connect: Se llama con cada conexión nueva (p. ej. para registrar
+                        funciones SQL que usan los triggers de la BD).
+        """
+        self._db_path = db_path
+        self._max_idle = max_idle
+        self._row_factory = row_factory
+        self._busy_timeout_ms = busy_timeout_ms
+        self._cached_statements = cached_statements
+        self._on_connect = on_connect
+
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+        self._created = 0
+
+        # journal_mode=WAL es persistente en el archivo: basta con fijarlo una vez
+        conn = self._create()
+        conn.execute("PRAGMA journal_mode=WAL")
+        self._release(conn)
+
+    # ─── Ciclo de vida de conexiones ──────────────────────────
+
+    def _create(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._db_path,
+            check_same_thread=False,  # se presta a un hilo a la vez
+            cached_statements=self._cached_statements,
+        )
+        conn.execute(f"PRAGMA busy_timeout={int(self._busy_timeout_ms)}")
+        if self._row_factory is not None:
+            conn.row_factory = self._row_factory
+        if self._on_connect is not None:
+            self._on_connect(conn)
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("El pool de SQLite ya fue cerrado")
+            if self._idle:
+                return self._idle.pop()  # LIFO: la conexión más "caliente"
+        return self._create()
+
+    def _release(self, conn: sqlite3.Connection):
+        with self._lock:
+            if not self._closed and len(self._idle) < self._max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Presta una conexión para un bloque `with`.
+        Hace commit al salir (rollback si hubo excepción) y la devuelve al pool.
+        Si el hilo ya tiene una conexión prestada, reutiliza esa misma y deja
+        el commit al bloque externo.
+        """
+        current = getattr(self._local, "conn", None)
+        if current is not None:
+            yield current
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            with conn:  # commit / rollback
+                yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    @contextmanager
+    def read_transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Como `connection()`, pero abre la transacción de entrada para que
+        todas las lecturas del bloque vean la misma foto de la BD (en WAL
+        las escrituras concurrentes no se cuelan entre un SELECT y otro).
+        Si el bloque externo ya tiene una transacción abierta, se usa esa.
+        """
+        with self.connection() as conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            yield conn
+
+    def close(self):
+        """Cierra todas las conexiones ociosas. Las prestadas se cierran al devolverse."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "created": self._created,
+                "closed": self._closed,
+            }
@@ -0,0 +1,215 @@
+"""
+token_budget.py — Conteo de tokens y recorte de contexto por presupuesto.
+
+Reemplaza el recorte por caracteres (24000 chars) de Groq/Mistral por un
+presupuesto en tokens reales (tiktoken) con prioridades:
+
+    1. Personalidad + conocimiento (primer mensaje system)  — siempre, con tope
+    2. Mensaje actual del usuario (último mensaje)           — siempre
+    3. Resúmenes de conversaciones anteriores (otros system) — si caben
+    4. Historial reciente, del más nuevo al más viejo        — hasta llenar
+
+Los conteos por texto se cachean, y el recorte es lineal: cada mensaje se
+cuenta una sola vez en lugar de re-sumar todo el historial en cada pop.
+
+tiktoken no trae los tokenizers de Llama/Mistral: cada familia de modelos
+se cuenta con el encoding de tiktoken más cercano y un factor calibrado
+(p. ej. Llama 3 ≈ cl100k_base; los Mistral de vocabulario de 32k parten el
+español en ~25% más tokens). Es una estimación (±10%), no el tokenizer
+exacto. Sin tiktoken se cae a ~4 caracteres por token, con el mismo factor.
+
+Uso:
+    from core.token_budget import count_tokens, fit_messages
+    n = count_tokens("hola mundo", provider="groq")
+    trimmed = fit_messages(messages, max_tokens=6000, provider="groq")
+"""
+
+from __future__ import annotations
+
+import math
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # dependencia opcional: se cae a la estimación por caracteres
+    tiktoken = None
+
+
+# Presupuesto de entrada por proveedor (tokens). Groq free tier da 6000 TPM
+# para llama-3.1-8b-instant: pasarse provoca 413 "Request too large".
+PROVIDER_INPUT_TOKENS = {
+    "groq": 6000,
+    "mistral": 6000,
+    "ollama": 8000,
+}
+
+# Encoding de tiktoken por proveedor / modelo
+_DEFAULT_ENCODING = "cl100k_base"
+_MODEL_ENCODINGS = {
+    "gpt-4o": "o200k_base",
+    "gpt-4o-mini": "o200k_base",
+}
+
+# Modelo por defecto de cada proveedor (ver core/ai_clients.py)
+_PROVIDER_MODELS = {
+    "groq": "llama-3.1-8b-instant",
+    "mistral": "mistral-small-latest",
+    "ollama": "llama3.1:8b",
+}
+
+# (fragmento del nombre del modelo, encoding, factor sobre ese encoding);
+# gana la primera coincidencia. Factores medidos sobre texto en español.
+_MODEL_FAMILIES = (
+    ("llama-3", "cl100k_base", 1.0),      # vocab de 128k construido sobre cl100k
+    ("llama3", "cl100k_base", 1.0),
+    ("llama-2", "cl100k_base", 1.3),      # SentencePiece 32k
+    ("llama2", "cl100k_base", 1.3),
+    ("qwen", "cl100k_base", 1.0),
+    ("gemma", "cl100k_base", 0.95),
+    ("mixtral", "cl100k_base", 1.25),     # SentencePiece 32k
+    ("mistral-7b", "cl100k_base", 1.25),
+    ("open-mistral-7b", "cl100k_base", 1.25),
+    ("mistral", "cl100k_base", 1.05),     # Tekken (131k): small / large / nemo
+    ("ministral", "cl100k_base", 1.05),
+    ("pixtral", "cl100k_base", 1.05),
+)
+
+# Tokens extra por mensaje (rol + separadores del chat template)
+MESSAGE_OVERHEAD = 4
+
+# Fracción máxima del presupuesto que puede ocupar el primer system prompt
+SYSTEM_SHARE = 0.6
+
+_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=64)
+def _tokenizer_profile(provider: str | None = None, model: str | None = None) -> tuple[str, float]:
+    """(encoding de tiktoken, factor de calibración) para el proveedor / modelo."""
+    model = model or _PROVIDER_MODELS.get(provider or "")
+    if not model:
+        return _DEFAULT_ENCODING, 1.0
+    if model in _MODEL_ENCODINGS:
+        return _MODEL_ENCODINGS[model], 1.0
+    name = model.lower()
+    for fragment, encoding, factor in _MODEL_FAMILIES:
+        if fragment in name:
+            return encoding, factor
+    return _DEFAULT_ENCODING, 1.0
+
+
+def _encoding_name(provider: str | None = None, model: str | None = None) -> str:
+    return _tokenizer_profile(provider, model)[0]
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(name: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=8192)
+def _count_cached(encoding_name: str, text: str) -> int:
+    enc = _get_encoding(encoding_name)
+    if enc is None:
+        return len(text) // _CHARS_PER_TOKEN + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str, provider: str | None = None, model: str | None = None) -> int:
+    """Tokens de un texto para el proveedor/modelo (cacheado por texto)."""
+    if not text:
+        return 0
+    encoding, factor = _tokenizer_profile(provider, model)
+    raw = _count_cached(encoding, text)
+    return raw if factor == 1.0 else math.ceil(raw * factor)
+
+
+def truncate_to_tokens(
+    text: str, max_tokens: int, provider: str | None = None, model: str | None = None,
+) -> str:
+    """Recorta `text` para que no rebase `max_tokens` (conserva el inicio)."""
+    if not text or max_tokens <= 0:
+        return ""
+    if count_tokens(text, provider, model) <= max_tokens:
+        return text
+    encoding, factor = _tokenizer_profile(provider, model)
+    budget = int(max_tokens / factor)     # tokens del modelo → tokens del encoding
+    enc = _get_encoding(encoding)
+    if enc is None:
+        return text[: max(budget - 1, 0) * _CHARS_PER_TOKEN]
+    return enc.decode(enc.encode(text, disallowed_special=())[:budget])
+
+
+def _content_text(message: dict) -> str:
+    content = message.get("content", "")
+    return content if isinstance(content, str) else str(content)
+
+
+def message_tokens(message: dict, provider: str | None = None, model: str | None = None) -> int:
+    return count_tokens(_content_text(message), provider, model) + MESSAGE_OVERHEAD
+
+
+def fit_messages(
+    messages: list[dict],
+    max_tokens: int,
+    provider: str | None = None,
+    model: str | None = None,
+) -> list[dict]:
+    """
+    Devuelve los mensajes que caben en `max_tokens`, por prioridad y en su
+    orden original. Ver prioridades en el docstring del módulo.
+    """
+    if not messages:
+        return messages
+    costs = [message_tokens(m, provider, model) for m in messages]
+    if sum(costs) <= max_tokens:
+        return messages
+
+    n = len(messages)
+    keep = [False] * n
+    out = list(messages)
+    used = 0
+
+    # 1. Primer system prompt (personalidad + KB), recortado si rebasa su parte
+    first_system = 0 if messages[0].get("role") == "system" else None
+    if first_system is not None:
+        share = int(max_tokens * SYSTEM_SHARE)
+        if costs[0] > share:
+            text = truncate_to_tokens(_content_text(messages[0]), share - MESSAGE_OVERHEAD, provider, model)
+            out[0] = {**messages[0], "content": text}
+            costs[0] = count_tokens(text, provider, model) + MESSAGE_OVERHEAD
+        keep[0] = True
+        used += costs[0]
+
+    # 2. Mensaje actual (el último), siempre; recortado si solo él ya no cabe
+    last = n - 1
+    if not keep[last]:
+        room = max_tokens - used
+        if costs[last] > room:
+            text = truncate_to_tokens(_content_text(messages[last]), room - MESSAGE_OVERHEAD, provider, model)
+            out[last] = {**messages[last], "content": text}
+            costs[last] = count_tokens(text, provider, model) + MESSAGE_OVERHEAD
+        keep[last] = True
+        used += costs[last]
+
+    # 3. Resúmenes / otros system, del más reciente al más viejo
+    for i in range(last - 1, -1, -1):
+        if not keep[i] and messages[i].get("role") == "system" and used + costs[i] <= max_tokens:
+            keep[i] = True
+            used += costs[i]
+
+    # 4. Historial, del más nuevo al más viejo; al primer mensaje que no cabe se corta
+    for i in range(last - 1, -1, -1):
+        if keep[i] or messages[i].get("role") == "system":
+            continue
+        if used + costs[i] > max_tokens:
+            break
+        keep[i] = True
+        used += costs[i]
+
+    return [out[i] for i in range(n) if keep[i]]
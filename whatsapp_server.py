@@ -19,11 +19,14 @@ ENDPOINTS:
         Response: {"status": "ok", "agent": "rAImundoGPT"}
 """
 
+import atexit
+import base64
 import re
 import json
 import os
+import threading
 import time
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import logging
 from pathlib import Path
@@ -91,7 +94,12 @@ from core.agent_logger import AgentLogger
 from core.agent_memory import VectorMemory
 from core.approval import approval_manager
 from core.conversation_db import ConversationDB
-from core.knowledge_db import KnowledgeBase
+from core.knowledge_db import KnowledgeBase, content_hash
+from core.bulk_ingest import start_ingest_job, get_job as get_ingest_job
+from core.cv_batch import BatchCVEvaluator, providers_from_clients, start_evaluation_job, get_job as get_evaluation_job
+from core.matching import CandidateRanker
+from core.db_maintenance import MaintenanceScheduler
+from core.embeddings import get_embedder
 from core.spotify_client import SpotifyClient, detect_spotify_intent
 from core.context_manager import ContextManager
 
@@ -168,7 +176,12 @@ try:
     logger.info(f"   • Modelo Ollama: {config_agente.get('modelos', {}).get('ollama', {}).get('modelo', 'llama3.1:8b')}")
 
     # Inicializar infraestructura agéntica
-    knowledge_base = KnowledgeBase()  # data/conocimiento.db
+    knowledge_base = KnowledgeBase(  # data/conocimiento.db
+        embedder=get_embedder(),
+        # Comprimir CVs / evaluaciones desde N bytes (0 = sin compresión)
+        compress_min_bytes=int(os.getenv("KB_COMPRESS_MIN_BYTES", "0")) or None,
+    )
+    candidate_ranker = CandidateRanker(knowledge_base)
     logger.info("✅ Base de conocimiento inicializada (SQLite)")
 
     # Inicializar Spotify (opcional — solo si hay config)
@@ -188,7 +201,13 @@ try:
     else:
         logger.info("⚠️ Spotify no configurado (agrega SPOTIFY_CLIENT_ID y SPOTIFY_CLIENT_SECRET en el archivo .env)")
 
-    adapter_registry = build_registry(gestor, knowledge_base=knowledge_base, spotify_client=spotify_client)
+    # Evaluación de CVs por lotes (JSON estricto, concurrencia acotada por proveedor)
+    cv_batch_evaluator = BatchCVEvaluator(
+        knowledge_base, providers_from_clients(groq=groq, mistral=mistral, ollama=ollama),
+    )
+    adapter_registry = build_registry(
+        gestor, knowledge_base=knowledge_base, spotify_client=spotify_client, cv_evaluator=cv_batch_evaluator,
+    )
 
     def _ai_chat_for_agent(messages, temperature=0.4, max_tokens=2000):
         """Función de chat para el AgentLoop — Ollama primero, Groq/Mistral como refuerzo."""
@@ -237,9 +256,19 @@ except Exception as e:
 # BASE DE DATOS DE CONVERSACIONES (SQLite persistente)
 # ====================================
 
-conversation_db = ConversationDB()  # data/conversaciones.db — sobrevive reinicios
+# data/conversaciones.db — sobrevive reinicios.
+# write_behind: los inserts de cada turno se agrupan y se escriben fuera del request.
+conversation_db = ConversationDB(write_behind=True)
 logger.info("✅ Base de datos de conversaciones inicializada (SQLite)")
 
+# Búsqueda FTS en historial viejo para el system prompt y el AgentLoop
+context_manager.conversation_db = conversation_db
+agent_loop.conversation_db = conversation_db
+
+# Cerrar las conexiones SQLite del pool al apagar el servidor
+atexit.register(conversation_db.close)
+atexit.register(knowledge_base.close)
+
 # Dict en RAM solo para cosas efímeras (idioma override por sesión)
 conversaciones = {}  # Solo para idioma_override
 
@@ -263,9 +292,50 @@ def get_historial(user_id):
     return conversation_db.get_history(user_id)
 
 
+# La compactación de historial viejo corre en segundo plano, fuera del /chat
+conversation_db.start_background_summaries(_summarize_fn)
+
+# Archivo frío: una vez al día, lo ya resumido y viejo sale de la tabla caliente
+ARCHIVE_INTERVAL_S = 24 * 3600
+
+
+def _archive_loop():
+    while True:
+        try:
+            conversation_db.archive_old_messages()
+        except Exception as e:
+            logger.warning(f"⚠️ Error archivando mensajes viejos: {e}")
+        time.sleep(ARCHIVE_INTERVAL_S)
+
+
+threading.Thread(target=_archive_loop, name="conversation-archiver", daemon=True).start()
+
+# Mantenimiento de las BDs (vacuum incremental, optimize, checkpoint del WAL) en tiempo ocioso
+_ultimo_request = time.time()
+
+
+@app.before_request
+def _marcar_actividad():
+    global _ultimo_request
+    _ultimo_request = time.time()
+
+
+maintenance_scheduler = MaintenanceScheduler(
+    {"conocimiento": knowledge_base.run_maintenance, "conversaciones": conversation_db.run_maintenance},
+    last_activity=lambda: _ultimo_request,
+)
+maintenance_scheduler.start()
+
+# Embeddings faltantes de la KB (BD previa a la búsqueda semántica), fuera del arranque
+threading.Thread(target=knowledge_base.reindex_embeddings, name="kb-embeddings", daemon=True).start()
+# Comprimir en su lugar los documentos previos a KB_COMPRESS_MIN_BYTES
+if os.getenv("KB_COMPRESS_MIN_BYTES", "0") != "0":
+    threading.Thread(target=knowledge_base.compress_documents, name="kb-compress", daemon=True).start()
+
+
 def get_contexto_completo(user_id):
     """Obtiene historial + resúmenes de conversaciones anteriores para el LLM."""
-    return conversation_db.build_context_messages(user_id, summarize_fn=_summarize_fn)
+    return conversation_db.build_context_messages(user_id)
 
 
 def agregar_mensaje(user_id, role, content):
@@ -276,6 +346,7 @@ def agregar_mensaje(user_id, role, content):
 def limpiar_historial(user_id):
     """Limpia el historial de un usuario."""
     conversation_db.clear_history(user_id)
+    context_manager.invalidate(user_id)
 
 def get_tono_usuario(user_id):
     """Devuelve el tono activo para un usuario (per-user override o global)."""
@@ -375,6 +446,7 @@ def _extraer_y_guardar_conocimiento(mensaje: str, respuesta: str, user_id: str):
                     nombres_encontrados.add(nombre)
 
         # Para cada persona detectada, guardar un fact con lo que se dijo
+        facts, personas = [], []
         for nombre in nombres_encontrados:
             # Extraer oraciones que mencionan a esta persona
             oraciones = re.findall(
@@ -384,8 +456,7 @@ def _extraer_y_guardar_conocimiento(mensaje: str, respuesta: str, user_id: str):
             )
             if oraciones:
                 fact = " ".join(o.strip() for o in oraciones[:3])  # Máx 3 oraciones
-                knowledge_base.add_fact(nombre, fact, source="conversacion", user_id=user_id)
-                logger.info(f"📝 Fact guardado sobre {nombre}")
+                facts.append({"person_name": nombre, "fact": fact, "source": "conversacion", "user_id": user_id})
 
                 # Si hay datos estructurales, crear/actualizar persona
                 texto_lower = texto_completo.lower()
@@ -407,7 +478,13 @@ def _extraer_y_guardar_conocimiento(mensaje: str, respuesta: str, user_id: str):
                 if rol_match:
                     person_data["role"] = rol_match.group(1).strip()
 
-                knowledge_base.store_person(**person_data)
+                personas.append(person_data)
+
+        # Una transacción por tabla, aunque el mensaje mencione a varias personas
+        if facts:
+            knowledge_base.add_facts_bulk(facts)
+            knowledge_base.store_people_bulk(personas)
+            logger.info(f"📝 Facts guardados sobre {', '.join(f['person_name'] for f in facts)}")
 
     except Exception as e:
         logger.warning(f"⚠️ Error extrayendo conocimiento: {e}")
@@ -757,7 +834,14 @@ Raymundo cambió automáticamente a **Ollama (local)** y seguirá funcionando si
             tipo_media = media_mimetype or 'desconocido'
             logger.info(f"📎 [{user_name or user_id}] Media adjunta recibida ({tipo_media}), extrayendo texto...")
             try:
-                texto_imagen_extraido = gestor.vision.extract_text_from_base64(image_base64, mimetype=media_mimetype)
+                # El mismo CV/imagen reenviado no se vuelve a procesar con OCR
+                media_hash = content_hash(base64.b64decode(image_base64))
+                doc_existente = knowledge_base.find_document_by_hash(user_id, media_hash)
+                if doc_existente:
+                    texto_imagen_extraido = doc_existente["content"]
+                    logger.info(f"♻️ Media ya procesada (doc_id={doc_existente['id']}), se omite OCR")
+                else:
+                    texto_imagen_extraido = gestor.vision.extract_text_from_base64(image_base64, mimetype=media_mimetype)
                 if texto_imagen_extraido and not texto_imagen_extraido.startswith("❌"):
                     logger.info(f"📝 Texto extraído de imagen: {len(texto_imagen_extraido)} chars")
                     mensaje_limpio = (
@@ -769,14 +853,16 @@ Raymundo cambió automáticamente a **Ollama (local)** y seguirá funcionando si
                     is_pdf = media_mimetype and 'pdf' in media_mimetype.lower()
                     doc_type = 'cv' if is_pdf else 'image'
                     try:
-                        doc_id = knowledge_base.store_document(
-                            user_id=user_id,
-                            doc_type=doc_type,
-                            content=texto_imagen_extraido,
-                            title=f"{'PDF' if is_pdf else 'Imagen'} de {user_name or user_id}",
-                            source="whatsapp",
-                        )
-                        logger.info(f"💾 Imagen guardada en KB (doc_id={doc_id})")
+                        if not doc_existente:
+                            doc_id = knowledge_base.store_document(
+                                user_id=user_id,
+                                doc_type=doc_type,
+                                content=texto_imagen_extraido,
+                                title=f"{'PDF' if is_pdf else 'Imagen'} de {user_name or user_id}",
+                                source="whatsapp",
+                                content_hash=media_hash,
+                            )
+                            logger.info(f"💾 Imagen guardada en KB (doc_id={doc_id})")
                     except Exception as ke:
                         logger.warning(f"⚠️ No se pudo guardar imagen en KB: {ke}")
                 else:
@@ -1073,6 +1159,150 @@ def clear_history(user_id):
             "error": str(e)
         }), 500
 
+@app.route('/conversations/archive', methods=['POST'])
+def archive_conversations():
+    """Archiva (comprimidos) los mensajes ya resumidos más viejos que `retention_days`."""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = conversation_db.archive_old_messages(
+            retention_days=float(data.get('retention_days', 90)),
+            user_id=data.get('user_id'),
+        )
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"❌ Error archivando conversaciones: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/conversations/export', methods=['GET'])
+def export_conversations():
+    """
+    Exporta conversaciones como NDJSON en streaming.
+
+    Query params: user_id (opcional), cursor (para reanudar), limit (registros
+    por página). Si hay más páginas, la última línea es {"type": "cursor", "next": ...}.
+    """
+    try:
+        lines = conversation_db.export_ndjson(
+            user_id=request.args.get('user_id'),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', type=int),
+        )
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/conversations/import', methods=['POST'])
+def import_conversations():
+    """Importa un export NDJSON (cuerpo del request), leído línea por línea."""
+    try:
+        result = conversation_db.import_ndjson(iter(request.stream.readline, b""))
+        logger.info(f"📥 Conversaciones importadas: {result}")
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"❌ Error importando conversaciones: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/conversations/<user_id>/restore', methods=['POST'])
+def restore_conversation(user_id):
+    """Regresa a la tabla activa los mensajes archivados de un usuario."""
+    try:
+        restored = conversation_db.restore_archived(user_id)
+        return jsonify({"user_id": user_id, "restaurados": restored})
+    except Exception as e:
+        logger.error(f"❌ Error restaurando historial archivado: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# ====================================
+# INGESTA MASIVA DE CVs
+# ====================================
+
+@app.route('/kb/ingest', methods=['POST'])
+def start_kb_ingest():
+    """
+    Lanza la ingesta masiva de una carpeta de CVs (PDFs / imágenes) en segundo plano.
+
+    Body JSON: folder, user_id, evaluate (bool, opcional), workers,
+    eval_concurrency (lotes evaluándose a la vez).
+    Regresa el job_id para consultar el avance en GET /kb/ingest/<job_id>.
+    """
+    data = request.get_json(silent=True) or {}
+    folder = data.get('folder', '')
+    user_id = data.get('user_id', '')
+    if not folder or not user_id:
+        return jsonify({"error": "Faltan 'folder' y/o 'user_id'"}), 400
+    if not Path(folder).is_dir():
+        return jsonify({"error": f"No existe la carpeta: {folder}"}), 400
+
+    # Corre en un subproceso (ver core/bulk_ingest.py): con su propio evaluador por lotes
+    job_id = start_ingest_job(
+        folder, knowledge_base, user_id,
+        workers=data.get('workers'),
+        evaluate=bool(data.get('evaluate')),
+        eval_concurrency=int(data.get('eval_concurrency', 2)),
+    )
+    logger.info(f"📥 Ingesta masiva iniciada ({job_id}): {folder} → {user_id}")
+    return jsonify({"job_id": job_id, "status": "running"}), 202
+
+@app.route('/kb/evaluate', methods=['POST'])
+def start_kb_evaluate():
+    """
+    Evalúa CVs ya guardados por lotes (JSON estricto, en paralelo entre proveedores).
+
+    Body JSON: doc_ids (lista) o user_id (sus CVs sin evaluación), limit, context.
+    Regresa el job_id para consultar el avance en GET /kb/evaluate/<job_id>.
+    """
+    data = request.get_json(silent=True) or {}
+    doc_ids = data.get('doc_ids')
+    if not doc_ids:
+        if not data.get('user_id'):
+            return jsonify({"error": "Faltan 'doc_ids' o 'user_id'"}), 400
+        limit = data.get('limit')
+        doc_ids = knowledge_base.pending_cv_ids(data['user_id'], int(limit) if limit else None)
+    if not doc_ids:
+        return jsonify({"error": "No hay CVs pendientes de evaluar"}), 404
+    job_id = start_evaluation_job(cv_batch_evaluator, [int(d) for d in doc_ids], context=data.get('context', ''))
+    logger.info(f"🧾 Evaluación por lotes iniciada ({job_id}): {len(doc_ids)} CVs")
+    return jsonify({"job_id": job_id, "status": "running", "documents": len(doc_ids)}), 202
+
+@app.route('/kb/evaluate/<job_id>', methods=['GET'])
+def kb_evaluate_status(job_id):
+    """Avance (o reporte final) de una evaluación por lotes."""
+    job = get_evaluation_job(job_id)
+    if not job:
+        return jsonify({"error": "Job no encontrado"}), 404
+    return jsonify(job)
+
+@app.route('/kb/rank', methods=['POST'])
+def kb_rank_candidates():
+    """
+    Rankea a todos los candidatos contra una vacante.
+
+    Body JSON: job (descripción), skills (lista, opcional), level, user_id, top_k.
+    """
+    data = request.get_json(silent=True) or {}
+    if not data.get('job') and not data.get('skills'):
+        return jsonify({"error": "Falta 'job' (o 'skills')"}), 400
+    try:
+        ranking = candidate_ranker.rank(
+            data.get('job', ''),
+            skills=data.get('skills'),
+            level=data.get('level'),
+            user_id=data.get('user_id'),
+            top_k=int(data.get('top_k', 10)),
+        )
+        return jsonify(ranking)
+    except Exception as e:
+        logger.error(f"❌ Error rankeando candidatos: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/kb/ingest/<job_id>', methods=['GET'])
+def kb_ingest_status(job_id):
+    """Avance (o reporte final) de una ingesta masiva."""
+    job = get_ingest_job(job_id)
+    if not job:
+        return jsonify({"error": "Job no encontrado"}), 404
+    return jsonify(job)
+
 # ====================================
 # ENDPOINTS AGÉNTICOS
 # ====================================
@@ -1128,8 +1358,25 @@ def stats():
         stats_data['conversaciones'] = {
             "tipo_almacenamiento": "SQLite persistente",
             "db_path": str(conversation_db._db_path),
+            "conteos": conversation_db.get_stats(),
+            "escrituras_pendientes": conversation_db.pending_writes(),
+            "resumenes_en_segundo_plano": conversation_db.get_summary_worker_stats(),
+            "cache_contexto": conversation_db.get_context_cache_stats(),
+            "archivo": conversation_db.get_archive_stats(),
+            "cache_system_prompt": context_manager.get_cache_stats(),
+        }
+        stats_data['base_conocimiento'] = {
+            "conteos": knowledge_base.get_stats(),
+            "cache_consultas": knowledge_base.get_cache_stats(),
+            "evaluacion_cvs": cv_batch_evaluator.get_stats(),
         }
+        stats_data['mantenimiento_bd'] = maintenance_scheduler.get_stats()
         return jsonify(stats_data)
+@app.route('/maintenance/run', methods=['POST'])
+def run_db_maintenance():
+    """Corre ya el mantenimiento de las BDs (sin esperar al programador)."""
+    return jsonify(maintenance_scheduler.run_now())
+
 @app.route('/metrics/reset', methods=['POST'])
 def reset_metrics():
     """Reinicia todas las métricas de tracking"""